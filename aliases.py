@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Aliases
+
+Compiled index of the curve alias xml used by
+:meth:`pet.Log.precondition`.
+
+The xml lists primary mnemonics in priority order, each with its aliases
+in priority order. The index keeps a reverse map from every alias to the
+primaries that list it, so resolving the curves of a log takes one
+dictionary lookup per curve instead of scanning every alias of every
+primary. Indexes are parsed once per file and reused until the file
+modification time changes.
+
+"""
+
+
+import os
+import heapq
+import xml.etree.ElementTree as ET
+
+
+DEFAULT_ALIAS_PATH = os.path.join(os.path.dirname(__file__), 'alias_folder',
+                                  'curve_alias.xml')
+
+# compiled indexes by absolute path, as (mtime, index)
+_indexes = {}
+
+
+class AliasIndex(object):
+    """
+    Reverse alias to primary mnemonic map with priority order.
+
+        Parameters
+        ----------
+        entries : list of tuple
+            (primary, aliases) in priority order. A repeated primary
+            replaces the aliases of the earlier entry and keeps its
+            position.
+
+    """
+
+    def __init__(self, entries):
+        self.aliases = {}
+        for primary, aliases in entries:
+            self.aliases[primary] = list(aliases)
+
+        self.primaries = list(self.aliases.keys())
+
+        ### alias -> [(primary rank, alias rank)] ###
+        self._reverse = {}
+        for primary_rank, primary in enumerate(self.primaries):
+            seen = set()
+            for alias_rank, alias in enumerate(self.aliases[primary]):
+                if alias in seen:
+                    continue
+                seen.add(alias)
+                self._reverse.setdefault(alias, []).append((primary_rank,
+                                                            alias_rank))
+
+    @classmethod
+    def from_xml(cls, path):
+        """
+        Parses an alias xml of LogAliasEntry elements.
+
+        """
+
+        root = ET.parse(path).getroot()
+
+        entries = []
+        for log_alias_entry in root.findall('.//LogAliasEntry'):
+            primary_log = log_alias_entry.find('PrimaryLog').text
+            aliases = [alias.text for alias in log_alias_entry.findall('Alias')]
+            entries.append((primary_log, aliases))
+
+        return cls(entries)
+
+    def primary(self, mnemonic):
+        """
+        Highest priority primary listing mnemonic as an alias, the
+        mnemonic itself if it is a primary, or None.
+
+        """
+
+        if mnemonic in self.aliases:
+            return mnemonic
+
+        ranks = self._reverse.get(mnemonic)
+        if ranks is None:
+            return None
+        return self.primaries[ranks[0][0]]
+
+    def resolve(self, mnemonics):
+        """
+        Renames to apply to a log with curves mnemonics.
+
+            Primaries are visited in priority order and take their
+            highest priority alias present in the log that no earlier
+            primary has taken. A primary created by a rename is present
+            for the primaries after it.
+
+            Parameters
+            ----------
+            mnemonics : list
+                Curve mnemonics of the log.
+
+            Returns
+            -------
+            renames : list of tuple
+                (primary, alias) in the order to apply, i.e.
+                :code:`log[primary] = log[alias]`.
+
+        """
+
+        present = set(mnemonics)
+        candidates = {}
+        pending = []
+
+        def add(mnemonic, after):
+            for primary_rank, alias_rank in self._reverse.get(mnemonic, ()):
+                if primary_rank <= after:
+                    continue
+                if primary_rank not in candidates:
+                    candidates[primary_rank] = []
+                    heapq.heappush(pending, primary_rank)
+                heapq.heappush(candidates[primary_rank],
+                               (alias_rank, mnemonic))
+
+        for mnemonic in present:
+            add(mnemonic, -1)
+
+        renames = []
+        taken = set()
+        while pending:
+            primary_rank = heapq.heappop(pending)
+            options = candidates[primary_rank]
+            while options and options[0][1] in taken:
+                heapq.heappop(options)
+            if not options:
+                continue
+
+            alias = options[0][1]
+            primary = self.primaries[primary_rank]
+            renames.append((primary, alias))
+            taken.add(alias)
+
+            if primary not in present:
+                present.add(primary)
+                add(primary, primary_rank)
+
+        return renames
+
+    def sources(self, mnemonics):
+        """
+        Curve of mnemonics each mnemonic has after applying the renames
+        of :meth:`resolve`, following renames of created primaries.
+
+        """
+
+        sources = {m: m for m in mnemonics}
+        for primary, alias in self.resolve(mnemonics):
+            sources[primary] = sources.get(alias, alias)
+
+        return sources
+
+    def select(self, mnemonics, primaries):
+        """
+        Curves of a log needed for primaries after aliasing.
+
+            The selected curves resolve primaries to the same curves as
+            all of mnemonics, so a log loaded with only them gives the
+            same primaries in :meth:`pet.Log.precondition`.
+
+            Parameters
+            ----------
+            mnemonics : list
+                Curve mnemonics of the log.
+            primaries : list
+                Primary mnemonics, or any other mnemonics, to keep.
+
+            Returns
+            -------
+            selected : list
+                Mnemonics to keep, in the order of mnemonics.
+
+        """
+
+        sources = self.sources(mnemonics)
+        needed = {sources[p] for p in primaries if p in sources}
+        selected = [m for m in mnemonics if m in needed]
+
+        ### aliases taken by other primaries decide between candidates ###
+        kept_sources = self.sources(selected)
+        if any(kept_sources.get(p) != sources.get(p) for p in primaries):
+            renamed = {alias for _, alias in self.resolve(mnemonics)}
+            selected = [m for m in mnemonics if m in needed or m in renamed]
+
+        return selected
+
+
+def load_alias_index(path=None):
+    """
+    Compiled alias index of an alias xml, parsed once and reused until
+    the file modification time changes.
+
+        Parameters
+        ----------
+        path : str or None (default None)
+            Path of the alias xml. None uses
+            alias_folder/curve_alias.xml next to this module.
+
+        Returns
+        -------
+        index : AliasIndex
+
+    """
+
+    if path is None:
+        path = DEFAULT_ALIAS_PATH
+    path = os.path.abspath(path)
+
+    if not os.path.isfile(path):
+        raise ValueError('Could not find alias xml at: %s' % path)
+
+    mtime = os.stat(path).st_mtime_ns
+    cached = _indexes.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    index = AliasIndex.from_xml(path)
+    _indexes[path] = (mtime, index)
+    return index
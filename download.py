@@ -209,7 +209,8 @@ def kgs_download(save_dir = None):
 
     return df
 
-def create_log_inventory_table(save_dir, folder_copy = None):
+def create_log_inventory_table(save_dir, folder_copy = None,
+                               header_only = None):
     """
     Scans all folders and subfolders (recursive scan) for las files,
     and opens them as a :class:`petropy.Log` object. Extracts header
@@ -220,6 +221,13 @@ def create_log_inventory_table(save_dir, folder_copy = None):
     ----------
     save_dir : str
         path to folder for recusive scan
+    folder_copy : str (default None)
+        path to folder to write a copy of each readable log, named by
+        well name, UWI or API
+    header_only : bool (default None)
+        only read each file up to the ~A data section, see
+        :func:`pet.read_las_header`. Defaults to True, or to False when
+        folder_copy is given, as copies need the data.
 
     Returns
     -------
@@ -244,6 +252,12 @@ def create_log_inventory_table(save_dir, folder_copy = None):
         if not os.path.isdir(folder_copy):
             os.makedirs(folder_copy)
 
+    if header_only is None:
+        header_only = folder_copy is None
+
+    if header_only and folder_copy is not None:
+        raise ValueError('folder_copy requires header_only = False.')
+
     error_log = os.path.join(save_dir, 'error_log.txt')
     with open(error_log, 'w') as f:
         f.write('LAS INVENTORY ERROR LOG\n')
@@ -254,7 +268,7 @@ def create_log_inventory_table(save_dir, folder_copy = None):
         for filename in fnmatch.filter(filenames, '*.las'):
             try:
                 las_path = os.path.join(root, filename)
-                log = Log(las_path)
+                log = Log(las_path, header_only = header_only)
 
                 if folder_copy is not None:
 
@@ -267,7 +281,7 @@ def create_log_inventory_table(save_dir, folder_copy = None):
                                 break
 
                     if new_name == '':
-                        new_name = os.path.basename(path)
+                        new_name = os.path.basename(las_path)
 
                     new_name = os.path.join(folder_copy, new_name)
                     log.write(new_name)
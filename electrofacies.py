@@ -16,7 +16,10 @@ def electrofacies(logs, curves=['NPHI', 'RHOB', 'ILD'], n_clusters=6, log_scale=
         if log.well['UWI'] is None:
             raise ValueError('UWI required for log identification.')
 
-        log_df = log.df()
+        # only the clustered curves, so memory-mapped logs read no others
+        columns = [c for c in dict.fromkeys(list(curves) + list(log_scale))
+                   if c in log.keys()]
+        log_df = pd.DataFrame({c: log[c] for c in columns})
         log_df['UWI'] = log.well['UWI'].value
         log_df['DEPTH_INDEX'] = np.arange(0, len(log[0]))
         combined_data.append(log_df)
@@ -57,13 +60,8 @@ def electrofacies(logs, curves=['NPHI', 'RHOB', 'ILD'], n_clusters=6, log_scale=
         depth_index = combined_df.loc[combined_df.UWI == uwi, 'DEPTH_INDEX']
         classes = combined_df.loc[combined_df.UWI == uwi, curve_name]
         
-        if curve_name in log.keys():
-            data = log[curve_name]
-            data[depth_index] = classes
-        else:
-            data = np.empty(len(log[0]))
-            data[:] = np.nan
-            data[depth_index] = classes
-            log.append_curve(curve_name, np.copy(data), descr='Electrofacies')
+        log.append_curves([{'mnemonic': curve_name, 'data': classes,
+                            'descr': 'Electrofacies'}],
+                          depth_index=depth_index)
 
     return logs
@@ -0,0 +1,898 @@
+# -*- coding: utf-8 -*-
+"""
+Fluid
+
+Array implementations of the pressure-volume-temperature correlations
+used by :meth:`pet.Log.fluid_properties`.
+
+The real gas Z factor is solved from the Dranchuk and Abou-Kassem fit
+of the Standing and Katz chart with a Newton iteration on the reduced
+density. Each element leaves the iteration as soon as its own Z factor
+has converged, instead of the whole array iterating until the worst
+element converges. Alternatively the Z factor can be interpolated from
+a precomputed (Tpr, Ppr) table, with elements outside of the table or
+over tolerance solved directly. Both methods report the maximum residual of the Dranchuk
+and Abou-Kassem equation at the returned Z factors.
+
+"""
+
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from lasio import HeaderItem
+
+
+### Dranchuk and Abou-Kassem coefficients ###
+_DAK = [0.3265,
+        -1.07,
+        -0.5339,
+        0.01569,
+        -0.05165,
+        0.5475,
+        -0.7361,
+        0.1844,
+        0.1056,
+        0.6134,
+        0.721]
+
+# default (Tpr, Ppr) range of the lookup table, covering the Standing
+# and Katz chart
+TABLE_TPR = (1.05, 3.0, 0.01)
+TABLE_PPR = (0.2, 15.0, 0.05)
+
+_default_table = None
+
+# defaults of pet.Log.fluid_properties
+DEFAULT_PARAMETERS = {'mast': 67, 'temp_grad': 0.015, 'press_grad': 0.5,
+                      'rws': 0.1, 'rwt': 70, 'rmfs': 0.4, 'rmft': 100,
+                      'gas_grav': 0.67, 'oil_api': 38, 'p_sep': 100,
+                      't_sep': 100, 'yn2': 0, 'yco2': 0, 'yh2s': 0,
+                      'yh20': 0, 'rs': 0, 'lith_grad': 1.03, 'biot': 0.8,
+                      'pr': 0.25, 'z_tol': 1e-5, 'z_max_iter': 50,
+                      'z_table': None}
+
+# output curves as (mnemonic, unit, description)
+OUTPUT_CURVES = [
+    ('PORE_PRESS', 'psi', 'Calculated Pore Pressure'),
+    ('RES_TEMP', 'F', 'Calculated Reservoir Temperature'),
+    ('NES', 'psi', 'Calculated Net Effective Stress'),
+    ('RW', 'ohmm', 'Calculated Resistivity Water'),
+    ('RMF', 'ohmm', 'Calculated Resistivity Mud Filtrate'),
+    ('RHO_HC', 'g/cc', 'Calculated Density of Hydrocarbon'),
+    ('RHO_W', 'g/cc', 'Calculated Density of Water'),
+    ('RHO_MF', 'g/cc', 'Calculated Density of Mud Filtrate'),
+    ('NPHI_HC', 'v/v', 'Calculated Neutron Log Response of Hydrocarbon'),
+    ('NPHI_W', 'v/v', 'Calculated Neutron Log Response of Water'),
+    ('NPHI_MF', 'v/v', 'Calculated Neutron Log Response of Mud Filtrate'),
+    ('MU_HC', 'cP', 'Calculated Viscosity of Hydrocarbon')
+]
+
+_GAS_CURVES = [
+    ('Z', '', 'Calculated Real Gas Z Factor'),
+    ('CG', '1 / psi', 'Calculated Gas Compressibility'),
+    ('BG', '', 'Calculated Gas Formation Volume Factor')
+]
+
+_OIL_CURVES = [
+    ('BO', '', 'Calculated Oil Formation Volume Factor'),
+    ('BP', 'psi', 'Calculated Bubble Point')
+]
+
+
+def _dak_terms(tpr):
+    """
+    Temperature dependent terms of the Dranchuk and Abou-Kassem
+    equation.
+
+    """
+
+    a = _DAK
+    t2 = a[0] * tpr + a[1] + a[2] / (tpr ** 2) + \
+        a[3] / (tpr ** 3) + a[4] / (tpr ** 4)
+
+    t3 = a[5] * tpr + a[6] + a[7] / tpr
+    t4 = -a[8] * (a[6] + a[7] / tpr)
+    t5 = a[9] / (tpr ** 2)
+
+    return t2, t3, t4, t5
+
+
+def _dak_function(r, tpr, ppr, t2, t3, t4, t5):
+    """
+    Dranchuk and Abou-Kassem equation in reduced density and its
+    derivative.
+
+    """
+
+    a10 = _DAK[10]
+    exp = np.exp(-a10 * r ** 2)
+
+    f = r * (tpr + t2 * r + t3 * r ** 2 + t4 * r ** 5 + \
+            t5 * r ** 2 * (1 + a10 * r ** 2) * exp) - 0.27 * ppr
+
+    fp = tpr + 2 * t2 * r + 3 * t3 * r ** 2 + \
+        6 * t4 * r ** 5 + t5 * r ** 2 * exp * \
+        (3 + a10 * r ** 2 * (3 - 2 * a10 * r ** 2))
+
+    return f, fp
+
+
+def _newton(tpr, ppr, z, tol, max_iter):
+    """
+    Newton iteration on reduced density, in place on z. Only elements
+    whose Z factor has not changed by less than tol in the last step are
+    evaluated. Elements with a non finite starting reduced density are
+    set to nan. Returns the number of elements that did not converge.
+
+    """
+
+    r = 0.27 * ppr / tpr / z
+    z[~np.isfinite(r)] = np.nan
+    active = np.flatnonzero(np.isfinite(r))
+    t2, t3, t4, t5 = _dak_terms(tpr[active])
+
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+
+        tpr_a = tpr[active]
+        ppr_a = ppr[active]
+        f, fp = _dak_function(r[active], tpr_a, ppr_a, t2, t3, t4, t5)
+        r_a = r[active] - f / fp
+        z_a = 0.27 * ppr_a / tpr_a / r_a
+
+        ### retire converged elements ###
+        keep = ~(np.abs(z_a - z[active]) <= tol)
+        r[active] = r_a
+        z[active] = z_a
+
+        active = active[keep]
+        t2, t3, t4, t5 = t2[keep], t3[keep], t4[keep], t5[keep]
+
+    return len(active)
+
+
+def z_factor(tpr, ppr, tol=1e-5, max_iter=50, table=None):
+    """
+    Real gas Z factor from the Dranchuk and Abou-Kassem fit of the
+    Standing and Katz chart.
+
+        Parameters
+        ----------
+        tpr : float or array
+            Pseudo reduced temperature.
+        ppr : float or array
+            Pseudo reduced pressure.
+        tol : float (default 1e-5)
+            Convergence tolerance on the change of Z factor between
+            Newton steps, tested for each element independently.
+        max_iter : int (default 50)
+            Maximum number of Newton steps.
+        table : RegularGridInterpolator, bool or None (default None)
+            Lookup table from :func:`z_factor_table`. Z factors inside the
+            table are interpolated instead of iterated. Elements with a
+            relative residual over tol after interpolation are refined
+            with the Newton iteration from the interpolated value, and
+            elements outside of the table are solved from Z = 1. Use
+            True for the default table, built on first use. None solves
+            every element.
+
+        Returns
+        -------
+        z : array
+            Z factor
+        cpr : array
+            Pseudo reduced gas compressibility, gas compressibility is
+            :code:`cpr / ppc`
+        residual : float
+            Maximum absolute residual of the Dranchuk and Abou-Kassem
+            equation at the returned Z factors, relative to
+            :code:`0.27 * ppr`. NaN if there are no finite elements.
+
+    """
+
+    tpr, ppr = np.broadcast_arrays(np.asarray(tpr, dtype=float),
+                                   np.asarray(ppr, dtype=float))
+    shape = tpr.shape
+    tpr = tpr.ravel()
+    ppr = ppr.ravel()
+
+    if table is True:
+        table = default_z_factor_table()
+
+    if table is None:
+        z = np.ones(len(tpr))
+        _newton(tpr, ppr, z, tol, max_iter)
+    else:
+        z = table(np.column_stack((tpr, ppr)))
+        r = 0.27 * ppr / tpr / z
+        f, _ = _dak_function(r, tpr, ppr, *_dak_terms(tpr))
+
+        ### solve elements outside of the table or over tolerance, ###
+        ### starting from the interpolated z where there is one ###
+        solve = np.flatnonzero(~(np.abs(f) <= tol * 0.27 * ppr))
+        if len(solve) > 0:
+            z_solve = np.where(np.isfinite(z[solve]), z[solve], 1.0)
+            _newton(tpr[solve], ppr[solve], z_solve, tol, max_iter)
+            z[solve] = z_solve
+
+    ### residual and compressibility at the returned z ###
+    r = 0.27 * ppr / tpr / z
+    f, fp = _dak_function(r, tpr, ppr, *_dak_terms(tpr))
+    cpr = tpr * z / ppr / fp
+
+    relative = np.abs(f) / (0.27 * ppr)
+    finite = np.isfinite(relative)
+    residual = relative[finite].max() if finite.any() else np.nan
+
+    return z.reshape(shape), cpr.reshape(shape), residual
+
+
+def z_factor_table(tpr_range=TABLE_TPR, ppr_range=TABLE_PPR, tol=1e-12,
+                   max_iter=100):
+    """
+    Precomputes Z factors on a regular (Tpr, Ppr) grid for
+    :func:`z_factor`.
+
+        Parameters
+        ----------
+        tpr_range : tuple (default (1.05, 3.0, 0.01))
+            Start, stop (inclusive) and step of pseudo reduced
+            temperature.
+        ppr_range : tuple (default (0.2, 15.0, 0.05))
+            Start, stop (inclusive) and step of pseudo reduced pressure.
+        tol : float (default 1e-12)
+            Convergence tolerance of the table values.
+        max_iter : int (default 100)
+            Maximum number of Newton steps for the table values.
+
+        Returns
+        -------
+        table : RegularGridInterpolator
+            Linear interpolation of Z factor on (tpr, ppr), NaN outside
+            of the grid.
+
+    """
+
+    tpr_grid = np.arange(tpr_range[0], tpr_range[1] + tpr_range[2] / 2,
+                         tpr_range[2])
+    ppr_grid = np.arange(ppr_range[0], ppr_range[1] + ppr_range[2] / 2,
+                         ppr_range[2])
+
+    tpr, ppr = np.meshgrid(tpr_grid, ppr_grid, indexing = 'ij')
+    z = np.ones(tpr.size)
+    _newton(tpr.ravel(), ppr.ravel(), z, tol, max_iter)
+
+    return RegularGridInterpolator((tpr_grid, ppr_grid),
+                                   z.reshape(tpr.shape),
+                                   bounds_error = False, fill_value = np.nan)
+
+
+def default_z_factor_table():
+    """
+    Z factor table over the default range, built once per process.
+
+    """
+
+    global _default_table
+    if _default_table is None:
+        _default_table = z_factor_table()
+    return _default_table
+
+
+def _correlations(depths, mast, temp_grad, press_grad, rws, rwt, rmfs, rmft,
+                  gas_grav, oil_api, p_sep, t_sep, yn2, yco2, yh2s, yh20, rs,
+                  lith_grad, biot, pr, z_tol, z_max_iter, z_table):
+    """
+    Evaluates the fluid property correlations at every depth. Returns a
+    dictionary of curve data by mnemonic and the maximum relative
+    residual of the Z factor, NaN for oil.
+
+    """
+
+    form_temp = mast + temp_grad * depths
+    pore_press = press_grad * depths
+
+    ### water properties ###
+    rw = (rwt + 6.77) / (form_temp + 6.77) * rws
+    rmf = (rmft + 6.77) / (form_temp + 6.77) * rmfs
+
+    rw68 = (rwt + 6.77) / (68 + 6.77) * rws
+    rmf68 = (rmft + 6.77) / (68 + 6.77) * rws
+
+    ### weight percent total dissolved solids ###
+    xsaltw = 10 ** (-0.5268 * (np.log10(rw68)) ** 3 - 1.0199 * \
+                (np.log10(rw68)) ** 2 - 1.6693 * (np.log10(rw68)) - 0.3087)
+    xsaltmf = 10 ** (-0.5268 * (np.log10(rmf68)) ** 3 - 1.0199 * \
+                    (np.log10(rmf68)) ** 2 - 1.6693 * (np.log10(rmf68)) - 0.3087)
+
+    ### bw for reservoir water. ###
+    ### Eq 1.83 - 1.85 Gas Reservoir Engineering ###
+    dvwt = -1.0001 * 10 ** -2 + 1.33391 * 10 ** -4 * form_temp + \
+        5.50654 * 10 ** -7 * form_temp ** 2
+
+    dvwp = -1.95301 * 10 ** -9 * pore_press * form_temp - \
+        1.72834 * 10 ** -13 * pore_press ** 2 * form_temp - \
+        3.58922 * 10 ** -7 * pore_press - \
+        2.25341 * 10 ** -10 * pore_press ** 2
+
+    bw = (1 + dvwt) * (1 + dvwp)
+
+    ### calculate solution gas in water ratio ###
+    ### Eq. 1.86 - 1.91 Gas Reservoir Engineering ###
+    rsa = 8.15839 - 6.12265 * 10 ** -2 * form_temp + \
+        1.91663 * 10 ** -4 * form_temp ** 2 - \
+        2.1654 * 10 ** -7 * form_temp ** 3
+
+    rsb = 1.01021 * 10 ** -2 - 7.44241 * 10 ** -5 * form_temp + \
+        3.05553 * 10 ** -7 * form_temp ** 2 - \
+        2.94883 * 10 ** -10 * form_temp ** 3
+
+    rsc = -1.0 * 10 ** -7 * (9.02505 - 0.130237 * form_temp + \
+                            8.53425 * 10 ** -4 * form_temp ** 2 - 2.34122 * 10 ** -6 * \
+                            form_temp ** 3 + 2.37049 * 10 ** -9 * form_temp ** 4)
+
+    rswp = rsa + rsb * pore_press + rsc * pore_press ** 2
+    rsw = rswp * 10 ** (-0.0840655 * xsaltw * form_temp ** -0.285584)
+
+    ### log responses ###
+    rho_w = (2.7512 * 10 ** -5 * xsaltw +
+            6.9159 * 10 ** -3 * xsaltw + 1.0005) * bw
+
+    rho_mf = (2.7512 * 10 ** -5 * xsaltmf +
+            6.9159 * 10 ** -3 * xsaltmf + 1.0005) * bw
+
+    nphi_w = 1 + 0.4 * (xsaltw / 100)
+    nphi_mf = 1 + 0.4 * (xsaltmf / 100)
+
+    ### net effective stress ###
+    nes = (((lith_grad * depths) - (biot * press_grad * depths) +
+            2 * (pr / (1 - pr)) * (lith_grad * depths) -
+            (biot * press_grad * depths))) / 3
+
+    ### gas reservoir ###
+    z_residual = np.nan
+    if oil_api == 0:
+        # hydrocarbon gravity only
+        hc_grav = (gas_grav - 1.1767 * yh2s - 1.5196 * yco2 - \
+                0.9672 * yn2 - 0.622 * yh20) / \
+                (1.0 - yn2 - yco2 - yh20 - yh2s)
+
+        # pseudocritical properties of hydrocarbon
+        ppc_h = 756.8 - 131.0 * hc_grav - 3.6 * (hc_grav ** 2)
+        tpc_h = 169.2 + 349.5 * hc_grav - 74.0 * (hc_grav ** 2)
+
+        # pseudocritical properties of mixture
+        ppc = (1.0 - yh2s - yco2 - yn2 - yh20) * ppc_h + \
+            1306.0 * yh2s + 1071.0 * yco2 + \
+            493.1 * yn2 + 3200.1 * yh20
+
+        tpc = (1.0 - yh2s - yco2 - yn2 - yh20) * tpc_h + \
+            672.35 * yh2s + 547.58 * yco2 + \
+            227.16 * yn2 + 1164.9 * yh20
+
+        # Wichert-Aziz correction for H2S and CO2
+        if yco2 > 0 or yh2s > 0:
+            epsilon = 120 * ((yco2 + yh2s) ** 0.9 -
+                            (yco2 + yh2s) ** 1.6) + \
+                    15 * (yh2s ** 0.5 - yh2s ** 4)
+
+            tpc_temp = tpc - epsilon
+            ppc = (ppc * tpc_temp) / \
+                (tpc + (yh2s * (1.0 - yh2s) * epsilon))
+
+            tpc = tpc_temp
+        # Casey correction for nitrogen and water vapor
+        if yn2 > 0 or yh20 > 0:
+            tpc_cor = -246.1 * yn2 + 400 * yh20
+            ppc_cor = -162.0 * yn2 + 1270.0 * yh20
+            tpc = (tpc - 227.2 * yn2 - 1165.0 * yh20) / \
+                (1.0 - yn2 - yh20) + tpc_cor
+
+            ppc = (ppc - 493.1 * yn2 - 3200.0 * yh20) / \
+                (1.0 - yn2 - yh20) + ppc_cor
+
+        # Reduced pseudocritical properties
+        tpr = (form_temp + 459.67) / tpc
+        ppr = pore_press / ppc
+
+        ### z factor from Dranchuk and Abou-Kassem fit of ###
+        ### Standing and Katz chart ###
+        z, cpr, z_residual = z_factor(tpr, ppr, tol = z_tol,
+                                      max_iter = z_max_iter,
+                                      table = z_table)
+
+        ### gas compressibility from Dranchuk and Abau-Kassem ###
+        cg = cpr / ppc
+
+        ### gas expansion factor ###
+        bg = (0.0282793 * z * (form_temp + 459.67)) / pore_press
+
+        ### gas density Eq 1.64 GRE ###
+        rho_hc = 1.495 * 10 ** -3 * (pore_press * (gas_grav)) / \
+                (z * (form_temp + 459.67))
+        nphi_hc = 2.17 * rho_hc
+
+        ### gas viscosity Lee Gonzalez Eakin method ###
+        ### Eqs. 1.63-1.67 GRE ###
+        k = ((9.379 + 0.01607 * (28.9625 * gas_grav)) * \
+            (form_temp + 459.67) ** 1.5) / \
+            (209.2 + 19.26 * (28.9625 * gas_grav) + \
+            (form_temp + 459.67))
+
+        x = 3.448 + 986.4 / \
+            (form_temp + 459.67) + 0.01009 * (28.9625 * gas_grav)
+
+        y = 2.447 - 0.2224 * x
+        mu_hc = 10 ** -4 * k * np.exp(x * rho_hc ** y)
+
+        ### oil reservoir ###
+    else:
+
+        # Normalize gas gravity to separator pressure of 100 psi
+        ygs100 = gas_grav * (1 + 5.912 * 0.00001 * oil_api * \
+                            (t_sep - 459.67) * np.log10(p_sep / 114.7))
+
+        if oil_api < 30:
+            if rs == 0 or rs is None:
+                rs = 0.0362 * ygs100 * pore_press ** 1.0937 * \
+                    np.exp((25.724 * oil_api) / (form_temp + 459.67))
+
+            bp = ((56.18 * rs / ygs100) * 10 ** \
+                (-10.393 * oil_api / (form_temp + 459.67))) ** 0.84246
+            ### gas saturated bubble-point ###
+            bo = 1 + 4.677 * 10 ** -4 * rs + 1.751 * 10 ** -5 * \
+                (form_temp - 60) * (oil_api / ygs100) - \
+                1.811 * 10 ** -8 * rs * \
+                (form_temp - 60) * (oil_api / ygs100)
+        else:
+            if rs == 0 or rs is None:
+                rs = 0.0178 * ygs100 * pore_press ** 1.187 * \
+                    np.exp((23.931 * oil_api) / (form_temp + 459.67))
+
+            bp = ((56.18 * rs / ygs100) * 10 ** \
+                (-10.393 * oil_api / (form_temp + 459.67))) ** 0.84246
+
+            ### gas saturated bubble-point ###
+            bo = 1 + 4.670 * 10 ** -4 * rs + 1.1 * \
+                10 ** -5 * (form_temp - 60) * (oil_api / ygs100) + \
+                1.337 * 10 ** -9 * rs * (form_temp - 60) * \
+                (oil_api / ygs100)
+
+        ### calculate bo for undersaturated oil ###
+        pp_gt_bp = np.where(pore_press > bp + 100)[0]
+        if len(pp_gt_bp) > 0:
+            bo[pp_gt_bp] = bo[pp_gt_bp] * np.exp(-(0.00001 * \
+                                                (-1433 + 5 * rs + 17.2 * form_temp[pp_gt_bp] - \
+                                                    1180 * ygs100 + 12.61 * oil_api)) * \
+                                                np.log(pore_press[pp_gt_bp] / bp[pp_gt_bp]))
+
+        ### oil properties ###
+        rho_hc = (((141.5 / (oil_api + 131.5) * 62.428) + \
+                0.0136 * rs * ygs100) / bo) / 62.428
+        nphi_hc = 1.003 * rho_hc
+
+        ### oil viscosity from Beggs-Robinson ###
+        ### RE Handbook Eqs. 2.121 ###
+        muod = 10 ** (np.exp(6.9824 - 0.04658 * oil_api) * \
+                    form_temp ** -1.163) - 1
+
+        mu_hc = (10.715 * (rs + 100) ** -0.515) * \
+                muod ** (5.44 * (rs + 150) ** -0.338)
+
+        ### undersaturated oil viscosity from Vasquez and Beggs ###
+        ### Eqs. 2.123 ###
+        if len(pp_gt_bp) > 0:
+            mu_hc[pp_gt_bp] = mu_hc[pp_gt_bp] * \
+                            (pore_press[pp_gt_bp] / bp[pp_gt_bp]) ** \
+                            (2.6 * pore_press[pp_gt_bp] ** 1.187 * \
+                            10 ** (-0.000039 * pore_press[pp_gt_bp] - 5))
+
+    curves = {'PORE_PRESS': pore_press, 'RES_TEMP': form_temp, 'NES': nes,
+              'RW': rw, 'RMF': rmf, 'RHO_HC': rho_hc, 'RHO_W': rho_w,
+              'RHO_MF': rho_mf, 'NPHI_HC': nphi_hc, 'NPHI_W': nphi_w,
+              'NPHI_MF': nphi_mf, 'MU_HC': mu_hc}
+
+    if oil_api == 0:
+        curves.update({'Z': z, 'CG': cg, 'BG': bg})
+    else:
+        curves.update({'BO': bo, 'BP': bp})
+
+    ### constant responses are broadcast to depth ###
+    for key in curves:
+        curves[key] = np.broadcast_to(np.asarray(curves[key], dtype = float),
+                                      depths.shape)
+
+    return curves, z_residual
+
+
+def _parameter_key(params):
+    """
+    Hashable key of a fluid parameter set. A lookup table is keyed by
+    identity.
+
+    """
+
+    items = []
+    for name in sorted(params):
+        value = params[name]
+        if name == 'z_table' and value not in (None, True, False):
+            value = ('table', id(value))
+        items.append((name, value))
+
+    return tuple(items)
+
+
+class ProfileCache(object):
+    """
+    Bounded least recently used cache of fluid profiles, keyed on the
+    fluid parameters and the depth grid. Used by :func:`fluid_profile`
+    with :code:`cache=True`, so that wells sharing parameters and depth
+    grids calculate the correlations once.
+
+        Parameters
+        ----------
+        maxsize : int (default 32)
+            Maximum number of profiles kept. The least recently used
+            profile is dropped when full.
+
+        Attributes
+        ----------
+        hits : int
+            Number of profiles returned from the cache.
+        misses : int
+            Number of profiles calculated and added to the cache.
+
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._profiles = OrderedDict()
+
+    def __len__(self):
+        return len(self._profiles)
+
+    @staticmethod
+    def key(depths, coarse_step, max_error, params):
+        """
+        Cache key of a profile. Depths are keyed by length, end points
+        and a digest of their values.
+
+        """
+
+        depths = np.ascontiguousarray(depths, dtype = float)
+        if len(depths) > 0:
+            grid = (len(depths), depths[0], depths[-1],
+                    hashlib.blake2b(depths.tobytes(),
+                                    digest_size = 16).hexdigest())
+        else:
+            grid = (0,)
+
+        return (grid, coarse_step, max_error, _parameter_key(params))
+
+    def get(self, key):
+        """
+        Profile for key, or None if not cached.
+
+        """
+
+        profile = self._profiles.get(key)
+        if profile is None:
+            return None
+
+        self._profiles.move_to_end(key)
+        self.hits += 1
+        curves, z_residual = profile
+        return dict(curves), z_residual
+
+    def put(self, key, curves, z_residual):
+        """
+        Adds a profile, dropping the least recently used profiles over
+        maxsize. Returns the profile as cached, with read only curves.
+
+        """
+
+        self.misses += 1
+        if self.maxsize <= 0:
+            return curves, z_residual
+
+        cached = {}
+        for mnemonic, data in curves.items():
+            data = np.array(data)
+            data.setflags(write = False)
+            cached[mnemonic] = data
+
+        self._profiles[key] = (cached, z_residual)
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last = False)
+
+        return dict(cached), z_residual
+
+    def info(self):
+        """
+        Dictionary of hits, misses, size and maxsize.
+
+        """
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._profiles), 'maxsize': self.maxsize}
+
+    def clear(self):
+        """
+        Drops every profile and resets the counters.
+
+        """
+
+        self._profiles.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# profiles shared by fluid_profile(cache=True)
+profile_cache = ProfileCache()
+
+
+def output_curves(oil_api):
+    """
+    Curves calculated for a fluid system as (mnemonic, unit,
+    description), dry gas if oil_api is 0 and oil otherwise.
+
+    """
+
+    if oil_api == 0:
+        return OUTPUT_CURVES + _GAS_CURVES
+    return OUTPUT_CURVES + _OIL_CURVES
+
+
+def _coarse_profile(depths, params, coarse_step, max_error):
+    """
+    Evaluates the correlations on a depth grid with spacing coarse_step
+    and interpolates onto depths. Each grid interval is checked at its
+    midpoint and split while the relative error of linear interpolation
+    is over max_error, down to the sample spacing of depths.
+
+    """
+
+    top = np.nanmin(depths)
+    bottom = np.nanmax(depths)
+    min_width = (bottom - top) / (len(depths) - 1)
+    n = max(int(np.ceil((bottom - top) / coarse_step)), 1)
+
+    grid = np.linspace(top, bottom, n + 1)
+    curves, z_residual = _correlations(grid, **params)
+    keys = list(curves.keys())
+    values = np.array([curves[k] for k in keys])
+
+    split = np.arange(n)
+    while len(split) > 0:
+        left = grid[split]
+        right = grid[split + 1]
+        mid = (left + right) / 2
+
+        mid_curves, mid_residual = _correlations(mid, **params)
+        mid_values = np.array([mid_curves[k] for k in keys])
+        z_residual = np.fmax(z_residual, mid_residual)
+
+        ### relative error of interpolation at midpoints ###
+        interp = (values[:, split] + values[:, split + 1]) / 2
+        scale = np.abs(mid_values)
+        error = np.abs(interp - mid_values) / np.where(scale > 0, scale, 1)
+        error = np.where(np.isfinite(error), error, 0).max(axis = 0)
+
+        ### add midpoints of failed intervals and split them again ###
+        failed = error > max_error
+        split = split[failed]
+        grid = np.insert(grid, split + 1, mid[failed])
+        values = np.insert(values, split + 1, mid_values[:, failed], axis = 1)
+
+        width = (right - left)[failed] / 2
+        children = split + np.arange(len(split))
+        split = np.concatenate((children, children + 1))
+        split = split[np.tile(width > min_width, 2)]
+        split.sort()
+
+    curves = {}
+    for key, value in zip(keys, values):
+        curves[key] = np.interp(depths, grid, value)
+
+    return curves, z_residual
+
+
+def fluid_profile(depths, coarse_step=None, max_error=1e-4, cache=False,
+                  **params):
+    """
+    Fluid properties at depth, the array implementation of
+    :meth:`pet.Log.fluid_properties`.
+
+        Parameters
+        ----------
+        depths : array
+            Depths to calculate, increasing.
+        coarse_step : float or None (default None)
+            Spacing in depth units of a coarse grid to evaluate the
+            correlations on, interpolated linearly onto depths. Grid
+            intervals are halved until the relative interpolation error
+            at their midpoint is under max_error. None evaluates every
+            depth.
+        max_error : float (default 1e-4)
+            Maximum relative error of each curve at the midpoint of
+            coarse grid intervals. Only used with coarse_step.
+        cache : bool or ProfileCache (default False)
+            Reuse profiles with the same parameters and depths from
+            :data:`profile_cache`, or from the given cache. Cached curves
+            are read only.
+        **params
+            Fluid parameters of :meth:`pet.Log.fluid_properties`, see
+            :data:`DEFAULT_PARAMETERS`.
+
+        Returns
+        -------
+        curves : dict
+            Curve data by mnemonic, see :func:`output_curves`.
+        z_residual : float
+            Maximum relative residual of the Z factor at the evaluated
+            depths, NaN for oil.
+
+    """
+
+    unknown = set(params) - set(DEFAULT_PARAMETERS)
+    if len(unknown) > 0:
+        raise ValueError('Unknown fluid parameters: %s' % \
+                         ', '.join(sorted(unknown)))
+
+    p = dict(DEFAULT_PARAMETERS)
+    p.update(params)
+    depths = np.asarray(depths, dtype = float)
+
+    if coarse_step is not None and coarse_step <= 0:
+        raise ValueError('coarse_step must be positive.')
+
+    if cache is True:
+        cache = profile_cache
+    elif cache is False:
+        cache = None
+
+    if cache is not None:
+        key = cache.key(depths, coarse_step, max_error, p)
+        profile = cache.get(key)
+        if profile is not None:
+            return profile
+
+    if coarse_step is None or len(depths) < 3:
+        curves, z_residual = _correlations(depths, **p)
+    else:
+        curves, z_residual = _coarse_profile(depths, p, coarse_step,
+                                             max_error)
+
+    if cache is not None:
+        return cache.put(key, curves, z_residual)
+
+    return curves, z_residual
+
+
+def write_profile(log, curves, z_residual, oil_api, depth_index):
+    """
+    Writes fluid curves from :func:`fluid_profile` to log at depth_index,
+    and the Z factor residual to the Z_RESID header parameter for dry
+    gas.
+
+    """
+
+    if oil_api == 0:
+        log.params['Z_RESID'] = HeaderItem(mnemonic = 'Z_RESID',
+            value = float(z_residual),
+            descr = 'Max relative residual of Z factor')
+
+    log_curves = []
+    for mnemonic, unit, descr in output_curves(oil_api):
+        log_curves.append({'mnemonic': mnemonic, 'data': curves[mnemonic],
+                           'unit': unit, 'descr': descr})
+
+    log.append_curves(log_curves, depth_index = depth_index)
+
+
+def fluid_properties_batch(logs, top=0, bottom=100000, overrides=None,
+                           coarse_step=None, max_error=1e-4, cache=False,
+                           **params):
+    """
+    Calculates fluid properties for many wells, the batched version of
+    :meth:`pet.Log.fluid_properties`.
+
+        Wells are grouped by their parameters after overrides. The depth
+        windows of each group are concatenated and the correlations are
+        evaluated once on their unique depths, then scattered back as
+        curves on each log. Wells with the same parameters and depth
+        grid share every evaluation.
+
+        Parameters
+        ----------
+        logs : list of pet.Log
+            Logs to calculate.
+        top : float (default 0)
+            The top depth of the calculation, for every well without a
+            top override.
+        bottom : float (default 100,000)
+            The bottom depth of the calculation, exclusive, for every
+            well without a bottom override.
+        overrides : list of dict or None (default None)
+            Per well parameters, aligned with logs. Each dictionary may
+            set top, bottom and any fluid parameter. None uses the
+            shared parameters for that well.
+        coarse_step : float or None (default None)
+            Coarse grid spacing, see :func:`fluid_profile`.
+        max_error : float (default 1e-4)
+            Maximum relative interpolation error, see
+            :func:`fluid_profile`.
+        cache : bool or ProfileCache (default False)
+            Profile cache of each group, see :func:`fluid_profile`.
+        **params
+            Fluid parameters shared by every well, see
+            :data:`DEFAULT_PARAMETERS`.
+
+        Note
+        ----
+        The Z_RESID header parameter of a dry gas well is the maximum
+        residual of its group.
+
+        Example
+        -------
+        >>> import fluid
+        >>> # wells 0 and 2 share one evaluation, well 1 is a gas well
+        >>> fluid.fluid_properties_batch(logs, temp_grad = 0.016,
+        ...     overrides = [None, {'oil_api': 0}, None])
+
+    """
+
+    logs = list(logs)
+    if overrides is None:
+        overrides = [None] * len(logs)
+    elif len(overrides) != len(logs):
+        raise ValueError('overrides must have one entry for each log.')
+
+    ### group wells by parameters ###
+    groups = OrderedDict()
+    for log, override in zip(logs, overrides):
+        p = dict(params)
+        if override is not None:
+            p.update(override)
+
+        well_top = p.pop('top', top)
+        well_bottom = p.pop('bottom', bottom)
+
+        depths = log['DEPT']
+        depth_index = np.logical_and(depths >= well_top,
+                                     depths < well_bottom)
+
+        key = _parameter_key(p)
+        if key not in groups:
+            groups[key] = (p, [])
+        groups[key][1].append((log, depth_index))
+
+    ### one pass per group on the unique depths of its wells ###
+    for p, wells in groups.values():
+        depths = np.concatenate([log['DEPT'][depth_index]
+                                 for log, depth_index in wells])
+        unique, inverse = np.unique(depths, return_inverse = True)
+
+        curves, z_residual = fluid_profile(unique, coarse_step = coarse_step,
+                                           max_error = max_error,
+                                           cache = cache, **p)
+
+        oil_api = p.get('oil_api', DEFAULT_PARAMETERS['oil_api'])
+        start = 0
+        for log, depth_index in wells:
+            stop = start + np.count_nonzero(depth_index)
+            take = inverse[start:stop]
+            start = stop
+
+            well_curves = {}
+            for mnemonic, data in curves.items():
+                well_curves[mnemonic] = data[take]
+
+            write_profile(log, well_curves, z_residual, oil_api,
+                          depth_index)
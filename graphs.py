@@ -888,6 +888,8 @@ class LogViewer(object):
         """
         Event handler for changing data in the figure and in the log
         object. Connected on line 857 with :code:`motion_notify_event`.
+        Edited depths are recorded with :meth:`pet.Log.mark_dirty` for
+        incremental recompute.
         """
 
         draw= self.fig.canvas.manager.toolmanager.get_tool('Curve Edit')
@@ -910,6 +912,7 @@ class LogViewer(object):
                 x = (x - b) / m
 
             self.log[curve_name][cursor_depth_index] =  x
+            self.log.mark_dirty(curve_name, cursor_depth_index)
 
             self.fig.canvas.draw()
 
@@ -932,6 +935,7 @@ class LogViewer(object):
                 x_data = (x_data - b) / m
 
             self.log[curve_name][:] = x_data
+            self.log.mark_dirty(curve_name)
 
             self.fig.canvas.draw()
 
@@ -1,9 +1,15 @@
 import os
+import gc
+import shutil
 import logging
+import tempfile
 import warnings
 import pet
 import glob
 import electrofacies as ef
+import las_cache
+from preconditioning import LOAD_CURVES
+from qc import required_curves
 from tqdm import tqdm
 import sys
 import threading
@@ -18,21 +24,58 @@ class ProcessingThread(threading.Thread):
         source_folder = self.parent.source_folder_input.text()
         dest_folder = self.parent.dest_folder_input.text()
 
+        qc = self.parent.qc_checkbox.isChecked()
         precondition = self.parent.precondition_checkbox.isChecked()
         fluidprop = self.parent.fluidprop_checkbox.isChecked()
         multimineral = self.parent.multimineral_checkbox.isChecked()
         electrofacies = self.parent.electrofacies_checkbox.isChecked()
 
+        # curves clustered by electrofacies
+        ef_curves = []
+        if self.parent.nphi_checkbox.isChecked():
+            ef_curves.append('NPHI')
+        if self.parent.rhob_checkbox.isChecked():
+            ef_curves.append('RHOB')
+        if self.parent.ild_checkbox.isChecked():
+            ef_curves.append('ILD')
+        if self.parent.gr_checkbox.isChecked():
+            ef_curves.append('GR')
+        if self.parent.pe_checkbox.isChecked():
+            ef_curves.append('PE')
+        if self.parent.dt_checkbox.isChecked():
+            ef_curves.append('DT')
+
+        # QC only requires the curves of the selected steps
+        steps = [step for step, selected in [('precondition', precondition),
+                                             ('fluid_properties', fluidprop),
+                                             ('multimineral_model', multimineral)]
+                 if selected]
+        required = required_curves(steps, ef_curves if electrofacies else None)
+
         if not os.path.exists(dest_folder):
             os.makedirs(dest_folder)
 
         las_files = glob.glob(os.path.join(source_folder, '*.las'))
 
         processed_files = []
+        skipped_files = []
 
         for index, las_file in enumerate(las_files):
             try:
-                log = pet.Log(las_file)
+                # precondition keeps only the standard curves, skip the rest
+                curves = LOAD_CURVES if precondition else None
+                log = pet.Log(las_file, curves=curves)
+
+                if qc:
+                    result = log.qc(thresholds={'required': required},
+                                    drho_matrix=self.parent.drho_matrix)
+                    if not result.passed:
+                        skipped_files.append(las_file)
+                        print(f"Skipped {las_file}, failed QC: {'; '.join(result.reasons)}")
+                        logging.error(f"Skipped {las_file}, failed QC: {'; '.join(result.reasons)}")
+                        self.parent.update_progress(index + 1, len(las_files))
+                        self.parent.update_status_message(f"Processing {index + 1}/{len(las_files)} files")
+                        continue
 
                 if precondition:
                     log.precondition(drho_matrix=self.parent.drho_matrix, n=self.parent.n)
@@ -55,32 +98,35 @@ class ProcessingThread(threading.Thread):
             self.parent.update_status_message(f"Processing {index + 1}/{len(las_files)} files")
 
         if electrofacies:
-            logs = [pet.Log(x) for x in processed_files]
-            self.parent.update_progress(len(las_files) + 1, len(las_files) + 1)
-
-            curves = []
-            if self.parent.nphi_checkbox.isChecked():
-                curves.append('NPHI')
-            if self.parent.rhob_checkbox.isChecked():
-                curves.append('RHOB')
-            if self.parent.ild_checkbox.isChecked():
-                curves.append('ILD')
-            if self.parent.gr_checkbox.isChecked():
-                curves.append('GR')
-            if self.parent.pe_checkbox.isChecked():
-                curves.append('PE')
-            if self.parent.dt_checkbox.isChecked():
-                curves.append('DT')
-            
-            combined_logs = ef.electrofacies(logs=logs, curves=curves, n_clusters=self.parent.n_clusters)
-
-            for i, log in enumerate(combined_logs):
-                log.write(processed_files[i])
+            # curves memory-mapped from a throwaway cache, read when clustered.
+            # the files are rewritten below, so the entries are never reused
+            cache_dir = tempfile.mkdtemp(prefix='las_cache_')
+            try:
+                cache = las_cache.LasCache(cache_dir)
+                logs = [pet.Log(x, cache=cache, mmap=True) for x in processed_files]
+                self.parent.update_progress(len(las_files) + 1, len(las_files) + 1)
+
+                combined_logs = ef.electrofacies(logs=logs, curves=ef_curves, n_clusters=self.parent.n_clusters)
+
+                for i, log in enumerate(combined_logs):
+                    log.write(processed_files[i])
+            finally:
+                # release the memory maps first, windows can't delete mapped files
+                logs = combined_logs = log = None
+                gc.collect()
+                try:
+                    shutil.rmtree(cache_dir)
+                except OSError as e:
+                    print(f"Could not remove electrofacies cache {cache_dir}: {str(e)}")
+                    logging.error(f"Could not remove electrofacies cache {cache_dir}: {str(e)}")
 
             self.parent.update_status_message(f"Processing Electrofacies (Step {len(las_files) + 1}/{len(las_files) + 1})")
 
         self.parent.processing_completed()
-        self.parent.update_status_message("Processing completed!")
+        if skipped_files:
+            self.parent.update_status_message(f"Processing completed! Skipped {len(skipped_files)} wells failing QC, see error_log/error.log")
+        else:
+            self.parent.update_status_message("Processing completed!")
 
 class ProcessingGUI(QMainWindow):
     def __init__(self):
@@ -110,6 +156,7 @@ class ProcessingGUI(QMainWindow):
         self.n_clusters_label = QLabel('n_clusters:')
         self.n_clusters_input = QLineEdit(str(self.n_clusters))
 
+        self.qc_checkbox = QCheckBox('Skip Wells Failing QC (Nulls, Ranges, Spikes, Coverage)')
         self.precondition_checkbox = QCheckBox('Apply Precondition (Standardize Curves)')
         self.fluidprop_checkbox = QCheckBox('Apply Fluid Properties')
         self.multimineral_checkbox = QCheckBox('Apply Multimineral Model')
@@ -136,6 +183,7 @@ class ProcessingGUI(QMainWindow):
         layout.addWidget(self.dest_folder_label)
         layout.addWidget(self.dest_folder_input)
         layout.addWidget(self.dest_folder_button)
+        layout.addWidget(self.qc_checkbox)
         layout.addWidget(self.precondition_checkbox)
         layout.addWidget(self.drho_matrix_label)
         layout.addWidget(self.drho_matrix_input)
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+LAS cache
+
+Binary cache of parsed las files, used by :class:`pet.Log` with
+:code:`cache=True`, so that a raw_las folder processed many times is
+only parsed once.
+
+Each entry is a .npy file of the curves as rows of one float array, and
+a .json file with the header text of the file up to ~A. The .npy can be
+memory-mapped, see :code:`pet.Log(mmap=True)`, so a curve is only read
+from disk when it is used. Entries are keyed by the absolute path of the
+file and are valid while its size and modification time match. When
+only the modification time changed, e.g. after copying the folder, the
+content hash decides. The cache is kept under a size limit by dropping
+the least recently used entries, with the modification time of the .npy
+file as last use.
+
+Command line::
+
+    python las_cache.py info
+    python las_cache.py warm raw_las
+    python las_cache.py clear
+
+"""
+
+
+import os
+import sys
+import json
+import glob
+import hashlib
+import argparse
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'las_cache')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# bumped when the entry layout changes, older entries are misses
+FORMAT_VERSION = 2
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    blake2b digest of the contents of a file.
+
+    """
+
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class LasCache(object):
+    """
+    Directory of parsed las files with least recently used eviction.
+
+        Parameters
+        ----------
+        directory : str (default None)
+            Cache directory, default las_cache next to this module.
+            Created on the first entry.
+        max_bytes : int (default 2 GiB)
+            Maximum total size of the entries.
+        max_entries : int (default None)
+            Maximum number of entries, None for no limit.
+        verify : bool (default False)
+            Check the content hash on every hit, not only when the
+            modification time changed.
+
+        Attributes
+        ----------
+        hits : int
+            Number of files loaded from the cache.
+        misses : int
+            Number of files not in the cache or with a stale entry.
+
+        Example
+        -------
+        >>> import pet
+        >>> import las_cache
+        >>> cache = las_cache.LasCache(max_bytes = 500 * 1024 ** 2)
+        >>> log = pet.Log('raw_las/well.las', cache = cache)
+        >>> cache.info()
+
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES,
+                 max_entries=None, verify=False):
+        if directory is None:
+            directory = DEFAULT_CACHE_DIR
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, path):
+        """
+        Path of the .npy curves of the cache entry of a las file. The
+        header is next to it, with a .json extension.
+
+        """
+
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.npy')
+
+    def get(self, path, mmap=False):
+        """
+        Cached header and curves of a las file.
+
+            Parameters
+            ----------
+            path : str
+                Path of the las file.
+            mmap : bool (default False)
+                Memory-map the curves copy on write instead of reading
+                them. Changes to the array are not written to the cache.
+
+            Returns
+            -------
+            entry : tuple or None
+                (header, data) with header the text up to ~A and data
+                the curves as rows, or None if the file is not cached or
+                changed since.
+
+        """
+
+        entry = self.entry_path(path)
+        if not os.path.isfile(entry):
+            self.misses += 1
+            return None
+
+        try:
+            with open(_meta_path(entry), encoding = 'utf-8') as f:
+                meta = json.load(f)
+            data = np.load(entry, mmap_mode = 'c' if mmap else None,
+                           allow_pickle = False)
+        except (OSError, ValueError):
+            self._remove(entry)
+            self.misses += 1
+            return None
+
+        stat = os.stat(path)
+        valid = meta.get('version') == FORMAT_VERSION and \
+            meta.get('path') == os.path.abspath(path) and \
+            meta.get('size') == stat.st_size and \
+            list(data.shape) == meta.get('shape')
+        moved = meta.get('mtime_ns') != stat.st_mtime_ns
+        if valid and (moved or self.verify):
+            valid = meta.get('hash') == file_hash(path)
+
+        if not valid:
+            del data
+            self._remove(entry)
+            self.misses += 1
+            return None
+
+        if moved:
+            meta['mtime_ns'] = stat.st_mtime_ns
+            _write_json(_meta_path(entry), meta)
+        os.utime(entry)
+        self.hits += 1
+
+        return meta['header'], data
+
+    def put(self, path, header, data):
+        """
+        Adds a parsed las file and drops the least recently used entries
+        over the limits.
+
+            Parameters
+            ----------
+            path : str
+                Path of the las file.
+            header : str
+                Text of the file up to ~A.
+            data : 2D array
+                Curves as rows.
+
+            Returns
+            -------
+            cached : bool
+                False if data is not numeric or the entry is larger than
+                max_bytes.
+
+        """
+
+        data = np.asarray(data)
+        if data.ndim != 2 or data.dtype.kind not in 'fiu' or \
+           data.nbytes > self.max_bytes:
+            return False
+
+        stat = os.stat(path)
+        meta = {
+            'version': FORMAT_VERSION,
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': file_hash(path),
+            'shape': list(data.shape),
+            'header': header
+        }
+
+        os.makedirs(self.directory, exist_ok = True)
+        entry = self.entry_path(path)
+        temp = '%s.%d.tmp' % (entry, os.getpid())
+        try:
+            ### header last, so a partly replaced entry is a miss ###
+            self._remove(entry)
+            with open(temp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(data), allow_pickle = False)
+            os.replace(temp, entry)
+            _write_json(_meta_path(entry), meta)
+        except OSError:
+            # entry memory-mapped by another log on windows
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return False
+
+        self.evict()
+        return True
+
+    def entries(self):
+        """
+        Cache entries as (path, bytes, last use), least recently used
+        first.
+
+        """
+
+        entries = []
+        for entry in glob.glob(os.path.join(self.directory, '*.npy')):
+            try:
+                stat = os.stat(entry)
+                size = stat.st_size + os.path.getsize(_meta_path(entry))
+            except OSError:
+                continue
+            entries.append((entry, size, stat.st_mtime))
+
+        entries.sort(key = lambda e: e[2])
+        return entries
+
+    def evict(self):
+        """
+        Drops least recently used entries until the cache is within
+        max_bytes and max_entries. Returns the number dropped.
+
+        """
+
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+
+        dropped = 0
+        for entry, size, _ in entries:
+            over_count = self.max_entries is not None and \
+                len(entries) - dropped > self.max_entries
+            if total <= self.max_bytes and not over_count:
+                break
+            self._remove(entry)
+            total -= size
+            dropped += 1
+
+        return dropped
+
+    def info(self):
+        """
+        Dictionary of hits, misses, entries, bytes and limits.
+
+        """
+
+        entries = self.entries()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(entries), 'bytes': sum(e[1] for e in entries),
+                'max_bytes': self.max_bytes, 'max_entries': self.max_entries,
+                'directory': self.directory}
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters. Returns the number
+        of entries removed.
+
+        """
+
+        entries = self.entries()
+        for entry, _, _ in entries:
+            self._remove(entry)
+        self.hits = 0
+        self.misses = 0
+
+        return len(entries)
+
+    def warm(self, paths):
+        """
+        Loads las files into the cache.
+
+            Parameters
+            ----------
+            paths : list of str
+                Las files, or folders of las files.
+
+            Returns
+            -------
+            loaded : int
+                Number of files cached.
+            errors : list of tuple
+                (path, message) of files that failed to load.
+
+        """
+
+        from pet import Log
+
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(glob.glob(os.path.join(path, '*.las'))))
+            else:
+                files.append(path)
+
+        loaded = 0
+        errors = []
+        for las_file in files:
+            try:
+                Log(las_file, cache = self)
+            except Exception as e:
+                errors.append((las_file, str(e)))
+                continue
+            if os.path.isfile(self.entry_path(las_file)):
+                loaded += 1
+
+        return loaded, errors
+
+    @staticmethod
+    def _remove(entry):
+        for path in (_meta_path(entry), entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _meta_path(entry):
+    return os.path.splitext(entry)[0] + '.json'
+
+
+def _write_json(path, obj):
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp, 'w', encoding = 'utf-8') as f:
+        json.dump(obj, f)
+    os.replace(temp, path)
+
+
+# cache used by pet.Log(cache=True)
+default_cache = LasCache()
+
+
+def main(argv=None):
+    """
+    Command line to show, clear or warm a cache.
+
+    """
+
+    parser = argparse.ArgumentParser(description = 'Cache of parsed las files.')
+    parser.add_argument('command', choices = ['info', 'clear', 'warm'])
+    parser.add_argument('paths', nargs = '*',
+                        help = 'las files or folders to warm')
+    parser.add_argument('--dir', default = None, help = 'cache directory')
+    parser.add_argument('--max-mb', type = float, default = None,
+                        help = 'maximum cache size in MiB')
+    parser.add_argument('--max-entries', type = int, default = None,
+                        help = 'maximum number of cached files')
+    args = parser.parse_args(argv)
+
+    max_bytes = DEFAULT_MAX_BYTES if args.max_mb is None else \
+        int(args.max_mb * 1024 ** 2)
+    cache = LasCache(args.dir, max_bytes = max_bytes,
+                     max_entries = args.max_entries)
+
+    if args.command == 'clear':
+        print('Removed %d entries from %s' % (cache.clear(), cache.directory))
+    elif args.command == 'warm':
+        if not args.paths:
+            parser.error('warm needs las files or folders')
+        loaded, errors = cache.warm(args.paths)
+        for las_file, message in errors:
+            print('Error loading %s: %s' % (las_file, message))
+        print('Cached %d files in %s' % (loaded, cache.directory))
+    else:
+        for key, value in cache.info().items():
+            print('%s: %s' % (key, value))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1627 @@
+# -*- coding: utf-8 -*-
+"""
+Multimineral
+
+Array implementation of the :meth:`pet.Log.multimineral_model` fixed
+point iteration. Instead of iterating one depth at a time, every step
+of the iteration (clay volume, organics, clean matrix correction,
+mineral inversion, saturations and hydrocarbons in place) is evaluated
+on whole depth arrays. Depths leave the iteration independently, with
+the same convergence test as the per-sample loop, so each depth stops
+at the same iteration it would have stopped at in the loop.
+
+"""
+
+
+import os
+import hashlib
+import itertools
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import lsq_linear
+from lasio import HeaderItem
+
+
+# curves read by the model. PE is optional, BO or BG depends on the
+# hydrocarbon class.
+RAW_CURVES = ['GR', 'NPHI', 'RHOB', 'ILD']
+FLUID_CURVES = ['RW', 'RHO_HC', 'RHO_W', 'NPHI_HC', 'NPHI_W', 'RES_TEMP',
+                'NES', 'PORE_PRESS']
+
+# order of the bulk volumes used in the convergence test
+_CONVERGENCE_ORDER = ['BVQTZ', 'BVCLC', 'BVDOL', 'BVX', 'PHIE', 'BVOM',
+                      'BVCLAY', 'BVPYR']
+
+_MINERALS = ['QTZ', 'CLC', 'DOL', 'X']
+
+# input curves of the iteration, and input curves only used for
+# hydrocarbons in place, for incremental recompute
+_ITERATION_CURVES = RAW_CURVES + ['PE', 'RW', 'RHO_HC', 'RHO_W', 'NPHI_HC',
+                                  'NPHI_W', 'RES_TEMP']
+_HC_CURVES = ['BO', 'BG', 'PORE_PRESS']
+
+# curves returned by multimineral_arrays for every model
+OUTPUT_CURVES = ['PHIE', 'SW', 'SHC', 'BVH', 'BVW', 'BVOM', 'BVCLAY',
+                 'BVPYR', 'VOM', 'VCLAY', 'VPYR', 'RHOM', 'TOC', 'WTCLAY',
+                 'WTPYR', 'BVQTZ', 'VQTZ', 'WTQTZ', 'BVCLC', 'VCLC', 'WTCLC',
+                 'BVDOL', 'VDOL', 'WTDOL', 'BVX', 'VX', 'WTX', 'MM_ITER',
+                 'MM_SSE', 'MM_APE']
+
+
+# default keyword parameters of :meth:`pet.Log.multimineral_model`
+DEFAULT_PARAMETERS = {
+    'gr_matrix': 10, 'nphi_matrix': 0, 'gr_clay': 350, 'rho_clay': 2.64,
+    'nphi_clay': 0.65, 'pe_clay': 4, 'rma': 180, 'rt_clay': 80,
+    'vclay_linear_weight': 1, 'vclay_clavier_weight': 0.5,
+    'vclay_larionov_weight': 0.5, 'vclay_nphi_weight': 1,
+    'vclay_nphi_rhob_weight': 1, 'vclay_cutoff': 0.1, 'rho_om': 1.15,
+    'nphi_om': 0.6, 'pe_om': 0.2, 'ro': 1.6, 'lang_press': 670,
+    'passey_nphi_weight': 1, 'passey_rhob_weight': 1, 'passey_lom': 10,
+    'passey_baseline_res': 40, 'passey_baseline_rhob': 2.65,
+    'passey_baseline_nphi': 0, 'schmoker_weight': 1,
+    'schmoker_slope': 0.7257, 'schmoker_baseline_rhob': 2.6,
+    'rho_pyr': 5, 'nphi_pyr': 0.13, 'pe_pyr': 13, 'om_pyrite_slope': 0.2,
+    'include_qtz': 'YES', 'rho_qtz': 2.65, 'nphi_qtz': -0.04,
+    'pe_qtz': 1.81, 'include_clc': 'YES', 'rho_clc': 2.71, 'nphi_clc': 0,
+    'pe_clc': 5.08, 'include_dol': 'YES', 'rho_dol': 2.85,
+    'nphi_dol': 0.04, 'pe_dol': 3.14, 'include_x': 'NO',
+    'name_x': 'Gypsum', 'name_log_x': 'GYP', 'rho_x': 2.35,
+    'nphi_x': 0.507, 'pe_x': 4.04, 'pe_fl': 0, 'm': 2, 'n': 2, 'a': 1,
+    'archie_weight': 1, 'indonesia_weight': 0, 'simandoux_weight': 0,
+    'modified_simandoux_weight': 0, 'waxman_smits_weight': 0, 'cec': -1,
+    'buckles_parameter': -1,
+}
+
+# parameters that select models or name curves, and so can not vary
+# between the realizations of MultimineralModel.uncertainty
+_FIXED_PARAMETERS = ['include_qtz', 'include_clc', 'include_dol',
+                     'include_x', 'name_x', 'name_log_x',
+                     'buckles_parameter']
+
+_VCLAY_WEIGHTS = ['vclay_linear_weight', 'vclay_clavier_weight',
+                  'vclay_larionov_weight', 'vclay_nphi_weight',
+                  'vclay_nphi_rhob_weight']
+_TOC_WEIGHTS = ['passey_nphi_weight', 'passey_rhob_weight',
+                'schmoker_weight']
+_SW_WEIGHTS = ['archie_weight', 'indonesia_weight', 'simandoux_weight',
+               'modified_simandoux_weight', 'waxman_smits_weight']
+
+# log curves written by MultimineralModel.apply as
+# (mnemonic, unit, description)
+_MODEL_CURVES = [
+    ('PHIE', 'v/v', 'Effective Porosity'),
+    ('SW', 'v/v', 'Water Saturation'),
+    ('SHC', 'v/v', 'Hydrocarbon Saturation'),
+    ('BVH', 'v/v', 'Bulk Volume Hydrocarbon'),
+    ('BVW', 'v/v', 'Bulk Volume Water'),
+    ('BVWI', 'v/v', 'Bulk Volume Water Irreducible'),
+    ('BVWF', 'v/v', 'Bulk Volume Water Free'),
+    ('BVOM', 'v/v', 'Bulk Volume Fraction Organic Matter'),
+    ('BVCLAY', 'v/v', 'Bulk Volume Fraction Clay'),
+    ('BVPYR', 'v/v', 'Bulk Volume Fraction Pyrite'),
+    ('VOM', 'v/v', 'Matrix Volume Fraction Organic Matter'),
+    ('VCLAY', 'v/v', 'Matrix Volume Fraction Clay'),
+    ('VPYR', 'v/v', 'Matrix Volume Fraction Pyrite'),
+    ('RHOM', 'g/cc', 'Matrix Density'),
+    ('TOC', 'wt/wt', 'Matrix Weight Fraction Organic Matter'),
+    ('WTCLAY', 'wt/wt', 'Matrix Weight Fraction Clay'),
+    ('WTPYR', 'wt/wt', 'Matrix Weight Fraction Pyrite'),
+]
+
+_MINERAL_NAMES = {'QTZ': 'Quartz', 'CLC': 'Calcite', 'DOL': 'Dolomite'}
+
+_OIL_CURVES = [('OIP', 'Mmbbl / section', 'Oil in Place')]
+
+_GAS_CURVES = [
+    ('GIP', 'BCF / section', 'Gas in Place'),
+    ('GIP_FREE', 'BCF / section', 'Free Gas in Place'),
+    ('GIP_ADS', 'BCF / section', 'Adsorbed Gas in Place'),
+]
+
+_DIAGNOSTICS_CURVES = [
+    ('MM_ITER', '', 'Multimineral Iterations'),
+    ('MM_SSE', '', 'Multimineral Sum of Squared Errors'),
+    ('MM_APE', '%', 'Multimineral Average Percent Error'),
+]
+
+
+def _compile(params, use_pe):
+    """
+    Parses the include flags and builds the endmember matrix of the
+    clean minerals from the keyword parameters of
+    :meth:`pet.Log.multimineral_model`.
+    """
+
+    p = dict(params)
+
+    minerals = []
+    for mineral in _MINERALS:
+        key = 'include_' + mineral.lower()
+        p[key] = str(p[key]).upper()[0] == 'Y'
+        if p[key]:
+            minerals.append(mineral)
+    p['minerals'] = minerals
+
+    if use_pe:
+        responses = ('rho', 'nphi', 'pe')
+    else:
+        responses = ('rho', 'nphi')
+    p['responses'] = responses
+
+    # rows are log responses, columns are minerals
+    p['endmembers'] = _response_matrix(p, responses, minerals)
+
+    # organics, clay and pyrite responses for the modeled logs
+    p['unconventional'] = _response_matrix(p, responses,
+                                           ['om', 'clay', 'pyr'])
+
+    p['vclay_weights_sum'] = p['vclay_linear_weight'] + \
+        p['vclay_clavier_weight'] + p['vclay_larionov_weight'] + \
+        p['vclay_nphi_weight'] + p['vclay_nphi_rhob_weight']
+
+    p['toc_weights'] = p['passey_nphi_weight'] + \
+        p['passey_rhob_weight'] + p['schmoker_weight']
+
+    p['weight_saturations'] = p['archie_weight'] + \
+        p['indonesia_weight'] + p['simandoux_weight'] + \
+        p['modified_simandoux_weight'] + p['waxman_smits_weight']
+
+    # clay volume and saturation models with a non zero weight
+    p['vclay_models'] = [w[len('vclay_'):-len('_weight')] for w in
+                         _VCLAY_WEIGHTS if p[w] != 0]
+    p['sw_models'] = [w[:-len('_weight')] for w in _SW_WEIGHTS if p[w] != 0]
+
+    p['use_pe'] = use_pe
+
+    # entries given per depth as arrays, set by MultimineralModel.uncertainty
+    p['per_depth'] = []
+
+    return p
+
+
+def _response_matrix(p, responses, components):
+    """
+    Matrix of log responses (rows) of components (columns). Parameters
+    given per depth as arrays give a matrix for each depth, of shape
+    (depths, responses, components).
+    """
+
+    values = [np.asarray(p['%s_%s' % (r, c.lower())], dtype = float)
+              for r in responses for c in components]
+    shape = np.broadcast_shapes(*[v.shape for v in values])
+
+    matrix = np.empty(shape + (len(responses), len(components)))
+    for i, v in enumerate(values):
+        matrix[..., i // len(components), i % len(components)] = v
+
+    return matrix
+
+
+def _initial_state(size):
+    """
+    Starting guesses for every depth, identical to the per-sample loop.
+    """
+
+    state = {
+        'PHIE': np.full(size, 0.1),
+        'RHOM': np.full(size, 2.68),
+        'RHO_FL': np.ones(size),
+        'NPHI_FL': np.ones(size),
+        'VOM': np.zeros(size),
+        'PREV': np.ones((len(_CONVERGENCE_ORDER), size)),
+    }
+
+    return state
+
+
+def _active_sets(k):
+    """
+    All assignments of k variables to free (0), lower bound (-1) and
+    upper bound (1), ordered by the number of variables held at a bound.
+    """
+
+    sets = itertools.product((0, -1, 1), repeat = k)
+    return sorted(sets, key = lambda s: sum(x != 0 for x in s))
+
+
+def _non_unique(a, x, lb, ub, tol):
+    """
+    Mask of the bounded least squares solutions x of a that are not the
+    only optimum, i.e. a direction in the null space of a keeps them
+    feasible. Null spaces of more than one dimension with a variable at
+    a bound are always flagged.
+
+    """
+
+    _, sv, vh = np.linalg.svd(a)
+    k = a.shape[2]
+    rank = np.sum(sv > sv[:, :1] * max(a.shape[1:]) * 1e-12, axis = 1)
+    nullity = k - rank
+
+    at_lower = x <= lb + tol
+    at_upper = x >= ub - tol
+    bound = (at_lower | at_upper).any(axis = 1)
+
+    ### one dimensional null space, check both directions ###
+    n = vh[:, -1, :]
+    eps = 1e-6
+    plus = np.all(~at_lower | (n >= -eps), axis = 1) & \
+           np.all(~at_upper | (n <= eps), axis = 1)
+    minus = np.all(~at_lower | (n <= eps), axis = 1) & \
+            np.all(~at_upper | (n >= -eps), axis = 1)
+
+    return bound & ((nullity > 1) | ((nullity == 1) & (plus | minus)))
+
+
+def bounded_lstsq(a, b, lb = 0, ub = 1, tol = 1e-9):
+    """
+    Solves many small bounded least squares problems in one call.
+
+        Finds x minimizing ||a x - b|| with lb <= x <= ub for every
+        right hand side in b. Each candidate active set (every
+        variable free, at its lower bound or at its upper bound) is
+        solved for all right hand sides at once, and a right hand side
+        is finished by the first candidate that is feasible and
+        satisfies the Karush-Kuhn-Tucker conditions, which is the
+        global minimum of this convex problem. Candidates are tried in
+        order of the number of bound variables, so when the
+        unconstrained minimum norm solution is feasible it is returned,
+        as with :func:`scipy.optimize.lsq_linear`. Right hand sides
+        that no candidate solves, which only happens for degenerate
+        systems, fall back to :func:`scipy.optimize.lsq_linear`, as do
+        right hand sides with more than one optimum.
+
+        Parameters
+        ----------
+        a : array_like
+            Matrix of shape (m, k) shared by every right hand side, or a
+            stack of matrices of shape (n, m, k), one per right hand
+            side.
+        b : array_like
+            Right hand sides of shape (n, m), or (m,) for a single
+            system.
+        lb : float or array_like (default 0)
+            Lower bound of each variable.
+        ub : float or array_like (default 1)
+            Upper bound of each variable.
+        tol : float (default 1e-9)
+            Tolerance for the bounds and the optimality conditions.
+
+        Returns
+        -------
+        x : :class:`numpy.ndarray`
+            Solutions of shape (n, k), or (k,) for a single system.
+            Systems with non finite values return nan.
+
+        Note
+        ----
+        The enumeration is exact and cheap for the 3 x 4 and 4 x 5
+        systems of the mineral inversion, but grows as 3 ** k.
+
+        When a system is underdetermined and the bounds are active,
+        the optimum can be non unique, and the optimum found by the
+        active sets is arbitrary. These right hand sides are solved by
+        lsq_linear, so the solution matches it in every case.
+
+        Example
+        -------
+        >>> import numpy as np
+        >>> from multimineral import bounded_lstsq
+        >>> # quartz, calcite and fluid density with unity row
+        >>> a = np.array([[2.65, 2.71, 1.0], [1, 1, 1]])
+        >>> b = np.array([[2.4, 1], [2.7, 1]])
+        >>> x = bounded_lstsq(a, b)
+
+    """
+
+    a = np.asarray(a, dtype = float)
+    b = np.asarray(b, dtype = float)
+
+    single = b.ndim == 1
+    if single:
+        b = b[None, :]
+
+    n = b.shape[0]
+    if a.ndim == 2:
+        a = np.broadcast_to(a, (n,) + a.shape)
+    k = a.shape[2]
+
+    lb = np.broadcast_to(np.asarray(lb, dtype = float), (k,))
+    ub = np.broadcast_to(np.asarray(ub, dtype = float), (k,))
+
+    x = np.full((n, k), np.nan)
+
+    finite = np.isfinite(a).all(axis = (1, 2)) & np.isfinite(b).all(axis = 1)
+    todo = np.where(finite)[0]
+    ambiguous = []
+
+    for status in _active_sets(k):
+        if len(todo) == 0:
+            break
+
+        status = np.asarray(status)
+        free = np.where(status == 0)[0]
+
+        a_todo = a[todo]
+        b_todo = b[todo]
+
+        x_try = np.empty((len(todo), k))
+        x_try[:, status == -1] = lb[status == -1]
+        x_try[:, status == 1] = ub[status == 1]
+
+        if len(free) > 0:
+            fixed = np.where(status != 0)[0]
+            r = b_todo - np.einsum('imk,ik->im', a_todo[:, :, fixed],
+                                   x_try[:, fixed])
+            a_free = a_todo[:, :, free]
+            x_try[:, free] = np.einsum('ikm,im->ik', np.linalg.pinv(a_free),
+                                       r)
+
+        ### feasibility of free variables ###
+        ok = np.all((x_try >= lb - tol) & (x_try <= ub + tol), axis = 1)
+
+        ### optimality of bound variables ###
+        grad = np.einsum('imk,im->ik', a_todo,
+                         np.einsum('imk,ik->im', a_todo, x_try) - b_todo)
+        scale = tol * (1 + np.abs(b_todo).max(axis = 1))
+        ok &= np.all(grad[:, status == -1] >= -scale[:, None], axis = 1)
+        ok &= np.all(grad[:, status == 1] <= scale[:, None], axis = 1)
+        ok &= np.all(np.abs(grad[:, free]) <= scale[:, None], axis = 1)
+
+        done = todo[ok]
+        x_done = np.clip(x_try[ok], lb, ub)
+        unique = np.ones(len(done), dtype = bool)
+        if len(done) > 0:
+            unique = ~_non_unique(a[done], x_done, lb, ub, tol)
+        x[done[unique]] = x_done[unique]
+        ambiguous.extend(done[~unique])
+        todo = todo[~ok]
+
+    for j in np.concatenate((todo, ambiguous)).astype(int):
+        x[j] = lsq_linear(a[j], b[j], bounds = (lb, ub)).x
+
+    if single:
+        return x[0]
+    return x
+
+
+def _iterate(inp, st, p, hc_class, active):
+    """
+    One step of the fixed point iteration on all depths in inp. Only
+    the active depths are inverted for minerals, with a single call to
+    :func:`bounded_lstsq`.
+
+    Returns a dict of the updated state and outputs, including the
+    residual of the modeled logs, and the absolute change in bulk
+    volumes used as convergence criteria.
+    """
+
+    rhob = inp['RHOB']
+    nphi = inp['NPHI']
+    ild = inp['ILD']
+    rw = inp['RW']
+
+    phie = st['PHIE']
+    rhom = st['RHOM']
+    rho_fl = st['RHO_FL']
+    nphi_fl = st['NPHI_FL']
+    vom = st['VOM']
+
+    ### log curves without organics ###
+    rhoba = rhob + (rhom - p['rho_om']) * vom
+    nphia = nphi + (p['nphi_matrix'] - p['nphi_om']) * vom
+
+    ### clay solver, only models with a non zero weight ###
+    vclay_models = p['vclay_models']
+    vclay = 0
+
+    if 'linear' in vclay_models or 'clavier' in vclay_models or \
+       'larionov' in vclay_models:
+        gr_index = np.clip((inp['GR'] - p['gr_matrix']) / \
+                           (p['gr_clay'] - p['gr_matrix']), 0, 1)
+
+    if 'linear' in vclay_models:
+        vclay_linear = gr_index
+        vclay = vclay + p['vclay_linear_weight'] * vclay_linear
+
+    if 'clavier' in vclay_models:
+        vclay_clavier = np.clip(1.7 - np.sqrt(3.38 - (gr_index + 0.7) ** 2),
+                                0, 1)
+        vclay = vclay + p['vclay_clavier_weight'] * vclay_clavier
+
+    if 'larionov' in vclay_models:
+        vclay_larionov = np.clip(0.083 * (2 ** (3.7 * gr_index) - 1), 0, 1)
+        vclay = vclay + p['vclay_larionov_weight'] * vclay_larionov
+
+    if 'nphi' in vclay_models:
+        vclay_nphi = np.clip((nphia - p['nphi_matrix']) / \
+                             (p['nphi_clay'] - p['nphi_matrix']), 0, 1)
+        vclay = vclay + p['vclay_nphi_weight'] * vclay_nphi
+
+    if 'nphi_rhob' in vclay_models:
+        m1 = (nphi_fl - p['nphi_matrix']) / (rho_fl - rhom)
+        x1 = nphia + m1 * (rhom - rhoba)
+        x2 = p['nphi_clay'] + m1 * (rhom - p['rho_clay'])
+        vclay_nphi_rhob = np.where(x2 - p['nphi_matrix'] != 0,
+                                   np.clip((x1 - p['nphi_matrix']) / \
+                                           (x2 - p['nphi_matrix']), 0, 1), 0)
+        vclay = vclay + p['vclay_nphi_rhob_weight'] * vclay_nphi_rhob
+
+    vclay = vclay / p['vclay_weights_sum']
+
+    vclay = np.clip(vclay, 0, 1)
+
+    bvclay = vclay * (1 - phie)
+
+    ### organics ###
+    organic = vclay > p['vclay_cutoff']
+
+    log_res = np.log10(ild / p['passey_baseline_res'])
+    passey_scale = 10 ** (2.297 - 0.1688 * p['passey_lom']) / 100
+
+    dlr_nphi = log_res + 4 * (nphi - p['passey_baseline_nphi'])
+    dlr_rhob = log_res - 2.5 * (rhob - p['passey_baseline_rhob'])
+
+    toc_nphi = np.clip(dlr_nphi * passey_scale, 0, 1)
+    toc_rhob = np.clip(dlr_rhob * passey_scale, 0, 1)
+    toc_sch = np.clip(p['schmoker_slope'] * \
+                      (p['schmoker_baseline_rhob'] - rhob), 0, 1)
+
+    toc = (p['passey_nphi_weight'] * toc_nphi + \
+           p['passey_rhob_weight'] * toc_rhob + \
+           p['schmoker_weight'] * toc_sch) / p['toc_weights']
+
+    volume_om = toc / p['rho_om']
+    rhom_no_om = (rhom - toc * p['rho_om']) / (1 - toc)
+    volume_else = (1 - toc) / rhom_no_om
+    volume_total = volume_om + volume_else
+
+    vom = np.where(organic, volume_om / volume_total, 0)
+    bvom = vom * (1 - phie)
+
+    ### pyrite correlation with organics ###
+    vpyr = np.clip(p['om_pyrite_slope'] * vom, 0, 1)
+    bvpyr = vpyr * (1 - phie)
+
+    ### remove effect of clay, organics, and pyrite ###
+    volume_unconventional = bvom + bvclay + bvpyr
+    rhob_clean = (rhob - (p['rho_om'] * bvom + p['rho_clay'] * bvclay + \
+                  p['rho_pyr'] * bvpyr)) / (1 - volume_unconventional)
+    nphi_clean = (nphi - (p['nphi_om'] * bvom + \
+                  p['nphi_clay'] * bvclay + p['nphi_pyr'] * bvpyr)) / \
+                  (1 - volume_unconventional)
+
+    size = len(rhob)
+    endmembers = p['endmembers']
+    n_rows = endmembers.shape[0] + 1
+    n_cols = endmembers.shape[1] + 1
+
+    ### C, V and L matrices from Chapter 4 of ###
+    ### Principles of Mathematical Petrophysics by Doveton ###
+    c_clean = np.empty((size, n_rows, n_cols))
+    c_clean[:, :-1, :-1] = endmembers
+    c_clean[:, -1, :] = 1
+    c_clean[:, 0, -1] = rho_fl
+    c_clean[:, 1, -1] = nphi_fl
+
+    l_clean = np.empty((size, n_rows))
+    l_clean[:, 0] = rhob_clean
+    l_clean[:, 1] = nphi_clean
+    l_clean[:, -1] = 1
+
+    l = np.empty((size, n_rows))
+    l[:, 0] = rhob
+    l[:, 1] = nphi
+    l[:, -1] = 1
+
+    if p['use_pe']:
+        pe = inp['PE']
+        c_clean[:, 2, -1] = p['pe_fl']
+        l_clean[:, 2] = (pe - (p['pe_om'] * bvom + p['pe_clay'] * bvclay + \
+                         p['pe_pyr'] * bvpyr)) / (1 - bvom - bvclay - bvpyr)
+        l[:, 2] = pe
+
+    bv_clean = np.full((size, n_cols), np.nan)
+    bv_clean[active] = bounded_lstsq(c_clean[active], l_clean[active])
+
+    component_sum = np.sum(bv_clean, axis = 1)
+    bv_clean = bv_clean / component_sum[:, None] * \
+               (1 - volume_unconventional)[:, None]
+
+    bv = {'BV' + mineral: np.zeros(size) for mineral in _MINERALS}
+    for s, mineral in enumerate(p['minerals']):
+        bv['BV' + mineral] = bv_clean[:, s]
+    phie = bv_clean[:, -1]
+
+    ### modeled logs from all components ###
+    l_hat = np.einsum('ijk,ik->ij', c_clean, bv_clean)
+    unconventional = p['unconventional']
+    l_hat[:, :-1] += bvom[:, None] * unconventional[..., 0] + \
+                     bvclay[:, None] * unconventional[..., 1] + \
+                     bvpyr[:, None] * unconventional[..., 2]
+    l_hat[:, -1] += bvom + bvclay + bvpyr
+
+    sse = np.sum((l - l_hat) ** 2, axis = 1)
+    avg_percent_error = np.mean(np.abs(l - l_hat) / l, axis = 1) * 100
+
+    cur = np.asarray([bv['BVQTZ'], bv['BVCLC'], bv['BVDOL'], bv['BVX'],
+                      phie, bvom, bvclay, bvpyr])
+    diff = np.abs(cur - st['PREV']).sum(axis = 0)
+
+    ### matrix volume fraction ###
+    per_matrix = 1 - phie
+
+    vqtz = bv['BVQTZ'] / per_matrix
+    vclc = bv['BVCLC'] / per_matrix
+    vdol = bv['BVDOL'] / per_matrix
+    vx = bv['BVX'] / per_matrix
+    vclay = bvclay / per_matrix
+    vom = bvom / per_matrix
+    vpyr = bvpyr / per_matrix
+
+    ### weight fraction ###
+    mass_qtz = vqtz * p['rho_qtz']
+    mass_clc = vclc * p['rho_clc']
+    mass_dol = vdol * p['rho_dol']
+    mass_x = vx * p['rho_x']
+    mass_om = vom * p['rho_om']
+    mass_clay = vclay * p['rho_clay']
+    mass_pyr = vpyr * p['rho_pyr']
+
+    rhom = mass_qtz + mass_clc + mass_dol + mass_x + mass_om + \
+           mass_clay + mass_pyr
+
+    ### saturations, only models with a non zero weight ###
+    sw_models = p['sw_models']
+    sw = 0
+
+    phis = np.where(phie < 0.001, 0.001, phie)
+
+    a, m, n = p['a'], p['m'], p['n']
+    rt_clay = p['rt_clay']
+
+    if 'archie' in sw_models:
+        sw_archie = np.clip(((a * rw) / (ild * (phis ** m))) ** (1 / n),
+                            0, 1)
+        sw = sw + p['archie_weight'] * sw_archie
+
+    if 'indonesia' in sw_models:
+        sw_ind_a = (phie ** m / rw) ** 0.5
+        sw_ind_b = (vclay ** (2.0 - vclay) / rt_clay) ** 0.5
+        sw_indonesia = np.clip(((sw_ind_a + sw_ind_b) ** 2.0 * ild) ** \
+                               (-1 / n), 0, 1)
+        sw = sw + p['indonesia_weight'] * sw_indonesia
+
+    if 'simandoux' in sw_models:
+        c = (1.0 - vclay) * a * rw / (phis ** m)
+        d = c * vclay / (2.0 * rt_clay)
+        e = c / ild
+        sw_simandoux = np.clip(((d ** 2 + e) ** 0.2 - d) ** (2 / n), 0, 1)
+        sw = sw + p['simandoux_weight'] * sw_simandoux
+
+    if 'modified_simandoux' in sw_models:
+        sw_mod_simd = np.clip((0.5 * rw / phis ** m) * ((4 * phis ** m) / \
+                              (rw * ild) + (vclay / rt_clay) ** 2) ** \
+                              (1 / n) - vclay / rt_clay, 0, 1)
+        sw = sw + p['modified_simandoux_weight'] * sw_mod_simd
+
+    if 'waxman_smits' in sw_models:
+        cec = np.where(p['cec'] <= 0, 10 ** (1.9832 * vclay - 2.4473),
+                       p['cec'])
+
+        rw77 = ild * (inp['RES_TEMP'] + 6.8) / 83.8
+        b = 4.6 * (1 - 0.6 * np.exp(-0.77 / rw77))
+        f = a / (phis ** m)
+        qv = cec * (1 - phis) * rhom / phis
+        sw_waxman_smits = np.clip(0.5 * ((-b * qv * rw77) + \
+                                  ((b * qv * rw77) ** 2 + 4 * f * rw / ild) \
+                                  ** 0.5) ** (2 / n), 0, 1)
+        sw = sw + p['waxman_smits_weight'] * sw_waxman_smits
+
+    sw = sw / p['weight_saturations']
+
+    bvw = phie * sw
+    bvh = phie * (1 - sw)
+
+    new = {
+        'PHIE': phie, 'SW': sw, 'BVW': bvw, 'BVH': bvh,
+        'BVOM': bvom, 'BVCLAY': bvclay, 'BVPYR': bvpyr,
+        'VOM': vom, 'VCLAY': vclay, 'VPYR': vpyr,
+        'RHOM': rhom, 'TOC': mass_om / rhom,
+        'WTCLAY': mass_clay / rhom, 'WTPYR': mass_pyr / rhom,
+        'BVQTZ': bv['BVQTZ'], 'BVCLC': bv['BVCLC'],
+        'BVDOL': bv['BVDOL'], 'BVX': bv['BVX'],
+        'VQTZ': vqtz, 'VCLC': vclc, 'VDOL': vdol, 'VX': vx,
+        'WTQTZ': mass_qtz / rhom, 'WTCLC': mass_clc / rhom,
+        'WTDOL': mass_dol / rhom, 'WTX': mass_x / rhom,
+        'MM_SSE': sse, 'MM_APE': avg_percent_error,
+        'PREV': cur,
+    }
+
+    new.update(_hydrocarbons(inp, bvh, vom, p, hc_class))
+
+    new['RHO_FL'] = inp['RHO_W'] * sw + inp['RHO_HC'] * (1 - sw)
+    new['NPHI_FL'] = inp['NPHI_W'] * sw + inp['NPHI_HC'] * (1 - sw)
+
+    return new, diff
+
+
+def _hydrocarbons(inp, bvh, vom, p, hc_class):
+    """
+    Oil in place, or free, adsorbed and total gas in place, of each
+    depth from the bulk volume of hydrocarbon and organic matter.
+    """
+
+    hc = {}
+
+    sample_rate = inp['SAMPLE_RATE']
+    if hc_class == 'OIL':
+        # Mmbbl per sample rate
+        hc['OIP'] = (7758 * 640 * sample_rate * bvh * 10 ** -6) / inp['BO']
+
+    elif hc_class == 'GAS':
+        langslope = (-0.08 * inp['RES_TEMP'] + 2 * p['ro'] + 22.75) / 2
+        gas_ads = langslope * vom * 100 * \
+                  (inp['PORE_PRESS'] / (inp['PORE_PRESS'] + p['lang_press']))
+
+        # BCF per sample rate
+        hc['GIP_FREE'] = (43560 * 640 * sample_rate * bvh * 10 ** -9) / \
+                         inp['BG']
+        hc['GIP_ADS'] = (1359.7 * 640 * sample_rate * inp['RHOB'] * \
+                         gas_ads * 10 ** -9) / inp['BG']
+        hc['GIP'] = hc['GIP_FREE'] + hc['GIP_ADS']
+
+    return hc
+
+
+def _fixed_point(inp, state, p, hc_class, max_iter, tol,
+                 retire_converged):
+    """
+    Iterates every depth in inp from the starting state until it
+    converges or reaches max_iter.
+    """
+
+    size = len(inp['RHOB'])
+    state['MM_ITER'] = np.zeros(size)
+    active = np.ones(size, dtype = bool)
+
+    counter = 0
+    with np.errstate(all = 'ignore'):
+        # at least one step, so every output exists even without depths
+        while counter < max_iter:
+            counter += 1
+
+            if retire_converged:
+                idx = np.where(active)[0]
+                p_active = dict(p)
+                for k in p['per_depth']:
+                    p_active[k] = p[k][idx]
+                new, diff = _iterate({k: v[idx] for k, v in inp.items()},
+                                     {k: v[..., idx] for k, v in
+                                      state.items()},
+                                     p_active, hc_class,
+                                     np.ones(len(idx), dtype = bool))
+                for k, v in new.items():
+                    if k not in state:
+                        state[k] = np.full(v.shape[:-1] + (size,), np.nan)
+                    state[k][..., idx] = v
+
+                state['MM_ITER'][idx] = counter
+                active[idx] = diff > tol
+
+            else:
+                new, diff = _iterate(inp, state, p, hc_class, active)
+
+                ### converged depths keep the values of their last step ###
+                for k, v in new.items():
+                    if k in state:
+                        state[k] = np.where(active, v, state[k])
+                    else:
+                        state[k] = v
+
+                state['MM_ITER'][active] = counter
+                active = active & (diff > tol)
+
+            if not active.any():
+                break
+
+    return state
+
+
+def _same_run(log, key, top, bottom):
+    """
+    True if the MM_KEY, MM_TOP and MM_BOT header parameters of log match
+    key, top and bottom.
+
+    """
+
+    try:
+        return str(log.params['MM_KEY'].value) == key and \
+            float(log.params['MM_TOP'].value) == float(top) and \
+            float(log.params['MM_BOT'].value) == float(bottom)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _log_inputs(log, top, bottom):
+    """
+    Checks the curves required by the model and reads them from log at
+    the depths between top and bottom with no null values.
+
+    Returns the curves, the sample rate of each depth, the hydrocarbon
+    class, use_pe, and the indices of the depths between top and bottom
+    and of the valid depths among them.
+    """
+
+    ### check for requirements ###
+    use_pe = 'PE' in log.keys()
+    required_raw_curves = list(RAW_CURVES)
+    if use_pe:
+        required_raw_curves += ['PE']
+
+    for curve in required_raw_curves:
+        if curve not in log.keys():
+            raise ValueError('Raw curve %s not found and is required for multimineral_model.' % curve)
+
+    for curve in FLUID_CURVES:
+        if curve not in log.keys():
+            raise ValueError('Fluid Properties curve %s not found. Run fluid_properties before multimineral_model.' % curve)
+
+    all_required_curves = required_raw_curves + FLUID_CURVES
+
+    if 'BO' not in log.keys() and 'BG' not in log.keys():
+        raise ValueError('Formation Volume Factor required for multimineral_model. Run fluid_properties first.')
+
+    if 'BO' in log.keys():
+        hc_class = 'OIL'
+    else:
+        hc_class = 'GAS'
+
+    ### screen depths with null values ###
+    depths = log[0]
+    depth_index = np.intersect1d(np.where(depths >= top)[0],
+                                 np.where(depths < bottom)[0])
+
+    valid = np.ones(len(depth_index), dtype = bool)
+    for x in all_required_curves:
+        valid &= np.isfinite(log[x][depth_index])
+    valid_index = depth_index[valid]
+
+    sample_rates = np.empty(len(depths))
+    sample_rates[1:] = np.abs(np.diff(depths))
+    if len(depths) > 1:
+        sample_rates[0] = abs(depths[0] - depths[1])
+
+    curves = {x: log[x][valid_index] for x in all_required_curves}
+    if hc_class == 'OIL':
+        curves['BO'] = log['BO'][valid_index]
+    else:
+        curves['BG'] = log['BG'][valid_index]
+
+    return curves, sample_rates[valid_index], hc_class, use_pe, \
+           depth_index, valid_index
+
+
+def _nanpercentile(values, q):
+    """
+    Percentile q of each column of values ignoring nan, with linear
+    interpolation as :func:`numpy.nanpercentile`, which loops over
+    columns in python when there are nan values.
+    """
+
+    ordered = np.sort(values, axis = 0)
+    count = np.sum(~np.isnan(values), axis = 0)
+
+    position = np.maximum(count - 1, 0) * q / 100.0
+    low = np.floor(position).astype(int)
+    high = np.minimum(low + 1, np.maximum(count - 1, 0))
+    fraction = position - low
+
+    columns = np.arange(values.shape[1])
+    result = ordered[low, columns] * (1 - fraction) + \
+             ordered[high, columns] * fraction
+    result[count == 0] = np.nan
+
+    return result
+
+
+def _realizations(distributions, grid, n_realizations, seed):
+    """
+    Parameter values of every realization as 1D arrays keyed by
+    parameter, sampled from distributions or taken from every
+    combination of the values in grid.
+    """
+
+    if (distributions is None) == (grid is None):
+        raise ValueError('Give one of distributions or grid.')
+
+    if grid is not None:
+        names = list(grid.keys())
+        combinations = list(itertools.product(*[np.atleast_1d(grid[k])
+                                                for k in names]))
+        return {k: np.asarray([c[i] for c in combinations], dtype = float)
+                for i, k in enumerate(names)}
+
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, spec in distributions.items():
+        if isinstance(spec, tuple):
+            kind = spec[0]
+            if kind == 'normal':
+                samples[name] = rng.normal(spec[1], spec[2], n_realizations)
+            elif kind == 'uniform':
+                samples[name] = rng.uniform(spec[1], spec[2], n_realizations)
+            elif kind == 'triangular':
+                samples[name] = rng.triangular(spec[1], spec[2], spec[3],
+                                               n_realizations)
+            else:
+                raise ValueError('Distribution of %s must be normal, '
+                                 'uniform or triangular, not %s.' % \
+                                 (name, kind))
+        else:
+            samples[name] = np.asarray(spec, dtype = float)
+            if samples[name].shape != (n_realizations,):
+                raise ValueError('%s must have n_realizations values.' % \
+                                 name)
+
+    return samples
+
+
+class MultimineralModel(object):
+    """
+    Multimineral model with its parameters validated and compiled once,
+    for applying the same model to many logs.
+
+        The keyword parameters are those of
+        :meth:`pet.Log.multimineral_model`, and parameters that are not
+        given take the same defaults. On creation the include flags are
+        parsed, the endmember matrices of the clean minerals are built
+        with and without PE, and the clay volume, toc and saturation
+        weights are summed, so :meth:`apply` only reads curves, runs
+        the iteration and writes the results.
+
+        Parameters
+        ----------
+        **params
+            Keyword parameters of :meth:`pet.Log.multimineral_model`,
+            from gr_matrix to buckles_parameter.
+
+        Attributes
+        ----------
+        params : dict
+            All model parameters, including defaults.
+        sw_models : list
+            Saturation models with a non zero weight.
+
+        Raises
+        ------
+        ValueError
+            If a parameter is not a parameter of the model.
+
+        ValueError
+            If an include flag is not 'YES' or 'NO'.
+
+        ValueError
+            If a clay volume, toc or saturation weight is negative, or
+            all weights of one of them are 0.
+
+        Example
+        -------
+        >>> import pet
+        >>> from multimineral import MultimineralModel
+        >>> model = MultimineralModel(include_dol = 'NO',
+        ...                           archie_weight = 0,
+        ...                           indonesia_weight = 1)
+        >>> for path in las_paths:
+        ...     log = pet.Log(path)
+        ...     log.precondition()
+        ...     log.fluid_properties()
+        ...     model.apply(log)
+
+        See Also
+        --------
+        :meth:`pet.Log.multimineral_model`
+            applies a model built from its keyword parameters
+
+    """
+
+    def __init__(self, **params):
+
+        unknown = sorted(set(params) - set(DEFAULT_PARAMETERS))
+        if len(unknown) > 0:
+            raise ValueError('Unknown multimineral_model parameters %s.' % \
+                             ', '.join(unknown))
+
+        self.params = dict(DEFAULT_PARAMETERS)
+        self.params.update(params)
+
+        for mineral in _MINERALS:
+            key = 'include_' + mineral.lower()
+            if str(self.params[key]).upper()[:1] not in ('Y', 'N'):
+                raise ValueError('%s must be YES or NO, not %s.' % \
+                                 (key, self.params[key]))
+
+        for weights in (_VCLAY_WEIGHTS, _TOC_WEIGHTS, _SW_WEIGHTS):
+            if any(self.params[w] < 0 for w in weights):
+                raise ValueError('Weights %s must not be negative.' % \
+                                 ', '.join(weights))
+            if sum(self.params[w] for w in weights) == 0:
+                raise ValueError('At least one of %s must be greater '
+                                 'than 0.' % ', '.join(weights))
+
+        self._compiled = {use_pe: _compile(self.params, use_pe)
+                          for use_pe in (False, True)}
+
+        self.sw_models = self._compiled[True]['sw_models']
+
+    def key(self, max_iter = 20, tol = 1e-3):
+        """
+        Short hash of the parameters of the model and the iteration
+        settings, stored in the MM_KEY header parameter by :meth:`apply`.
+
+        """
+
+        text = repr((sorted((k, str(v)) for k, v in self.params.items()),
+                     int(max_iter), float(tol)))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def output_curves(self, hc_class, diagnostics = False):
+        """
+        Log curves written by :meth:`apply`.
+
+            Parameters
+            ----------
+            hc_class : str {'OIL', 'GAS'}
+                Hydrocarbon class of the reservoir.
+            diagnostics : bool (default False)
+                Include the MM_ITER, MM_SSE and MM_APE curves.
+
+            Returns
+            -------
+            list
+                Tuples of (mnemonic, key, unit, description) where key
+                is the name of the curve in the results of
+                :meth:`arrays`.
+
+        """
+
+        p = self._compiled[True]
+
+        curves = [(c[0], c[0], c[1], c[2]) for c in _MODEL_CURVES]
+
+        for mineral in p['minerals']:
+            if mineral == 'X':
+                name = self.params['name_x']
+                name_log = self.params['name_log_x'].upper()
+            else:
+                name = _MINERAL_NAMES[mineral]
+                name_log = mineral
+            curves += [
+                ('BV' + name_log, 'BV' + mineral, 'v/v',
+                 'Bulk Volume Fraction ' + name),
+                ('V' + name_log, 'V' + mineral, 'v/v',
+                 'Matrix Volume Fraction ' + name),
+                ('WT' + name_log, 'WT' + mineral, 'wt/wt',
+                 'Matrix Weight Fraction ' + name),
+            ]
+
+        if hc_class == 'OIL':
+            extra = _OIL_CURVES
+        else:
+            extra = _GAS_CURVES
+        if diagnostics:
+            extra = extra + _DIAGNOSTICS_CURVES
+        curves += [(c[0], c[0], c[1], c[2]) for c in extra]
+
+        return curves
+
+    def arrays(self, curves, sample_rate, hc_class, use_pe, max_iter = 20,
+               tol = 1e-3, retire_converged = True, warm_start = None,
+               coarse_step = 10, n_jobs = 1, chunk_size = None):
+        """
+        Runs the multimineral fixed point iteration on whole depth
+        arrays.
+
+            Parameters
+            ----------
+            curves : dict
+                1D arrays of the raw and fluid property curves keyed by
+                mnemonic, already limited to valid depths. Must include
+                the curves in RAW_CURVES and FLUID_CURVES, PE when use_pe
+                is True, and BO or BG according to hc_class.
+            sample_rate : :class:`numpy.ndarray`
+                Depth increment of each sample, used for hydrocarbons in
+                place.
+            hc_class : str {'OIL', 'GAS'}
+                Hydrocarbon class of the reservoir.
+            use_pe : bool
+                Include the photoelectric curve in the mineral inversion.
+            max_iter : int (default 20)
+                Maximum number of iterations for each depth.
+            tol : float (default 1e-3)
+                A depth has converged when the sum of absolute changes of
+                its bulk volumes between iterations is not greater than
+                tol.
+            retire_converged : bool (default True)
+                If True, converged depths are removed from the working
+                set and later iterations only evaluate the unconverged
+                depths. If False, every iteration evaluates all depths
+                and converged depths are masked, which is slower but
+                keeps array shapes fixed.
+            warm_start : {None, 'previous', 'coarse'} (default None)
+                Starting guesses of the iteration. None starts every
+                depth from the default guesses (PHIE 0.1, RHOM 2.68,
+                fluid density and neutron 1, VOM 0). 'previous' solves
+                every second depth from the default guesses, then starts
+                each remaining depth from the converged state of the
+                depth above it. 'coarse' solves every coarse_step depth
+                from the default guesses, then starts each remaining
+                depth from the converged state of the nearest coarse
+                depth above it. Warm started depths that reach max_iter
+                are solved again from the default guesses.
+            coarse_step : int (default 10)
+                Spacing in samples of the pre-solve for
+                warm_start = 'coarse'.
+            n_jobs : int (default 1)
+                Number of processes. If greater than 1, the depths are
+                split into chunks that are evaluated in a process pool.
+                The input curves are placed in shared memory, and each
+                worker writes its chunk into a shared output block, so
+                only the chunk bounds and the compiled model are
+                pickled. -1 uses every cpu.
+            chunk_size : int (default None)
+                Number of depths per chunk when n_jobs > 1. Defaults to
+                four chunks per process.
+
+            Returns
+            -------
+            dict
+                1D arrays of the model curves keyed by mnemonic. Mineral
+                X is returned under the generic BVX, VX and WTX keys.
+                Diagnostics are returned as MM_ITER, the number of
+                iterations of each depth, MM_SSE, the sum of squared
+                errors of the modeled logs, and MM_APE, the average
+                percent error of the modeled logs.
+
+            Note
+            ----
+            Outputs agree with the per sample loop of
+            :meth:`pet.Log.multimineral_model` to within 1e-4 for every
+            curve, the tolerance of :func:`scipy.optimize.lsq_linear` in
+            the loop. Without PE the clean mineral system is
+            underdetermined and, at depths where the bounds are active,
+            the split between minerals can be non unique. Those depths
+            are solved by lsq_linear as in the loop, which makes the
+            engine several times slower than with PE.
+
+            Waxman Smits with a correlated cec (:code:`cec <= 0`) is
+            evaluated for each depth here, while the loop keeps the cec
+            of the first evaluated depth.
+
+            A warm started depth begins next to its converged state, so
+            it usually needs fewer iterations, but it stops at a
+            different point within tol of the fixed point. Warm starting
+            trades accuracy for little speed: on test wells 'previous'
+            saved no time and 'coarse' about 10%, while SW moved by more
+            than 0.01 at 0.1 to 0.2% of depths with 'previous' and 0.5
+            to 0.6% with 'coarse', by up to 0.3, mostly where PHIE is
+            under 0.05 and SW is sensitive to small changes in bulk
+            volumes. Depths that reach max_iter from the warm start are
+            solved again from the default guesses, so they match a run
+            without warm_start, at the cost of their iterations.
+
+            Raises
+            ------
+            ValueError
+                If warm_start is not None, 'previous' or 'coarse'.
+
+        """
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+
+        if n_jobs > 1:
+            return _multimineral_parallel(self, curves, sample_rate,
+                                          hc_class, use_pe, n_jobs,
+                                          chunk_size,
+                                          dict(max_iter = max_iter,
+                                               tol = tol,
+                                               retire_converged = \
+                                                   retire_converged,
+                                               warm_start = warm_start,
+                                               coarse_step = coarse_step))
+
+        p = self._compiled[bool(use_pe)]
+
+        inp = {k: np.asarray(v, dtype = float) for k, v in curves.items()}
+        inp['SAMPLE_RATE'] = np.asarray(sample_rate, dtype = float)
+
+        size = len(inp['RHOB'])
+        if warm_start is None:
+            state = _fixed_point(inp, _initial_state(size), p, hc_class,
+                                 max_iter, tol, retire_converged)
+
+        elif warm_start in ('previous', 'coarse'):
+            if warm_start == 'previous':
+                step = 2
+            else:
+                step = max(int(coarse_step), 2)
+
+            ### pre-solve the coarse depths from the default guesses ###
+            coarse = np.arange(0, size, step)
+            coarse_state = _fixed_point({k: v[coarse] for k, v in
+                                         inp.items()},
+                                        _initial_state(len(coarse)), p,
+                                        hc_class, max_iter, tol,
+                                        retire_converged)
+
+            state = {}
+            for k, v in coarse_state.items():
+                state[k] = np.empty(v.shape[:-1] + (size,))
+                state[k][..., coarse] = v
+
+            ### seed the remaining depths from the preceding coarse depth ###
+            fine = np.setdiff1d(np.arange(size), coarse)
+            if len(fine) > 0:
+                seed = _initial_state(len(fine))
+                for k in seed:
+                    seed[k] = coarse_state[k][..., fine // step]
+                fine_state = _fixed_point({k: v[fine] for k, v in
+                                           inp.items()},
+                                          seed, p, hc_class, max_iter, tol,
+                                          retire_converged)
+
+                ### retry depths that did not converge from the default guesses ###
+                retry = fine_state['MM_ITER'] >= max_iter
+                if retry.any():
+                    cold_state = _fixed_point({k: v[fine[retry]] for k, v in
+                                               inp.items()},
+                                              _initial_state(retry.sum()), p,
+                                              hc_class, max_iter, tol,
+                                              retire_converged)
+                    for k, v in cold_state.items():
+                        fine_state[k][..., retry] = v
+
+                for k, v in fine_state.items():
+                    state[k][..., fine] = v
+
+        else:
+            raise ValueError('warm_start must be None, previous or coarse, '
+                             'not %s.' % warm_start)
+
+        ### find irreducible water if buckles_parameter is specified ###
+        buckles_parameter = self.params['buckles_parameter']
+        if buckles_parameter > 0:
+            with np.errstate(all = 'ignore'):
+                sw_irr = buckles_parameter / \
+                         (state['PHIE'] / (1 - state['VCLAY']))
+                state['BVWI'] = state['PHIE'] * sw_irr
+                state['BVWF'] = state['BVW'] - state['BVWI']
+
+        state['SHC'] = 1 - state['SW']
+
+        for k in ('PREV', 'RHO_FL', 'NPHI_FL'):
+            state.pop(k)
+
+        return state
+
+    def apply(self, log, top = 0, bottom = 100000, max_iter = 20,
+              tol = 1e-3, retire_converged = True, diagnostics = False,
+              warm_start = None, coarse_step = 10, n_jobs = 1,
+              chunk_size = None, incremental = False):
+        """
+        Calculates the model on a log between top and bottom, adding
+        the output curves to the log if they are not present.
+
+            Parameters
+            ----------
+            log : :class:`pet.Log`
+                Log with the raw curves and the curves of
+                :meth:`pet.Log.fluid_properties`. Output curves are
+                added with :meth:`pet.Log.append_curves`.
+            top : float (default 0)
+                Top depth to apply the model.
+            bottom : float (default 100000)
+                Bottom depth to apply the model.
+            diagnostics : bool (default False)
+                If True, adds the solver diagnostics curves MM_ITER,
+                MM_SSE and MM_APE.
+            incremental : bool (default False)
+                If True and the output curves are present, only depths
+                where an input curve of the iteration was modified since
+                the last run are recomputed, as recorded by
+                :meth:`pet.Log.mark_dirty`. Depths where only BO, BG or
+                PORE_PRESS were modified, such as after a bulk shift of
+                a formation volume factor, only have OIP or GIP
+                recomputed from the stored PHIE, SW and VOM. Other
+                depths are left untouched. If the parameters, max_iter,
+                tol, top or bottom differ from the last run, as recorded
+                in the MM_KEY, MM_TOP and MM_BOT header parameters, every
+                depth is recomputed.
+
+            The remaining parameters are passed to :meth:`arrays`.
+
+            Note
+            ----
+            Every depth is iterated independently from the default
+            guesses, so an incremental run gives the same curves as a
+            full run. With warm_start, recomputed depths are warm
+            started only from other recomputed depths. The modification
+            records of the input curves are cleared between top and
+            bottom after each run, and MM_KEY, MM_TOP and MM_BOT are set
+            to the run.
+
+            Raises
+            ------
+            ValueError
+                If raw curves GR, NPHI, RHOB, and ILD are not present.
+
+            ValueError
+                If fluid properties curves are not present in log.
+
+            ValueError
+                If no formation value factor is found.
+
+        """
+
+        curves, sample_rate, hc_class, use_pe, depth_index, valid_index = \
+            _log_inputs(log, top, bottom)
+
+        output_curves = self.output_curves(hc_class,
+                                           diagnostics = diagnostics)
+
+        ### select modified depths for incremental recompute ###
+        key = self.key(max_iter, tol)
+        run = np.ones(len(valid_index), dtype = bool)
+        hc_only = np.zeros(len(valid_index), dtype = bool)
+        if incremental and _same_run(log, key, top, bottom) and \
+           all(c[0] in log.keys() for c in output_curves):
+            dirty = np.zeros(len(log[0]), dtype = bool)
+            dirty[log.dirty_index(_ITERATION_CURVES)] = True
+            run = dirty[valid_index]
+
+            dirty[:] = False
+            dirty[log.dirty_index(_HC_CURVES)] = True
+            hc_only = dirty[valid_index] & ~run
+
+        results = self.arrays({k: v[run] for k, v in curves.items()},
+                              sample_rate[run], hc_class,
+                              use_pe, max_iter = max_iter, tol = tol,
+                              retire_converged = retire_converged,
+                              warm_start = warm_start,
+                              coarse_step = coarse_step, n_jobs = n_jobs,
+                              chunk_size = chunk_size)
+
+        ### write results, adding output curves if not found ###
+        log.append_curves([{'mnemonic': mnemonic, 'data': results.get(key),
+                            'unit': unit, 'descr': descr}
+                           for mnemonic, key, unit, descr in output_curves],
+                          depth_index = valid_index[run])
+
+        ### hydrocarbons in place from the stored model curves ###
+        if hc_only.any():
+            hc_index = valid_index[hc_only]
+            inp = {k: np.asarray(v[hc_only], dtype = float)
+                   for k, v in curves.items()}
+            inp['SAMPLE_RATE'] = sample_rate[hc_only]
+
+            with np.errstate(all = 'ignore'):
+                hc = _hydrocarbons(inp, log['BVH'][hc_index],
+                                   log['VOM'][hc_index],
+                                   self._compiled[use_pe], hc_class)
+            log.append_curves([{'mnemonic': k, 'data': v}
+                               for k, v in hc.items()],
+                              depth_index = hc_index)
+
+        log.clear_dirty(_ITERATION_CURVES + _HC_CURVES, depth_index)
+
+        log.params['MM_KEY'] = HeaderItem(mnemonic = 'MM_KEY', value = key,
+            descr = 'Multimineral model parameter key')
+        log.params['MM_TOP'] = HeaderItem(mnemonic = 'MM_TOP',
+            value = float(top), descr = 'Multimineral model top depth')
+        log.params['MM_BOT'] = HeaderItem(mnemonic = 'MM_BOT',
+            value = float(bottom), descr = 'Multimineral model bottom depth')
+
+        ### find irreducible water saturation from calculated values ###
+        buckles_parameter = self.params['buckles_parameter']
+        if buckles_parameter < 0:
+            buckles_parameter = np.mean(log['PHIE'][depth_index] * \
+                                        log['SW'][depth_index])
+
+            ir_denom = (log['PHIE'][depth_index] / \
+                       (1 - log['VCLAY'][depth_index]))
+            ir_denom[np.where(ir_denom < 0.001)[0]] = 0.001
+            sw_irr = buckles_parameter / ir_denom
+
+            log['BVWI'][depth_index] = log['PHIE'][depth_index] * sw_irr
+
+            log['BVWF'][depth_index] = log['BVW'][depth_index] - \
+                                       log['BVWI'][depth_index]
+
+
+    def uncertainty(self, log, distributions = None, grid = None,
+                    n_realizations = 100, seed = None, top = 0,
+                    bottom = 100000, max_iter = 20, tol = 1e-3,
+                    batch_size = None):
+        """
+        Evaluates many realizations of the model with varied parameters
+        and adds P10, P50 and P90 curves of PHIE, SW and OIP or GIP to
+        the log.
+
+            The realizations are stacked along the depth axis, with the
+            varied parameters given per depth, so each batch of
+            realizations is a single pass of the iteration instead of a
+            separate run of the model on a copy of the log.
+
+            Parameters
+            ----------
+            log : :class:`pet.Log`
+                Log with the raw curves and the curves of
+                :meth:`pet.Log.fluid_properties`.
+            distributions : dict (default None)
+                Distribution of each varied parameter, as
+                ('normal', mean, std), ('uniform', low, high),
+                ('triangular', low, mode, high) or an array of
+                n_realizations values. Keys are model parameters, such
+                as rho_clay, gr_clay, m or n, or input curves, such as
+                RW, which are multiplied by the sampled values.
+            grid : dict (default None)
+                Values of each varied parameter. Every combination of
+                the values is a realization. Give one of distributions
+                or grid.
+            n_realizations : int (default 100)
+                Number of realizations sampled from distributions.
+            seed : int (default None)
+                Seed of the random number generator.
+            top : float (default 0)
+                Top depth to apply the model.
+            bottom : float (default 100000)
+                Bottom depth to apply the model.
+            max_iter : int (default 20)
+                Maximum number of iterations for each depth.
+            tol : float (default 1e-3)
+                Convergence tolerance, see :meth:`arrays`.
+            batch_size : int (default None)
+                Realizations evaluated in one pass. Defaults to about
+                20000 depths per pass, which keeps the working arrays
+                in cache.
+
+            Returns
+            -------
+            dict
+                P10, P50 and P90 of the total OIP or GIP between top
+                and bottom, keyed by curve and then by percentile.
+
+            Note
+            ----
+            Percentiles follow the reserves convention: P90 is the value
+            exceeded by 90% of realizations, which is the 10th
+            percentile, and P10 is the 90th percentile. Curves are named
+            like PHIE_P10, SW_P50 and OIP_P90.
+
+            Raises
+            ------
+            ValueError
+                If both or neither of distributions and grid are given,
+                or a distribution is unknown.
+
+            ValueError
+                If a varied parameter is a weight, an include flag, a
+                mineral name or buckles_parameter, or is not a parameter
+                or input curve of the model.
+
+            Example
+            -------
+            >>> model = MultimineralModel()
+            >>> totals = model.uncertainty(log, distributions = {
+            ...     'rho_clay': ('normal', 2.64, 0.03),
+            ...     'm': ('triangular', 1.8, 2, 2.2),
+            ...     'RW': ('uniform', 0.8, 1.2)}, n_realizations = 200)
+            >>> totals['OIP']['P50']
+
+        """
+
+        curves, sample_rate, hc_class, use_pe, depth_index, valid_index = \
+            _log_inputs(log, top, bottom)
+
+        samples = _realizations(distributions, grid, n_realizations, seed)
+
+        fixed = _VCLAY_WEIGHTS + _TOC_WEIGHTS + _SW_WEIGHTS + \
+                _FIXED_PARAMETERS
+        for name in samples:
+            if name in curves:
+                continue
+            if name not in DEFAULT_PARAMETERS or name in fixed:
+                raise ValueError('%s can not vary between realizations.' % \
+                                 name)
+
+        n_real = len(next(iter(samples.values())))
+        size = len(sample_rate)
+
+        if hc_class == 'OIL':
+            hc_curve = 'OIP'
+        else:
+            hc_curve = 'GIP'
+        names = ['PHIE', 'SW', hc_curve]
+
+        values = {k: np.empty((n_real, size)) for k in names}
+
+        if batch_size is None:
+            batch_size = 20000 // max(size, 1)
+        batch_size = max(int(batch_size), 1)
+
+        base = self._compiled[use_pe]
+        for start in range(0, n_real, batch_size):
+            stop = min(start + batch_size, n_real)
+
+            ### stack realizations along the depth axis ###
+            p = dict(base)
+            inp = {k: np.tile(np.asarray(v, dtype = float), stop - start)
+                   for k, v in curves.items()}
+            inp['SAMPLE_RATE'] = np.tile(sample_rate, stop - start)
+
+            p['per_depth'] = []
+            for name, v in samples.items():
+                per_depth = np.repeat(v[start:stop], size)
+                if name in curves:
+                    inp[name] = inp[name] * per_depth
+                else:
+                    p[name] = per_depth
+                    p['per_depth'].append(name)
+
+            p['endmembers'] = _response_matrix(p, p['responses'],
+                                               p['minerals'])
+            p['unconventional'] = _response_matrix(p, p['responses'],
+                                                   ['om', 'clay', 'pyr'])
+            for k in ('endmembers', 'unconventional'):
+                if p[k].ndim == 3:
+                    p['per_depth'].append(k)
+
+            state = _fixed_point(inp, _initial_state((stop - start) * size),
+                                 p, hc_class, max_iter, tol, True)
+            for k in names:
+                values[k][start:stop] = state[k].reshape(stop - start, size)
+
+        ### percentiles over realizations ###
+        info = {c[0]: c[1:] for c in _MODEL_CURVES + _OIL_CURVES + \
+                _GAS_CURVES}
+        percentiles = [('P10', 90), ('P50', 50), ('P90', 10)]
+
+        output_curves = []
+        totals = {}
+        for k in names:
+            unit, descr = info[k]
+            for label, q in percentiles:
+                output_curves.append({
+                    'mnemonic': '%s_%s' % (k, label),
+                    'data': _nanpercentile(values[k], q),
+                    'unit': unit, 'descr': '%s %s' % (descr, label)})
+
+        total = np.nansum(values[hc_curve], axis = 1)
+        totals[hc_curve] = {label: np.percentile(total, q)
+                            for label, q in percentiles}
+
+        log.append_curves(output_curves, depth_index = valid_index)
+
+        return totals
+
+
+def multimineral_arrays(curves, sample_rate, hc_class, use_pe, params,
+                        max_iter = 20, tol = 1e-3, retire_converged = True,
+                        warm_start = None, coarse_step = 10, n_jobs = 1,
+                        chunk_size = None):
+    """
+    Runs the multimineral fixed point iteration on whole depth arrays.
+
+    Builds a :class:`MultimineralModel` from params and returns the
+    results of :meth:`MultimineralModel.arrays`. To run the same model
+    on many wells, build the model once and call its methods instead.
+
+    Parameters
+    ----------
+    params : dict
+        Keyword parameters of :meth:`pet.Log.multimineral_model`.
+
+    See :meth:`MultimineralModel.arrays` for the other parameters and
+    the results.
+
+    """
+
+    model = MultimineralModel(**params)
+    return model.arrays(curves, sample_rate, hc_class, use_pe,
+                        max_iter = max_iter, tol = tol,
+                        retire_converged = retire_converged,
+                        warm_start = warm_start, coarse_step = coarse_step,
+                        n_jobs = n_jobs, chunk_size = chunk_size)
+
+
+def _chunk_worker(task):
+    """
+    Evaluates one chunk of depths read from shared memory and writes the
+    results into the shared output block.
+    """
+
+    model, in_name, in_names, out_name, out_names, size, start, stop, \
+        hc_class, use_pe, options = task
+
+    shm_in = shared_memory.SharedMemory(name = in_name)
+    shm_out = shared_memory.SharedMemory(name = out_name)
+    try:
+        block = np.ndarray((len(in_names), size), dtype = float,
+                           buffer = shm_in.buf)
+        out = np.ndarray((len(out_names), size), dtype = float,
+                         buffer = shm_out.buf)
+
+        curves = {k: np.array(block[i, start:stop]) for i, k in
+                  enumerate(in_names)}
+        sample_rate = curves.pop('SAMPLE_RATE')
+
+        results = model.arrays(curves, sample_rate, hc_class, use_pe,
+                               **options)
+        for i, k in enumerate(out_names):
+            out[i, start:stop] = results[k]
+
+        del block, out
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+    return stop - start
+
+
+def _multimineral_parallel(model, curves, sample_rate, hc_class, use_pe,
+                           n_jobs, chunk_size, options):
+    """
+    Splits the depths into chunks and evaluates them in a process pool
+    with the input and output curves in shared memory.
+    """
+
+    in_names = list(curves.keys()) + ['SAMPLE_RATE']
+    size = len(sample_rate)
+
+    out_names = list(OUTPUT_CURVES)
+    if hc_class == 'OIL':
+        out_names += ['OIP']
+    else:
+        out_names += ['GIP', 'GIP_FREE', 'GIP_ADS']
+    if model.params['buckles_parameter'] > 0:
+        out_names += ['BVWI', 'BVWF']
+
+    if chunk_size is None:
+        chunk_size = -(-size // (4 * n_jobs))
+    chunk_size = max(int(chunk_size), 1)
+
+    shm_in = shared_memory.SharedMemory(create = True,
+                                        size = max(len(in_names) * size * 8, 1))
+    shm_out = shared_memory.SharedMemory(create = True,
+                                         size = max(len(out_names) * size * 8,
+                                                    1))
+    try:
+        block = np.ndarray((len(in_names), size), dtype = float,
+                           buffer = shm_in.buf)
+        for i, k in enumerate(in_names[:-1]):
+            block[i] = curves[k]
+        block[-1] = sample_rate
+
+        out = np.ndarray((len(out_names), size), dtype = float,
+                         buffer = shm_out.buf)
+        out[:] = np.nan
+
+        tasks = [(model, shm_in.name, in_names, shm_out.name, out_names,
+                  size, start, min(start + chunk_size, size), hc_class,
+                  use_pe, options) for start in range(0, size, chunk_size)]
+
+        with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+            list(pool.map(_chunk_worker, tasks))
+
+        results = {k: np.array(out[i]) for i, k in enumerate(out_names)}
+
+        del block, out
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+
+    return results
@@ -1,13 +1,125 @@
 import os
 import re
-import xml.etree.ElementTree as ET
+import io
+import warnings
 import pandas as pd
 import numpy as np
 import datetime as dt
 from scipy.optimize import nnls,lsq_linear
-from scipy.signal import lfilter, filtfilt
 
-from lasio import LASFile, CurveItem
+from lasio import LASFile, CurveItem, HeaderItem
+from lasio.reader import open_with_codecs, read_header_line
+
+from multimineral import MultimineralModel
+from qc import check_log
+from aliases import load_alias_index
+from preconditioning import PreconditionPipeline, filter_segments, \
+                            clip_limits
+import fluid
+import las_cache
+
+# encoding options of lasio.reader.open_with_codecs
+_ENCODING_KWARGS = ('encoding', 'encoding_errors', 'autodetect_encoding',
+                    'autodetect_encoding_chars')
+
+
+def read_las_header(file_ref, **kwargs):
+    """
+    Reads the text of a las file up to the ~A data section.
+
+        Parameters
+        ----------
+        file_ref : str
+            Path to las file.
+        kwargs : kwargs
+            Encoding options of :func:`lasio.reader.open_with_codecs`.
+
+        Returns
+        -------
+        header : str
+            Every line before ~A, with an empty ~A section.
+
+        Raises
+        ------
+        ValueError
+            If file_ref is not the path of a file.
+
+    """
+
+    if not isinstance(file_ref, str) or not os.path.isfile(file_ref):
+        raise ValueError('read_las_header needs the path of a las file, '
+                         'not %r.' % (file_ref,))
+
+    lines = []
+    f, encoding = open_with_codecs(file_ref, **kwargs)
+    with f:
+        for line in f:
+            if line.lstrip()[:2].upper() == '~A':
+                break
+            lines.append(line)
+
+    return ''.join(lines) + '~A\n'
+
+
+def read_las_data(file_ref, n_columns, usecols=None):
+    """
+    Parses the ~A section of an unwrapped, space delimited las file with
+    one NumPy call.
+
+        Parameters
+        ----------
+        file_ref : str
+            Path to las file.
+        n_columns : int
+            Number of curves in the ~C section.
+        usecols : list of int (default None)
+            Columns to parse, in increasing order. The other columns
+            are skipped without converting them to floats.
+
+        Returns
+        -------
+        data : 2D array or None
+            Parsed curves as rows. None if there is no ~A section, or it
+            has anything but whitespace separated numbers, or the rows
+            do not have n_columns values, so the file has to be read by
+            lasio.
+
+    """
+
+    if n_columns < 1:
+        return None
+
+    with open(file_ref, 'rb') as f:
+        text = f.read()
+
+    match = re.search(rb'(?m)^[ \t]*~[Aa]', text)
+    if match is None:
+        return None
+    start = text.find(b'\n', match.end())
+    if start < 0:
+        return None
+
+    ### skipped columns are not checked by loadtxt, check the first row ###
+    first = re.compile(rb'\S[^\n]*').search(text, start + 1)
+    if first is None or len(first.group().split()) != n_columns:
+        return None
+
+    body = io.BytesIO(text)
+    body.seek(start + 1)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            data = np.loadtxt(body, usecols = usecols, comments = None,
+                              ndmin = 2)
+    except (ValueError, UserWarning):
+        return None
+
+    columns = n_columns if usecols is None else len(usecols)
+    if len(data) == 0 or data.shape[1] != columns:
+        return None
+
+    return np.ascontiguousarray(data.T)
+
 
 """
 Log contains parent classes to work with log data.
@@ -32,6 +144,40 @@ class Log(LASFile):
             str path to las file
         drho_matrix : float (default 2.71)
             Matrix density for conversion from density porosity to density.
+        null_to_nan : bool (default False)
+            Convert the NULL value of every curve to nan after loading,
+            see :meth:`normalize_nulls`.
+        header_only : bool (default False)
+            Only read the file up to the ~A section. The well, parameter
+            and curve headers are loaded and every curve has no data.
+            For inventory and triage of many files. Encoding kwargs
+            are used to read the header. A file_ref that is not a path,
+            e.g. a file object, is read by lasio without the data.
+        fast : bool (default True)
+            Parse the ~A section of unwrapped, space delimited LAS 1.2
+            and 2.0 files in bulk with :func:`read_las_data`. Wrapped,
+            LAS 3.0 or malformed files, and loads with lasio kwargs, are
+            read by lasio.
+        cache : bool or las_cache.LasCache (default False)
+            Load the file from :data:`las_cache.default_cache`, or from
+            the given cache, and add it after parsing when it is not
+            cached or changed since. Ignored with lasio kwargs.
+        mmap : bool (default False)
+            Memory-map the curves from the cache, the default cache if
+            cache is False, instead of holding them in memory. A curve is
+            read from disk when it is used, e.g. :code:`log['GR']`, and
+            changes to it stay in memory. For sessions with many logs
+            loaded at once. Ignored with lasio kwargs.
+        curves : list (default None)
+            Only load these curves and the index curve. Primary mnemonics
+            of the alias xml also load the curves that
+            :meth:`precondition` would alias to them, e.g.
+            :data:`preconditioning.LOAD_CURVES`. Skipped columns are not
+            converted to floats by the fast path. Default every curve.
+        alias_path : str (default None)
+            Alias xml for curves, default alias_folder/curve_alias.xml.
+        drop_text : bool (default False)
+            Drop the ~Parameter and ~Other sections of the file.
         kwargs : kwargs
             Key Word arguements for use with lasio LASFile class.
 
@@ -45,14 +191,80 @@ class Log(LASFile):
 
     """
     
-    def __init__(self, file_ref = None, drho_matrix = 2.71, **kwargs):
+    def __init__(self, file_ref = None, drho_matrix = 2.71,
+                 null_to_nan = False, header_only = False, fast = True,
+                 cache = False, mmap = False, curves = None,
+                 alias_path = None, drop_text = False, **kwargs):
+
+        # modified depths of each curve, see mark_dirty
+        self._dirty = {}
+        self.header_only = header_only
+        selected = False
+
+        if file_ref is not None and header_only:
+            ### paths are read up to ~A, anything else by lasio ###
+            if isinstance(file_ref, str) and os.path.isfile(file_ref):
+                encoding = {k: v for k, v in kwargs.items()
+                            if k in _ENCODING_KWARGS}
+                options = {k: v for k, v in kwargs.items()
+                           if k not in _ENCODING_KWARGS}
+                LASFile.__init__(self, file_ref = io.StringIO(
+                    read_las_header(file_ref, **encoding)),
+                    ignore_data = True, **options)
+            else:
+                LASFile.__init__(self, file_ref = file_ref,
+                                 ignore_data = True, **kwargs)
+        elif file_ref is not None:
+            if cache is True or (cache is False and mmap):
+                cache = las_cache.default_cache
+            elif cache is False:
+                cache = None
+
+            ### fast path and cache only for plain loads of a file ###
+            plain = not kwargs and isinstance(file_ref, str) and \
+                os.path.isfile(file_ref)
+            if not plain:
+                cache = None
+
+            ### curves selected from the cache are copied from a map ###
+            if cache is not None:
+                cached = cache.get(file_ref, mmap = mmap or curves is not None)
+                selected = cached is not None and self._set_data(*cached,
+                    curves = curves, alias_path = alias_path, mmap = mmap)
+            if not selected:
+                header = None
+                if plain and (fast or cache is not None):
+                    header = read_las_header(file_ref,
+                                             autodetect_encoding = True)
+                # the cache keeps every curve
+                select = curves if cache is None else None
+                if plain and fast and self._read_fast(file_ref, header,
+                        curves = select, alias_path = alias_path):
+                    selected = select is not None
+                else:
+                    LASFile.__init__(self, file_ref = file_ref,
+                                     autodetect_encoding = True, **kwargs)
+                if cache is not None and \
+                   self._cache_data(file_ref, header, cache) and \
+                   (mmap or curves is not None):
+                    ### swap the parsed curves for the cache entry ###
+                    cached = cache.get(file_ref, mmap = True)
+                    selected = cached is not None and self._set_data(*cached,
+                        curves = curves, alias_path = alias_path,
+                        mmap = mmap)
+
+        if file_ref is not None and curves is not None and not selected:
+            self.keep_curves(self._load_mnemonics(curves, alias_path))
+
+        if file_ref is not None and drop_text:
+            list.__setitem__(self.params, slice(None), [])
+            self.sections['Other'] = ''
 
         if file_ref is not None:
-            LASFile.__init__(self, file_ref = file_ref,
-                             autodetect_encoding = True, **kwargs)
             
-            # Get the base name of the file
-            file_name = os.path.basename(file_ref)
+            # Get the base name of the file, none for file objects
+            file_name = os.path.basename(file_ref) \
+                if isinstance(file_ref, str) else ''
 
             # Find a sequence of 10 or 14 digits in the file name
             file_api = re.findall(r'\d{10}(?:\d{4})?', file_name)
@@ -76,14 +288,544 @@ class Log(LASFile):
                 if self.header['Well']['API'].value and len(self.header['Well']['API'].value) == 14:
                     self.header['Well']['UWI'].value = self.header['Well']['API'].value
                 self.header['Well']['UWI'].value = self.header['Well']['UWI'].value.replace('-', '').replace(' ', '').ljust(14, '0')
+
+            if null_to_nan:
+                self.normalize_nulls()
         # self.precondition(drho_matrix = drho_matrix)
 
         # self.fluid_properties_parameters_from_csv()
         # self.multimineral_parameters_from_csv()
         # self.tops = {}
 
+    def _load_mnemonics(self, curves, alias_path = None):
+        """
+        Mnemonics of the curves of the log to load for curves, see the
+        curves parameter of :class:`Log`.
+        """
+
+        return load_alias_index(alias_path).select(self.keys(), curves)
+
+    def _select_columns(self, curves, alias_path = None):
+        """
+        Keeps the header of the index curve and the curves to load for
+        curves. Returns their positions in the file.
+        """
+
+        keep = set(self._load_mnemonics(curves, alias_path))
+        columns = [i for i, c in enumerate(self.curves)
+                   if i == 0 or c.mnemonic in keep]
+        list.__setitem__(self.curves, slice(None),
+                         [self.curves[i] for i in columns])
+
+        return columns
+
+    def _prune_header(self, header, curves, alias_path = None):
+        """
+        Removes the ~C lines of the curves not loaded for curves from
+        header text, so lasio does not parse them.
+
+            Returns
+            -------
+            pruned : tuple or None
+                (header, mnemonics, columns, n_columns) with the pruned
+                header, mnemonics and file columns of the kept curves,
+                and the number of curves in the file. None if mnemonics
+                are repeated, which lasio renames.
+
+        """
+
+        lines = header.split('\n')
+        mnemonics = []
+        line_nos = []
+        section = None
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if line.startswith('~'):
+                section = line[1:2].upper()
+            elif section == 'C' and line and line[0] != '#':
+                mnemonics.append(read_header_line(line,
+                    section_name = 'Curves')['name'])
+                line_nos.append(i)
+
+        if len(set(mnemonics)) != len(mnemonics):
+            return None
+
+        keep = set(load_alias_index(alias_path).select(mnemonics, curves))
+        columns = [i for i, m in enumerate(mnemonics) if i == 0 or m in keep]
+        drop = set(line_nos) - {line_nos[i] for i in columns}
+        header = '\n'.join(l for i, l in enumerate(lines) if i not in drop)
+
+        return header, [mnemonics[i] for i in columns], columns, len(mnemonics)
+
+    def _read_fast(self, file_ref, header, curves = None, alias_path = None):
+        """
+        Loads the headers with lasio and the data with
+        :func:`read_las_data`, only parsing the columns of curves if
+        given. Returns False if the file has to be read by lasio.
+        """
+
+        pruned = None
+        if curves is not None:
+            try:
+                pruned = self._prune_header(header, curves, alias_path)
+            except Exception:
+                # malformed ~C lines are reported by lasio
+                pruned = None
+
+        LASFile.__init__(self, file_ref = io.StringIO(
+            header if pruned is None else pruned[0]), ignore_data = True)
+
+        try:
+            version = float(self.version.VERS.value)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        wrap = str(self.version.WRAP.value).strip().upper() \
+            if 'WRAP' in self.version else 'YES'
+        delimiter = str(self.version.DLM.value).strip().upper() \
+            if 'DLM' in self.version else 'SPACE'
+        if version >= 3 or wrap != 'NO' or delimiter != 'SPACE':
+            return False
+
+        n_columns = len(self.curves)
+        usecols = None
+        if pruned is not None:
+            _, kept, usecols, n_columns = pruned
+            if self.keys() != kept:
+                return False
+        elif curves is not None:
+            usecols = self._select_columns(curves, alias_path)
+
+        data = read_las_data(file_ref, n_columns, usecols = usecols)
+        if data is None:
+            return False
+
+        ### NULL to nan as the lasio strict null policy, except the index ###
+        if 'NULL' in self.well:
+            null = self.well.NULL.value
+            with np.errstate(invalid = 'ignore'):
+                data[1:][data[1:] == null] = np.nan
+
+        for curve, row in zip(self.curves, data):
+            curve.data = row
+        self.index_initial = self.index.copy()
+
+        return True
+
+    def _set_data(self, header, data, curves = None, alias_path = None,
+                  mmap = False):
+        """
+        Loads the headers from header text and the curves from the rows
+        of data, as cached by :meth:`_cache_data`. Only the rows of
+        curves are kept if given, copied unless mmap. Returns False if
+        they do not match.
+        """
+
+        LASFile.__init__(self, file_ref = io.StringIO(header),
+                         ignore_data = True)
+        if len(self.curves) != len(data):
+            return False
+
+        if curves is not None:
+            columns = self._select_columns(curves, alias_path)
+            data = [data[i] for i in columns] if mmap else data[columns]
+
+        for curve, row in zip(self.curves, data):
+            curve.data = np.asarray(row, dtype = float)
+        self.index_initial = self.index.copy()
+
+        return True
+
+    def _cache_data(self, file_ref, header, cache):
+        """
+        Adds the loaded curves of file_ref to a las_cache.LasCache, if
+        they are float curves of equal length and match the curves of
+        the header.
+        """
+
+        curves = self.curves
+        if len(curves) == 0 or any(c.data.dtype.kind != 'f' or \
+           c.data.shape != curves[0].data.shape for c in curves):
+            return False
+
+        header_curves = LASFile(io.StringIO(header), ignore_data = True).curves
+        if [c.original_mnemonic for c in header_curves] != \
+           [c.original_mnemonic for c in curves]:
+            return False
+
+        data = np.empty((len(curves), len(curves[0].data)))
+        for row, curve in zip(data, curves):
+            row[:] = curve.data
+
+        return cache.put(file_ref, header, data)
+
+    def normalize_nulls(self):
+        """
+        Converts the NULL value of every curve to nan in one pass.
+
+            The float curves are copied into rows of one 2D array and the
+            NULL value is replaced in place. The NULL_NAN parameter is
+            added to the header, so later steps can use plain nan masks
+            instead of also comparing against the NULL value, see
+            :meth:`valid_mask`.
+
+        """
+
+        try:
+            null = float(self.well.NULL.value)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            null = None
+
+        rows = [c for c in self.curves if c.data.dtype.kind == 'f' and \
+                c.data.shape == self.curves[0].data.shape]
+
+        if null is not None and len(rows) > 0:
+            block = np.empty((len(rows), len(rows[0].data)))
+            for row, curve in zip(block, rows):
+                row[:] = curve.data
+                curve.data = row
+
+            nulls = block == null
+            block[nulls] = np.nan
+
+            for curve, mask in zip(rows, nulls):
+                if mask.any():
+                    self.mark_dirty(curve.mnemonic, np.flatnonzero(mask))
+
+        self.params['NULL_NAN'] = HeaderItem(mnemonic = 'NULL_NAN',
+            value = 1, descr = 'NULL values converted to nan')
+
+    @property
+    def nulls_normalized(self):
+        """
+        True if :meth:`normalize_nulls` was applied to the log.
+        """
+
+        return 'NULL_NAN' in self.params and \
+            str(self.params['NULL_NAN'].value) in ('1', '1.0')
+
+    def valid_mask(self, data):
+        """
+        Boolean mask of the finite, non NULL values of data. The NULL
+        comparison is skipped when the log nulls are normalized.
+        """
+
+        valid = np.isfinite(data)
+        if not self.nulls_normalized:
+            valid &= data != self.well.NULL.value
+        return valid
+
+    def append_curves(self, curves, depth_index = None):
+        """
+        Adds many curves to the log in one operation.
+
+            The data of every new curve is a row of a single 2D array
+            allocated once, and the new curves are added to the curves
+            section together, so lasio checks for duplicate mnemonics
+            once per batch instead of scanning every curve for each
+            append. Curves already in the log are updated in place.
+
+            Parameters
+            ----------
+            curves : list of dict
+                Curves to add, each with the key 'mnemonic' and optional
+                keys 'data', 'unit', 'descr' and 'value'. Curves
+                without data are filled with nan.
+            depth_index : array_like (default None)
+                Indices of the depths covered by the data. New curves
+                are nan at other depths. If None, data covers every
+                depth.
+
+            Note
+            ----
+            Existing curves keep their header. Their data is only
+            written at depth_index, and only when data is given.
+
+            Example
+            -------
+            >>> import numpy as np
+            >>> log.append_curves([
+            ...     {'mnemonic': 'PHIE', 'unit': 'v/v',
+            ...      'descr': 'Effective Porosity'},
+            ...     {'mnemonic': 'SW', 'data': np.ones(len(log[0])),
+            ...      'unit': 'v/v', 'descr': 'Water Saturation'}
+            ... ])
+
+        """
+
+        if depth_index is None:
+            depth_index = slice(None)
+
+        existing = set(self.keys())
+        useful = {c.useful_mnemonic for c in self.curves}
+
+        new = [c for c in curves if c['mnemonic'] not in existing]
+        block = np.empty((len(new), len(self[0])))
+        block[:] = np.nan
+
+        items = []
+        for curve in curves:
+            mnemonic = curve['mnemonic']
+            data = curve.get('data')
+
+            if mnemonic in existing:
+                if data is not None:
+                    self[mnemonic][depth_index] = data
+                    self.mark_dirty(mnemonic, depth_index)
+                continue
+
+            row = block[len(items)]
+            if data is not None:
+                row[depth_index] = data
+
+            items.append(CurveItem(mnemonic, curve.get('unit', ''),
+                                   curve.get('value', ''),
+                                   curve.get('descr', ''), row))
+            existing.add(mnemonic)
+
+        ### extend the section without a duplicate check per item ###
+        list.extend(self.curves, items)
+        for mnemonic in {c.useful_mnemonic for c in items} & useful:
+            self.curves.assign_duplicate_suffixes(mnemonic)
+
+    def keep_curves(self, mnemonics):
+        """
+        Deletes every curve not in mnemonics in one operation.
+
+            The kept curves are collected in a single pass over the curves
+            section and their float data is copied into rows of one 2D
+            array, instead of searching and popping the section once per
+            deleted curve. The index curve is always kept.
+
+            Parameters
+            ----------
+            mnemonics : list
+                Mnemonics of the curves to keep. Mnemonics not in the log
+                are ignored. Curves keep their order in the log.
+
+            Example
+            -------
+            >>> log.keep_curves(['GR', 'NPHI', 'RHOB'])
+            >>> log.keys()
+            ['DEPT', 'GR', 'NPHI', 'RHOB']
+
+        """
+
+        mnemonics = set(mnemonics)
+        kept = [c for i, c in enumerate(self.curves)
+                if i == 0 or c.mnemonic in mnemonics]
+
+        ### one block for the float curves ###
+        rows = [c for c in kept if c.data.dtype.kind == 'f' and \
+                c.data.shape == kept[0].data.shape]
+        if len(rows) > 0:
+            block = np.empty((len(rows), len(rows[0].data)))
+            for row, curve in zip(block, rows):
+                row[:] = curve.data
+                curve.data = row
+
+        list.__setitem__(self.curves, slice(None), kept)
+
+        for mnemonic in set(self._dirty) - {c.mnemonic for c in kept}:
+            del self._dirty[mnemonic]
+
+    def smooth(self, mnemonics, n = 15, limits = None, decimals = 4):
+        """
+        Zero phase moving average of several curves in one pass.
+
+            The curves are stacked in one 2D array and filtered with
+            :func:`scipy.signal.filtfilt` along depth. Each contiguous run
+            of valid samples is filtered on its own, so the filter does
+            not smear across NULL gaps. Curves with the same valid
+            samples are filtered together. Rounding and clipping are
+            applied in place on the filtered array.
+
+            Parameters
+            ----------
+            mnemonics : list
+                Curves to smooth. Mnemonics not in the log are ignored.
+            n : int (default 15)
+                Number of samples of the moving average.
+            limits : dict (default None)
+                Clip limits of the filtered curves as
+                {mnemonic: (min, max)}, None for no limit.
+            decimals : int (default 4)
+                Decimals to round the filtered curves to.
+
+            Note
+            ----
+            NULL and nan samples are nan in the smoothed curves.
+
+            Example
+            -------
+            >>> log.smooth(['DT', 'RHOB'], n = 15,
+            ...            limits = {'DT': (None, 122), 'RHOB': (2.2, None)})
+
+        """
+
+        mnemonics = [m for m in mnemonics if m in self.keys()]
+        if len(mnemonics) == 0:
+            return
+
+        if limits is None:
+            limits = {}
+
+        block = np.array([self[m] for m in mnemonics], dtype = float)
+        smoothed = filter_segments(block, self.valid_mask(block), n)
+        lower, upper = clip_limits(mnemonics, limits)
+
+        np.round(smoothed, decimals, out = smoothed)
+        np.clip(smoothed, lower[:, None], upper[:, None], out = smoothed)
+
+        for mnemonic, data in zip(mnemonics, smoothed):
+            self[mnemonic] = data
+
+    def __setitem__(self, key, value):
+        """
+        Sets or appends a curve as :class:`lasio.LASFile` and marks the
+        whole curve as modified.
+        """
+
+        LASFile.__setitem__(self, key, value)
+        self.mark_dirty(key)
+
+    def mark_dirty(self, mnemonic, depth_index = None):
+        """
+        Records that a curve was modified at some depths.
+
+            Whole curve assignments, such as :code:`log['GR'] = data`,
+            and updates through :meth:`append_curves` are recorded
+            automatically. In place edits of curve data, such as
+            :code:`log['GR'][10] = 50`, must be recorded with this
+            method, as :class:`graphs.LogViewer` does for curve edits
+            and bulk shifts. Modified depths are used by
+            :meth:`multimineral_model` with :code:`incremental = True`
+            to recompute only those depths.
+
+            Parameters
+            ----------
+            mnemonic : str
+                Mnemonic of the modified curve.
+            depth_index : int, slice or array_like (default None)
+                Indices of the modified depths. If None, every depth.
+
+        """
+
+        size = len(self[0])
+        mask = self._dirty.get(mnemonic)
+        if mask is None or len(mask) != size:
+            mask = np.zeros(size, dtype = bool)
+            self._dirty[mnemonic] = mask
+
+        if depth_index is None:
+            mask[:] = True
+        else:
+            mask[depth_index] = True
+
+    def dirty_index(self, mnemonics = None):
+        """
+        Indices of the depths modified in any of the curves.
+
+            Parameters
+            ----------
+            mnemonics : list (default None)
+                Curves to check. If None, every curve.
+
+            Returns
+            -------
+            :class:`numpy.ndarray`
+                Sorted depth indices.
+
+        """
+
+        mask = np.zeros(len(self[0]), dtype = bool)
+        for mnemonic, dirty in self._dirty.items():
+            if mnemonics is None or mnemonic in mnemonics:
+                if len(dirty) == len(mask):
+                    mask |= dirty
+
+        return np.where(mask)[0]
+
+    def dirty_ranges(self, mnemonics = None):
+        """
+        Depth ranges modified in any of the curves.
+
+            Parameters
+            ----------
+            mnemonics : list (default None)
+                Curves to check. If None, every curve.
+
+            Returns
+            -------
+            list
+                (top, bottom) depths of each contiguous modified range.
+
+        """
+
+        index = self.dirty_index(mnemonics)
+        if len(index) == 0:
+            return []
+
+        breaks = np.where(np.diff(index) > 1)[0]
+        starts = np.concatenate(([index[0]], index[breaks + 1]))
+        stops = np.concatenate((index[breaks], [index[-1]]))
 
-    def precondition(self, drho_matrix = 2.71, n = 15):
+        return [(self[0][a], self[0][b]) for a, b in zip(starts, stops)]
+
+    def clear_dirty(self, mnemonics = None, depth_index = None):
+        """
+        Clears recorded modifications.
+
+            Parameters
+            ----------
+            mnemonics : list (default None)
+                Curves to clear. If None, every curve.
+            depth_index : int, slice or array_like (default None)
+                Indices of the depths to clear. If None, every depth.
+
+        """
+
+        for mnemonic, dirty in self._dirty.items():
+            if mnemonics is None or mnemonic in mnemonics:
+                if depth_index is None:
+                    dirty[:] = False
+                else:
+                    dirty[depth_index] = False
+
+
+    def qc(self, thresholds = None, top = None, bottom = None,
+           alias_path = None, drho_matrix = 2.71):
+        """
+        Quality control before processing, see :func:`qc.check_log`.
+
+            The result is recorded in the QC_PASS and QC_NOTE parameters
+            of the header, so wells that fail can be skipped or flagged
+            before running the expensive calculations.
+
+            Returns
+            -------
+            result : qc.QCResult
+
+            Example
+            -------
+            >>> result = log.qc(thresholds = {'max_null_fraction': 0.3})
+            >>> if result.passed:
+            ...     log.precondition()
+
+        """
+
+        result = check_log(self, thresholds = thresholds, top = top,
+                           bottom = bottom, alias_path = alias_path,
+                           drho_matrix = drho_matrix)
+
+        self.params['QC_PASS'] = HeaderItem(mnemonic = 'QC_PASS',
+            value = int(result.passed), descr = 'Passed early QC')
+        self.params['QC_NOTE'] = HeaderItem(mnemonic = 'QC_NOTE',
+            value = '; '.join(result.reasons), descr = 'Failed QC checks')
+
+        return result
+
+    def precondition(self, drho_matrix = 2.71, n = 15, alias_path = None,
+                     pipeline = None):
         """
         Preconditions log curve by aliasing names.:
 
@@ -98,109 +840,44 @@ class Log(LASFile):
                 Default value for limestone matrix. If log was run on
                 sandstone matrix, use 2.65. If log was run on dolomite
                 matrix, use 2.85.
+            alias_path : str, optional
+                Path of a custom alias xml. Default uses
+                alias_folder/curve_alias.xml. The xml is parsed once and
+                reused until it is modified, see
+                :func:`aliases.load_alias_index`.
+            pipeline : preconditioning.PreconditionPipeline, optional
+                Custom preconditioning steps. If given, drho_matrix, n
+                and alias_path are not used.
+
+            Returns
+            -------
+            timings : list of tuple
+                (step, seconds) of each preconditioning step.
 
             Note
             -----
                 1. Curve Alias is provided by the curve_alias.xml file
+                2. Default steps are alias, derive RHOB or DPHI, keep the
+                standard curves, clip to 0.0001, round to 4 decimals,
+                smooth DT and RHOB, then clip DT to 122 and RHOB to 2.2.
+                See :func:`preconditioning.default_steps`.
 
         """
 
-        file_dir = os.path.dirname(__file__)
-        ALIAS_XML_PATH = os.path.join(file_dir, 'alias_folder', 'curve_alias.xml')
-
-        if not os.path.isfile(ALIAS_XML_PATH):
-            raise ValueError('Could not find alias xml at: %s' % ALIAS_XML_PATH)
-
-        with open(ALIAS_XML_PATH, 'r') as f:
-            root = ET.fromstring(f.read())
-
-        # Create a dictionary to store the alias mappings
-        alias_mappings = {}
-
-        for log_alias_entry in root.findall(".//LogAliasEntry"):
-            primary_log = log_alias_entry.find("PrimaryLog").text
-            aliases = [alias.text for alias in log_alias_entry.findall("Alias")]
-            alias_mappings[primary_log] = aliases
-
-        # Change the names of the keys based on alias mappings and keep only the first primary log if there are multiple
-        processed_keys = set()
-        for primary_log, aliases in alias_mappings.items():
-            for alias in aliases:
-                if alias in self.keys() and alias not in processed_keys:
-                    self[primary_log] = self[alias]
-                    processed_keys.add(alias)
-                    break
-
-        if 'RHOB' not in self.keys() and 'DPHI' in self.keys():
-                non_null_depth_mask = (self['DPHI'] != self.well.NULL.value)
-                non_null_depths = self['DPHI'][non_null_depth_mask]
-                calculated_rho = np.empty(len(self[0]))
-                calculated_rho[non_null_depth_mask] = drho_matrix - (drho_matrix - 1) * non_null_depths
-                self.append_curve('RHOB', calculated_rho, unit='g/cc',
-                                value='',
-                                descr='Calculated bulk density from density porosity assuming rho matrix = %.2f' % drho_matrix)
-        
-        if 'RHOB' in self.keys() and 'DPHI' not in self.keys():
-                non_null_depth_mask = (self['RHOB'] != self.well.NULL.value)
-                non_null_depths = self['RHOB'][non_null_depth_mask]
-                calculated_phi = np.empty(len(self[0]))
-                calculated_phi[non_null_depth_mask] = (drho_matrix - non_null_depths) / (drho_matrix - 1)
-                self.append_curve('DPHI', calculated_phi, unit='v/v',
-                                value='',
-                                descr='Calculated density porosity from bulk density assuming rho matrix = %.2f' % drho_matrix)
-
-        # Filter the curves to keep only those that are in standard_curves list
-        standard_curves = ['GR', 'NPHI', 'RHOB', 'ILD', 'PE', 'DT']
-        self_keys = list(self.keys())
-        for curve in self_keys:
-            if curve not in standard_curves and curve!= 'DEPT':
-                self.delete_curve(curve)
-
-        # Check if any curves from standard_curves are present after filtering
-        remaining_curves = [curve for curve in self.keys() if curve in standard_curves]
-        if not remaining_curves:
-            raise ValueError("None of the curves from the standard_curves list are present in the data.")
-
-        for curve in remaining_curves:
-            if curve == 'DEPT':
-                continue
-            self[curve] = np.round(np.clip(self[curve], a_min=0.0001, a_max=None), 4)
-
-        def apply_lfilter(curve_data):
-            valid_mask = ~np.logical_or(np.isnan(curve_data), curve_data == self.well.NULL.value)
-            filtered_data = np.empty_like(curve_data)
-            filtered_data[valid_mask] = filtfilt(np.ones(n) / n, 1, curve_data[valid_mask], padtype= None)
-            # Round the filtered data to a maximum of 4 decimal places
-            filtered_data = np.round(filtered_data, 4)
-            return np.where(valid_mask, filtered_data, np.nan)
-
-        if 'DT' in self.keys():
-            # Get DT curve data
-            dt = self['DT']
-
-            # Apply lfilter and add filtered curve to log
-            dt_filtered = np.clip(apply_lfilter(dt),a_min=None,a_max=122)
-            self['DT'] = dt_filtered
-            self.curvesdict.get('DT').descr = 'Lfilter applied to DT curve' 
-            # self.append_curve('DT', dt_filtered, unit=self.curvesdict.get('DT').unit,
-            #                     descr='Lfilter applied to DT curve')
-
-        if 'RHOB' in self.keys():
-            # Get RHOB curve data
-            rhob = self['RHOB']
-
-            # Apply lfilter and add filtered curve to log
-            rhob_filtered = np.clip(apply_lfilter(rhob),a_min=2.2,a_max=None)
-            self['RHOB'] = rhob_filtered
-            self.curvesdict.get('RHOB').descr = 'Lfilter applied to RHOB curve'
-            # self.append_curve('RHOB', rhob_filtered, unit=self.curvesdict.get('RHOB').unit,
-            #                     descr='Lfilter applied to RHOB curve') 
+        if pipeline is None:
+            pipeline = PreconditionPipeline.default(drho_matrix = drho_matrix,
+                                                    n = n,
+                                                    alias_path = alias_path)
+
+        return pipeline.run(self)
 
     def fluid_properties(self, top=0, bottom=100000, mast=67,
                         temp_grad=0.015, press_grad=0.5, rws=0.1, rwt=70,
                         rmfs=0.4, rmft=100, gas_grav=0.67, oil_api=38, p_sep=100,
                         t_sep=100, yn2=0, yco2=0, yh2s=0, yh20=0, rs=0,
-                        lith_grad=1.03, biot=0.8, pr=0.25):
+                        lith_grad=1.03, biot=0.8, pr=0.25, z_tol=1e-5,
+                        z_max_iter=50, z_table=None, coarse_step=None,
+                        max_error=1e-4, cache=False):
         """
         Calculates fluid properties along wellbore.
 
@@ -297,6 +974,32 @@ class Log(LASFile):
                 Biot constant.
             pr : float (default 0.25)
                 Poissons ratio
+            z_tol : float (default 1e-5)
+                Convergence tolerance of the Z factor. Only used with
+                :code:`oil_api = 0`.
+            z_max_iter : int (default 50)
+                Maximum Newton steps of the Z factor. Only used with
+                :code:`oil_api = 0`.
+            z_table : RegularGridInterpolator, bool or None (default None)
+                Z factor lookup table from :func:`fluid.z_factor_table`,
+                or True for the default table. None iterates every depth.
+                The maximum relative residual of the Z factor is stored
+                in the Z_RESID parameter of the header.
+                Only used with :code:`oil_api = 0`.
+            coarse_step : float or None (default None)
+                Evaluate the correlations on a depth grid with this
+                spacing and interpolate onto DEPT. Grid intervals are
+                halved until the interpolation error is under max_error.
+                None evaluates every depth.
+            max_error : float (default 1e-4)
+                Maximum relative error of interpolated curves at the
+                midpoint of coarse grid intervals. Only used with
+                coarse_step.
+            cache : bool or fluid.ProfileCache (default False)
+                Reuse the fluid curves of a previous well with the same
+                parameters and depths from :data:`fluid.profile_cache`,
+                or from the given cache. Hits and misses are counted by
+                the cache, see :meth:`fluid.ProfileCache.info`.
 
             Note
             ----
@@ -338,344 +1041,24 @@ class Log(LASFile):
             :meth:`petropy.Log.multimineral_model`
                 builds on fluid properties to calculate full petrophysical
                 model
+            :func:`fluid.fluid_properties_batch`
+                calculates fluid properties of many wells at once
 
         """
 
         depths = self['DEPT']
         depth_index = np.logical_and(depths >= top, depths < bottom)
-        depths = depths[depth_index]
-
-        form_temp = mast + temp_grad * depths
-        pore_press = press_grad * depths
-
-        ### water properties ###
-        rw = (rwt + 6.77) / (form_temp + 6.77) * rws
-        rmf = (rmft + 6.77) / (form_temp + 6.77) * rmfs
-
-        rw68 = (rwt + 6.77) / (68 + 6.77) * rws
-        rmf68 = (rmft + 6.77) / (68 + 6.77) * rws
-
-        ### weight percent total dissolved solids ###
-        xsaltw = 10 ** (-0.5268 * (np.log10(rw68)) ** 3 - 1.0199 * \
-                    (np.log10(rw68)) ** 2 - 1.6693 * (np.log10(rw68)) - 0.3087)
-        xsaltmf = 10 ** (-0.5268 * (np.log10(rmf68)) ** 3 - 1.0199 * \
-                        (np.log10(rmf68)) ** 2 - 1.6693 * (np.log10(rmf68)) - 0.3087)
-
-        ### bw for reservoir water. ###
-        ### Eq 1.83 - 1.85 Gas Reservoir Engineering ###
-        dvwt = -1.0001 * 10 ** -2 + 1.33391 * 10 ** -4 * form_temp + \
-            5.50654 * 10 ** -7 * form_temp ** 2
-
-        dvwp = -1.95301 * 10 ** -9 * pore_press * form_temp - \
-            1.72834 * 10 ** -13 * pore_press ** 2 * form_temp - \
-            3.58922 * 10 ** -7 * pore_press - \
-            2.25341 * 10 ** -10 * pore_press ** 2
-
-        bw = (1 + dvwt) * (1 + dvwp)
-
-        ### calculate solution gas in water ratio ###
-        ### Eq. 1.86 - 1.91 Gas Reservoir Engineering ###
-        rsa = 8.15839 - 6.12265 * 10 ** -2 * form_temp + \
-            1.91663 * 10 ** -4 * form_temp ** 2 - \
-            2.1654 * 10 ** -7 * form_temp ** 3
-
-        rsb = 1.01021 * 10 ** -2 - 7.44241 * 10 ** -5 * form_temp + \
-            3.05553 * 10 ** -7 * form_temp ** 2 - \
-            2.94883 * 10 ** -10 * form_temp ** 3
-
-        rsc = -1.0 * 10 ** -7 * (9.02505 - 0.130237 * form_temp + \
-                                8.53425 * 10 ** -4 * form_temp ** 2 - 2.34122 * 10 ** -6 * \
-                                form_temp ** 3 + 2.37049 * 10 ** -9 * form_temp ** 4)
-
-        rswp = rsa + rsb * pore_press + rsc * pore_press ** 2
-        rsw = rswp * 10 ** (-0.0840655 * xsaltw * form_temp ** -0.285584)
-
-        ### log responses ###
-        rho_w = (2.7512 * 10 ** -5 * xsaltw +
-                6.9159 * 10 ** -3 * xsaltw + 1.0005) * bw
-
-        rho_mf = (2.7512 * 10 ** -5 * xsaltmf +
-                6.9159 * 10 ** -3 * xsaltmf + 1.0005) * bw
-
-        nphi_w = 1 + 0.4 * (xsaltw / 100)
-        nphi_mf = 1 + 0.4 * (xsaltmf / 100)
-
-        ### net effective stress ###
-        nes = (((lith_grad * depths) - (biot * press_grad * depths) +
-                2 * (pr / (1 - pr)) * (lith_grad * depths) -
-                (biot * press_grad * depths))) / 3
-
-        ### gas reservoir ###
-        if oil_api == 0:
-            # hydrocarbon gravity only
-            hc_grav = (gas_grav - 1.1767 * yh2s - 1.5196 * yco2 - \
-                    0.9672 * yn2 - 0.622 * yh20) / \
-                    (1.0 - yn2 - yco2 - yh20 - yh2s)
-
-            # pseudocritical properties of hydrocarbon
-            ppc_h = 756.8 - 131.0 * hc_grav - 3.6 * (hc_grav ** 2)
-            tpc_h = 169.2 + 349.5 * hc_grav - 74.0 * (hc_grav ** 2)
-
-            # pseudocritical properties of mixture
-            ppc = (1.0 - yh2s - yco2 - yn2 - yh20) * ppc_h + \
-                1306.0 * yh2s + 1071.0 * yco2 + \
-                493.1 * yn2 + 3200.1 * yh20
-
-            tpc = (1.0 - yh2s - yco2 - yn2 - yh20) * tpc_h + \
-                672.35 * yh2s + 547.58 * yco2 + \
-                227.16 * yn2 + 1164.9 * yh20
-
-            # Wichert-Aziz correction for H2S and CO2
-            if yco2 > 0 or yh2s > 0:
-                epsilon = 120 * ((yco2 + yh2s) ** 0.9 -
-                                (yco2 + yh2s) ** 1.6) + \
-                        15 * (yh2s ** 0.5 - yh2s ** 4)
-
-                tpc_temp = tpc - epsilon
-                ppc = (ppc_a * tpc_temp) / \
-                    (tpc + (yh2s * (1.0 - yh2s) * epsilon))
-
-                tpc = tpc_temp
-            # Casey correction for nitrogen and water vapor
-            if yn2 > 0 or yh20 > 0:
-                tpc_cor = -246.1 * yn2 + 400 * yh20
-                ppc_cor = -162.0 * yn2 + 1270.0 * yh20
-                tpc = (tpc - 227.2 * yn2 - 1165.0 * yh20) / \
-                    (1.0 - yn2 - yh20) + tpc_cor
-
-                ppc = (ppc - 493.1 * yn2 - 3200.0 * yh20) / \
-                    (1.0 - yn2 - yh20) + ppc_cor
-
-            # Reduced pseudocritical properties
-            tpr = (form_temp + 459.67) / tpc
-            ppr = pore_press / ppc
-
-            ### z factor from Dranchuk and Abou-Kassem fit of ###
-            ### Standing and Katz chart ###
-            a = [0.3265,
-                -1.07,
-                -0.5339,
-                0.01569,
-                -0.05165,
-                0.5475,
-                -0.7361,
-                0.1844,
-                0.1056,
-                0.6134,
-                0.721]
-
-            t2 = a[0] * tpr + a[1] + a[2] / (tpr ** 2) + \
-                a[3] / (tpr ** 3) + a[4] / (tpr ** 4)
-
-            t3 = a[5] * tpr + a[6] + a[7] / tpr
-            t4 = -a[8] * (a[6] + a[7] / tpr)
-            t5 = a[9] / (tpr ** 2)
-
-            r = 0.27 * ppr / tpr
-            z = 0.27 * ppr / tpr / r
-
-            counter = 0
-            diff = 1
-            while counter <= 10 and diff > 10 ** -5:
-                counter += 1
-
-                f = r * (tpr + t2 * r + t3 * r ** 2 + t4 * r ** 5 + \
-                        t5 * r ** 2 * (1 + a[10] * r ** 2) * \
-                        np.exp(-a[10] * r ** 2)) - 0.27 * ppr
-
-                fp = tpr + 2 * t2 * r + 3 * t3 * r ** 2 + \
-                    6 * t4 * r ** 5 + t5 * r ** 2 * \
-                    np.exp(-a[10] * r ** 2) * \
-                    (3 + a[10] * r ** 2 * (3 - 2 * a[10] * r ** 2))
-
-                r = r - f / fp
-                diff = np.abs(z - (0.27 * ppr / tpr / r)).max()
-                z = 0.27 * ppr / tpr / r
-
-            ### gas compressibility from Dranchuk and Abau-Kassem ###
-            cpr = tpr * z / ppr / fp
-            cg = cpr / ppc
-
-            ### gas expansion factor ###
-            bg = (0.0282793 * z * (form_temp + 459.67)) / pore_press
-
-            ### gas density Eq 1.64 GRE ###
-            rho_hc = 1.495 * 10 ** -3 * (pore_press * (gas_grav)) / \
-                    (z * (form_temp + 459.67))
-            nphi_hc = 2.17 * rho_hc
-
-            ### gas viscosity Lee Gonzalez Eakin method ###
-            ### Eqs. 1.63-1.67 GRE ###
-            k = ((9.379 + 0.01607 * (28.9625 * gas_grav)) * \
-                (form_temp + 459.67) ** 1.5) / \
-                (209.2 + 19.26 * (28.9625 * gas_grav) + \
-                (form_temp + 459.67))
-
-            x = 3.448 + 986.4 / \
-                (form_temp + 459.67) + 0.01009 * (28.9625 * gas_grav)
-
-            y = 2.447 - 0.2224 * x
-            mu_hc = 10 ** -4 * k * np.exp(x * rho_hc ** y)
-
-            ### oil reservoir ###
-        else:
-
-            # Normalize gas gravity to separator pressure of 100 psi
-            ygs100 = gas_grav * (1 + 5.912 * 0.00001 * oil_api * \
-                                (t_sep - 459.67) * np.log10(p_sep / 114.7))
-
-            if oil_api < 30:
-                if rs == 0 or rs is None:
-                    rs = 0.0362 * ygs100 * pore_press ** 1.0937 * \
-                        np.exp((25.724 * oil_api) / (form_temp + 459.67))
-
-                bp = ((56.18 * rs / ygs100) * 10 ** \
-                    (-10.393 * oil_api / (form_temp + 459.67))) ** 0.84246
-                ### gas saturated bubble-point ###
-                bo = 1 + 4.677 * 10 ** -4 * rs + 1.751 * 10 ** -5 * \
-                    (form_temp - 60) * (oil_api / ygs100) - \
-                    1.811 * 10 ** -8 * rs * \
-                    (form_temp - 60) * (oil_api / ygs100)
-            else:
-                if rs == 0 or rs is None:
-                    rs = 0.0178 * ygs100 * pore_press ** 1.187 * \
-                        np.exp((23.931 * oil_api) / (form_temp + 459.67))
-
-                bp = ((56.18 * rs / ygs100) * 10 ** \
-                    (-10.393 * oil_api / (form_temp + 459.67))) ** 0.84246
-
-                ### gas saturated bubble-point ###
-                bo = 1 + 4.670 * 10 ** -4 * rs + 1.1 * \
-                    10 ** -5 * (form_temp - 60) * (oil_api / ygs100) + \
-                    1.337 * 10 ** -9 * rs * (form_temp - 60) * \
-                    (oil_api / ygs100)
-
-            ### calculate bo for undersaturated oil ###
-            pp_gt_bp = np.where(pore_press > bp + 100)[0]
-            if len(pp_gt_bp) > 0:
-                bo[pp_gt_bp] = bo[pp_gt_bp] * np.exp(-(0.00001 * \
-                                                    (-1433 + 5 * rs + 17.2 * form_temp[pp_gt_bp] - \
-                                                        1180 * ygs100 + 12.61 * oil_api)) * \
-                                                    np.log(pore_press[pp_gt_bp] / bp[pp_gt_bp]))
-
-            ### oil properties ###
-            rho_hc = (((141.5 / (oil_api + 131.5) * 62.428) + \
-                    0.0136 * rs * ygs100) / bo) / 62.428
-            nphi_hc = 1.003 * rho_hc
-
-            ### oil viscosity from Beggs-Robinson ###
-            ### RE Handbook Eqs. 2.121 ###
-            muod = 10 ** (np.exp(6.9824 - 0.04658 * oil_api) * \
-                        form_temp ** -1.163) - 1
-
-            mu_hc = (10.715 * (rs + 100) ** -0.515) * \
-                    muod ** (5.44 * (rs + 150) ** -0.338)
-
-            ### undersaturated oil viscosity from Vasquez and Beggs ###
-            ### Eqs. 2.123 ###
-            if len(pp_gt_bp) > 0:
-                mu_hc[pp_gt_bp] = mu_hc[pp_gt_bp] * \
-                                (pore_press[pp_gt_bp] / bp[pp_gt_bp]) ** \
-                                (2.6 * pore_press[pp_gt_bp] ** 1.187 * \
-                                10 ** (-0.000039 * pore_press[pp_gt_bp] - 5))
-
-            output_curves = [
-                {'mnemonic': 'PORE_PRESS', 'data': pore_press, 'unit': 'psi',
-                'descr': 'Calculated Pore Pressure'},
-
-                {'mnemonic': 'RES_TEMP', 'data': form_temp, 'unit': 'F',
-                'descr': 'Calculated Reservoir Temperature'},
-
-                {'mnemonic': 'NES', 'data': nes, 'unit': 'psi',
-                'descr': 'Calculated Net Effective Stress'},
-
-                {'mnemonic': 'RW', 'data': rw, 'unit': 'ohmm',
-                'descr': 'Calculated Resistivity Water'},
-
-                {'mnemonic': 'RMF', 'data': rmf, 'unit': 'ohmm',
-                'descr': 'Calculated Resistivity Mud Filtrate'},
-
-                {'mnemonic': 'RHO_HC', 'data': rho_hc, 'unit': 'g/cc',
-                'descr': 'Calculated Density of Hydrocarbon'},
-
-                {'mnemonic': 'RHO_W', 'data': rho_w, 'unit': 'g/cc',
-                'descr': 'Calculated Density of Water'},
-
-                {'mnemonic': 'RHO_MF', 'data': rho_mf, 'unit': 'g/cc',
-                'descr': 'Calculated Density of Mud Filtrate'},
-
-                {'mnemonic': 'NPHI_HC', 'data': nphi_hc, 'unit': 'v/v',
-                'descr': 'Calculated Neutron Log Response of Hydrocarbon'},
 
-                {'mnemonic': 'NPHI_W', 'data': nphi_w, 'unit': 'v/v',
-                'descr': 'Calculated Neutron Log Response of Water'},
+        curves, z_residual = fluid.fluid_profile(depths[depth_index],
+            coarse_step = coarse_step, max_error = max_error, mast = mast,
+            temp_grad = temp_grad, press_grad = press_grad, rws = rws,
+            rwt = rwt, rmfs = rmfs, rmft = rmft, gas_grav = gas_grav,
+            oil_api = oil_api, p_sep = p_sep, t_sep = t_sep, yn2 = yn2,
+            yco2 = yco2, yh2s = yh2s, yh20 = yh20, rs = rs,
+            lith_grad = lith_grad, biot = biot, pr = pr, z_tol = z_tol,
+            z_max_iter = z_max_iter, z_table = z_table, cache = cache)
 
-                {'mnemonic': 'NPHI_MF', 'data': nphi_mf, 'unit': 'v/v',
-                'descr': 'Calculated Neutron Log Response of Mud Filtrate'},
-
-                {'mnemonic': 'MU_HC', 'data': mu_hc, 'unit': 'cP',
-                'descr': 'Calculated Viscosity of Hydrocarbon'}
-            ]
-
-            for curve in output_curves:
-                if curve['mnemonic'] in self.keys():
-                    self[curve['mnemonic']][depth_index] = curve['data']
-                else:
-                    data = np.empty(len(self[0]))
-                    data[:] = np.nan
-                    data[depth_index] = curve['data']
-                    curve['data'] = data
-                    self.append_curve(curve['mnemonic'], data=curve['data'],
-                                    unit=curve['unit'], descr=curve['descr'])
-
-            ### gas curves ###
-            if oil_api == 0:
-                gas_curves = [
-                    {'mnemonic': 'Z', 'data': z, 'unit': '',
-                    'descr': 'Calculated Real Gas Z Factor'},
-
-                    {'mnemonic': 'CG', 'data': cg, 'unit': '1 / psi',
-                    'descr': 'Calculated Gas Compressibility'},
-
-                    {'mnemonic': 'BG', 'data': bg, 'unit': '',
-                    'descr': 'Calculated Gas Formation Volume Factor'}
-                ]
-
-                for curve in gas_curves:
-                    if curve['mnemonic'] in self.keys():
-                        self[curve['mnemonic']][depth_index] = curve['data']
-                    else:
-                        data = np.empty(len(self[0]))
-                        data[:] = np.nan
-                        data[depth_index] = curve['data']
-                        curve['data'] = data
-                        self.append_curve(curve['mnemonic'],
-                                        data=curve['data'],
-                                        unit=curve['unit'],
-                                        descr=curve['descr'])
-
-            ### oil curves ###
-            else:
-                oil_curves = [
-                    {'mnemonic': 'BO', 'data': bo, 'unit': '',
-                    'descr': 'Calculated Oil Formation Volume Factor'},
-
-                    {'mnemonic': 'BP', 'data': bp, 'unit': 'psi',
-                    'descr': 'Calculated Bubble Point'}
-                ]
-
-                for curve in oil_curves:
-                    if curve['mnemonic'] in self.keys():
-                        self[curve['mnemonic']][depth_index] = curve['data']
-                    else:
-                        data = np.empty(len(self[0]))
-                        data[:] = np.nan
-                        data[depth_index] = curve['data']
-                        curve['data'] = data
-                        self.append_curve(curve['mnemonic'],
-                                        data=curve['data'],
-                                        unit=curve['unit'],
-                                        descr=curve['descr'])
+        fluid.write_profile(self, curves, z_residual, oil_api, depth_index)
 
     def multimineral_model(self, top = 0, bottom = 100000,
     gr_matrix = 10, nphi_matrix = 0, gr_clay = 350, rho_clay = 2.64,
@@ -696,7 +1079,9 @@ class Log(LASFile):
     nphi_x = 0.507, pe_x = 4.04, pe_fl = 0, m = 2, n = 2, a = 1,
     archie_weight = 1, indonesia_weight = 0, simandoux_weight = 0,
     modified_simandoux_weight = 0, waxman_smits_weight = 0, cec = -1,
-    buckles_parameter = -1):
+    buckles_parameter = -1, engine = 'vector', max_iter = 20, tol = 1e-3,
+    retire_converged = True, diagnostics = False, warm_start = None,
+    coarse_step = 10, n_jobs = 1, chunk_size = None, incremental = False):
         """
         Calculates a petrophysical lithology and porosity model for
         conventional and unconventional reservoirs. For each depth, the
@@ -1056,6 +1441,58 @@ class Log(LASFile):
                 Buckles parameter for calculating irreducible water
                 saturation. If less than 0, it is calculated using a
                 correlation.
+            engine : str {'vector', 'loop'} (default 'vector')
+                'vector' builds a :class:`multimineral.MultimineralModel`
+                from the parameters and applies it, iterating on whole
+                depth arrays and solving the mineral inversion of every
+                depth in one call to :func:`multimineral.bounded_lstsq`.
+                'loop' is the original per-sample loop, kept as a
+                reference. See :meth:`multimineral.MultimineralModel.arrays`
+                for the agreement between the two.
+            max_iter : int (default 20)
+                Maximum number of iterations at each depth.
+            tol : float (default 1e-3)
+                Convergence tolerance on the sum of absolute changes in
+                bulk volumes between iterations.
+            retire_converged : bool (default True)
+                Vector engine only. Removes converged depths from the
+                working set so later iterations only evaluate unconverged
+                depths.
+            diagnostics : bool (default False)
+                If True, adds the solver diagnostics curves MM_ITER
+                (iterations at each depth), MM_SSE (sum of squared errors
+                of the modeled logs) and MM_APE (average percent error of
+                the modeled logs).
+            warm_start : {None, 'previous', 'coarse'} (default None)
+                Starting guesses at each depth. None uses the default
+                guesses at every depth. 'previous' starts each depth from
+                the converged state of the depth above it; the vector
+                engine does this for every second depth after solving the
+                others from the default guesses. 'coarse' (vector engine
+                only) pre-solves every coarse_step depth and starts the
+                remaining depths from the nearest coarse depth above.
+                Warm starts need fewer iterations on smooth intervals and
+                stop at a slightly different point within tol of the
+                fixed point. The vector engine solves warm started depths
+                that reach max_iter again from the default guesses. See
+                :meth:`multimineral.MultimineralModel.arrays` for the
+                accuracy and speed trade-off.
+            coarse_step : int (default 10)
+                Pre-solve spacing in samples for warm_start = 'coarse'.
+            n_jobs : int (default 1)
+                Vector engine only. Number of processes for evaluating
+                chunks of depths in parallel, -1 for every cpu. Input
+                curves are shared with the workers through shared memory
+                and results are written back into the output curves.
+            chunk_size : int (default None)
+                Depths per chunk when n_jobs > 1. Defaults to four chunks
+                per process.
+            incremental : bool (default False)
+                Vector engine only. Recomputes only the depths where input
+                curves were modified since the last run, as recorded by
+                :meth:`mark_dirty`, and only OIP or GIP where just BO, BG
+                or PORE_PRESS were modified. See
+                :meth:`multimineral.MultimineralModel.apply`.
 
             Raises
             ------
@@ -1073,6 +1510,13 @@ class Log(LASFile):
                 If no formation value factor is found, then ValueError is
                 raised to satisfy the calculation requirements.
 
+            ValueError
+                If engine is not 'vector' or 'loop'.
+
+            ValueError
+                If warm_start is not None, 'previous' or 'coarse', or is
+                'coarse' with the loop engine.
+
             References
             ----------
             **VCLAY**
@@ -1163,8 +1607,36 @@ class Log(LASFile):
             :meth:`petropy.Log.formation_multimineral_model`
                 uses multimineral_model accross formations
 
+            :class:`multimineral.MultimineralModel`
+                compiles the parameters once to apply the same model to
+                many logs
+
             """
 
+        ### model parameters for MultimineralModel ###
+        params = {k: v for k, v in locals().items()
+                  if k not in ('self', 'top', 'bottom', 'engine', 'max_iter',
+                               'tol', 'retire_converged', 'diagnostics',
+                               'warm_start', 'coarse_step', 'n_jobs',
+                               'chunk_size', 'incremental')}
+
+        if engine == 'vector':
+            model = MultimineralModel(**params)
+            model.apply(self, top = top, bottom = bottom,
+                        max_iter = max_iter, tol = tol,
+                        retire_converged = retire_converged,
+                        diagnostics = diagnostics, warm_start = warm_start,
+                        coarse_step = coarse_step, n_jobs = n_jobs,
+                        chunk_size = chunk_size, incremental = incremental)
+            return
+
+        if engine != 'loop':
+            raise ValueError('engine must be vector or loop, not %s.' % engine)
+
+        if warm_start not in (None, 'previous'):
+            raise ValueError('warm_start must be None or previous with '
+                             'the loop engine, not %s.' % warm_start)
+
         ### initialize required curves ###
         required_raw_curves = ['GR', 'NPHI', 'RHOB', 'ILD']
 
@@ -1224,153 +1696,137 @@ class Log(LASFile):
 
         ## check for existence of calculated curves ###
         ### add if not found ##
-        nulls = np.empty(len(self[0]))
-        nulls[:] = np.nan
-
         output_curves = [
-            {'mnemonic': 'PHIE', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'PHIE', 'unit': 'v/v',
             'descr': 'Effective Porosity'},
 
-            {'mnemonic': 'SW', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'SW', 'unit': 'v/v',
             'descr': 'Water Saturation'},
 
-            {'mnemonic': 'SHC', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'SHC', 'unit': 'v/v',
             'descr': 'Hydrocarbon Saturation'},
 
-            {'mnemonic': 'BVH', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVH', 'unit': 'v/v',
             'descr': 'Bulk Volume Hydrocarbon'},
 
-            {'mnemonic': 'BVW', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVW', 'unit': 'v/v',
             'descr': 'Bulk Volume Water'},
 
-            {'mnemonic': 'BVWI', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVWI', 'unit': 'v/v',
             'descr': 'Bulk Volume Water Irreducible'},
 
-            {'mnemonic': 'BVWF', 'data': np.copy(nulls), 'unit':
+            {'mnemonic': 'BVWF', 'unit':
             'v/v', 'descr': 'Bulk Volume Water Free'},
 
-            {'mnemonic': 'BVOM', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVOM', 'unit': 'v/v',
             'descr': 'Bulk Volume Fraction Organic Matter'},
 
-            {'mnemonic': 'BVCLAY', 'data': np.copy(nulls), 'unit':'v/v',
+            {'mnemonic': 'BVCLAY', 'unit':'v/v',
             'descr': 'Bulk Volume Fraction Clay'},
 
-            {'mnemonic': 'BVPYR', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVPYR', 'unit': 'v/v',
             'descr': 'Bulk Volume Fraction Pyrite'},
 
-            {'mnemonic': 'VOM', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VOM', 'unit': 'v/v',
             'descr': 'Matrix Volume Fraction Organic Matter'},
 
-            {'mnemonic': 'VCLAY', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VCLAY', 'unit': 'v/v',
             'descr': 'Matrix Volume Fraction Clay'},
 
-            {'mnemonic': 'VPYR', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VPYR', 'unit': 'v/v',
             'descr': 'Matrix Volume Fraction Pyrite'},
 
-            {'mnemonic': 'RHOM', 'data': np.copy(nulls), 'unit': 'g/cc',
+            {'mnemonic': 'RHOM', 'unit': 'g/cc',
             'descr': 'Matrix Density'},
 
-            {'mnemonic': 'TOC', 'data': np.copy(nulls), 'unit': 'wt/wt',
+            {'mnemonic': 'TOC', 'unit': 'wt/wt',
             'descr': 'Matrix Weight Fraction Organic Matter'},
 
-            {'mnemonic': 'WTCLAY', 'data':np.copy(nulls),'unit':'wt/wt',
+            {'mnemonic': 'WTCLAY', 'unit':'wt/wt',
             'descr': 'Matrix Weight Fraction Clay'},
 
-            {'mnemonic': 'WTPYR', 'data': np.copy(nulls),'unit':'wt/wt',
+            {'mnemonic': 'WTPYR', 'unit':'wt/wt',
             'descr': 'Matrix Weight Fraction Pyrite'},
         ]
-        for curve in output_curves:
-            if curve['mnemonic'] not in self.keys():
-                self.append_curve(curve['mnemonic'], curve['data'],
-                               unit = curve['unit'],
-                               descr = curve['descr'])
 
         qtz_curves = [
-            {'mnemonic': 'BVQTZ', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVQTZ', 'unit': 'v/v',
             'descr': 'Bulk Volume Fraction Quartz'},
-            {'mnemonic': 'VQTZ', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VQTZ', 'unit': 'v/v',
             'descr': 'Matrix Volume Fraction Quartz'},
-            {'mnemonic': 'WTQTZ', 'data': np.copy(nulls),'unit':'wt/wt',
+            {'mnemonic': 'WTQTZ', 'unit':'wt/wt',
             'descr': 'Matrix Weight Fraction Quartz'}
         ]
         if include_qtz:
-            for curve in qtz_curves:
-                if curve['mnemonic'] not in self.keys():
-                    self.append_curve(curve['mnemonic'], curve['data'],
-                                   unit = curve['unit'],
-                                   descr = curve['descr'])
+            output_curves += qtz_curves
 
         clc_curves = [
-            {'mnemonic': 'BVCLC', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVCLC', 'unit': 'v/v',
             'descr': 'Bulk Volume Fraction Calcite'},
-            {'mnemonic': 'VCLC', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VCLC', 'unit': 'v/v',
              'descr': 'Matrix Volume Fraction Calcite'},
-            {'mnemonic': 'WTCLC', 'data': np.copy(nulls),'unit':'wt/wt',
+            {'mnemonic': 'WTCLC', 'unit':'wt/wt',
             'descr': 'Matrix Weight Fraction Calcite'}
         ]
         if include_clc:
-            for curve in clc_curves:
-                if curve['mnemonic'] not in self.keys():
-                    self.append_curve(curve['mnemonic'], curve['data'],
-                                   unit = curve['unit'],
-                                   descr = curve['descr'])
+            output_curves += clc_curves
 
         dol_curves = [
-            {'mnemonic': 'BVDOL', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'BVDOL', 'unit': 'v/v',
             'descr': 'Bulk Volume Fraction Dolomite'},
-            {'mnemonic': 'VDOL', 'data': np.copy(nulls), 'unit': 'v/v',
+            {'mnemonic': 'VDOL', 'unit': 'v/v',
             'descr': 'Matrix Volume Fraction Dolomite'},
-            {'mnemonic': 'WTDOL', 'data': np.copy(nulls),'unit':'wt/wt',
+            {'mnemonic': 'WTDOL', 'unit':'wt/wt',
             'descr': 'Matrix Weight Fraction Dolomite'}
         ]
         if include_dol:
-            for curve in dol_curves:
-                if curve['mnemonic'] not in self.keys():
-                    self.append_curve(curve['mnemonic'], curve['data'],
-                                   unit = curve['unit'],
-                                   descr = curve['descr'])
+            output_curves += dol_curves
 
         min_x_curves = [
-            {'menmoic': 'V' + name_log_x, 'data': np.copy(nulls),
+            {'mnemonic': 'BV' + name_log_x,
             'unit': 'v/v', 'descr': 'Bulk Volume Fraction ' + name_x},
-            {'mnemonic': 'V' + name_log_x, 'data': np.copy(nulls),
+            {'mnemonic': 'V' + name_log_x,
             'unit': 'v/v', 'descr': 'Matrix Volume Fraction '+ name_x},
-            {'mnemonic': 'WT' + name_log_x, 'data': np.copy(nulls),
+            {'mnemonic': 'WT' + name_log_x,
             'unit': 'wt/wt', 'descr': 'Matrix Weight Fraction '+name_x}
         ]
         if include_x:
-            for curve in min_x_curves:
-                if curve['mnemonic'] not in self.keys():
-                    self.append_curve(curve['mnemonic'], curve['data'],
-                                   unit = curve['unit'],
-                                   descr = curve['descr'])
+            output_curves += min_x_curves
 
-        oil_curve = {'mnemonic': 'OIP', 'data': np.copy(nulls),
+        oil_curve = {'mnemonic': 'OIP',
                      'unit': 'Mmbbl / section', 'descr':'Oil in Place'}
         if hc_class == 'OIL':
-            if oil_curve['mnemonic'] not in self.keys():
-                self.append_curve(oil_curve['mnemonic'], oil_curve['data'],
-                               unit = oil_curve['unit'],
-                               descr = oil_curve['descr'])
+            output_curves += [oil_curve]
 
         gas_curves = [
-            {'mnemonic': 'GIP', 'data': np.copy(nulls),
+            {'mnemonic': 'GIP',
             'unit': 'BCF / section', 'descr': 'Gas in Place'},
-            {'mnemonic': 'GIP_FREE', 'data': np.copy(nulls),
+            {'mnemonic': 'GIP_FREE',
             'unit': 'BCF / section', 'descr': 'Free Gas in Place'},
-            {'mnemonic': 'GIP_ADS', 'data': np.copy(nulls),
+            {'mnemonic': 'GIP_ADS',
             'unit': 'BCF / section', 'descr': 'Adsorbed Gas in Place'}
         ]
         if hc_class == 'GAS':
-            for curve in gas_curves:
-                if curve['mnemonic'] not in self.keys():
-                    self.append_curve(curve['mnemonic'], curve['data'],
-                                   unit = curve['unit'],
-                                   descr = curve['descr'])
+            output_curves += gas_curves
+
+        diagnostics_curves = [
+            {'mnemonic': 'MM_ITER', 'unit': '',
+            'descr': 'Multimineral Iterations'},
+            {'mnemonic': 'MM_SSE', 'unit': '',
+            'descr': 'Multimineral Sum of Squared Errors'},
+            {'mnemonic': 'MM_APE', 'unit': '%',
+            'descr': 'Multimineral Average Percent Error'}
+        ]
+        if diagnostics:
+            output_curves += diagnostics_curves
+
+        self.append_curves(output_curves)
 
         ### calculations over depths ###
         depth_index = np.intersect1d(np.where(self[0] >= top)[0],
                                      np.where(self[0] < bottom)[0])
+
+        seed = None
         for i in depth_index:
 
             ### check for null values in data, skip if true ###
@@ -1399,9 +1855,15 @@ class Log(LASFile):
             bvclay_prev = 1
             bvpyr_prev = 1
 
+            ### converged state of the previous depth ###
+            if warm_start == 'previous' and seed is not None:
+                phie, rhom, rho_fl, nphi_fl, vom, bvqtz_prev, \
+                bvclc_prev, bvdol_prev, bvx_prev, phi_prev, bvom_prev, \
+                bvclay_prev, bvpyr_prev = seed
+
             diff = 1
             counter = 0
-            while diff > 1 * 10 ** -3 and counter < 20:
+            while diff > tol and counter < max_iter:
                 counter += 1
 
                 ### log curves without organics ###
@@ -1830,7 +2292,7 @@ class Log(LASFile):
             if include_dol:
                 self['VDOL'][i] = vdol
             if include_x:
-                self['V' + name_log_x] = vx
+                self['V' + name_log_x][i] = vx
 
             ### weight percent ###
             self['RHOM'][i] = rhom
@@ -1845,7 +2307,7 @@ class Log(LASFile):
             if include_dol:
                 self['WTDOL'][i] = wtdol
             if include_x:
-                self['WT' + name_log_x] = wtx
+                self['WT' + name_log_x][i] = wtx
 
             # find irreducible water if buckles_parameter is specified
             if buckles_parameter > 0:
@@ -1863,6 +2325,14 @@ class Log(LASFile):
                 self['GIP_ADS'][i] = gip_ads
                 self['GIP'][i] = gip
 
+            if diagnostics:
+                self['MM_ITER'][i] = counter
+                self['MM_SSE'][i] = sse
+                self['MM_APE'][i] = avg_percent_error
+
+            seed = (phie, rhom, rho_fl, nphi_fl, vom, bvqtz, bvclc,
+                    bvdol, bvx, phie, bvom, bvclay, bvpyr)
+
         ### find irreducible water saturation outside of loop ###
         ### since parameters depend on calculated values ###
 
@@ -1881,6 +2351,74 @@ class Log(LASFile):
             self['BVWF'][depth_index] = self['BVW'][depth_index] - \
                                         self['BVWI'][depth_index]
 
+    def multimineral_uncertainty(self, distributions = None, grid = None,
+                                 n_realizations = 100, seed = None, top = 0,
+                                 bottom = 100000, max_iter = 20, tol = 1e-3,
+                                 batch_size = None, **params):
+        """
+        Evaluates the multimineral model for many realizations of
+        uncertain parameters in batched passes, and adds P10, P50 and
+        P90 curves of PHIE, SW and OIP or GIP.
+
+            Parameters
+            ----------
+            distributions : dict (default None)
+                Distribution of each varied parameter, as
+                ('normal', mean, std), ('uniform', low, high),
+                ('triangular', low, mode, high) or an array of
+                n_realizations values. Keys are multimineral_model
+                parameters, or input curves such as RW which are scaled
+                by the sampled values.
+            grid : dict (default None)
+                Values of each varied parameter, evaluating every
+                combination. Give one of distributions or grid.
+            n_realizations : int (default 100)
+                Number of realizations sampled from distributions.
+            seed : int (default None)
+                Seed of the random number generator.
+            top : float (default 0)
+                Top depth to apply the model.
+            bottom : float (default 100000)
+                Bottom depth to apply the model.
+            max_iter : int (default 20)
+                Maximum number of iterations for each depth.
+            tol : float (default 1e-3)
+                Convergence tolerance of the iteration.
+            batch_size : int (default None)
+                Realizations evaluated in one pass.
+            **params
+                Fixed parameters of :meth:`multimineral_model`.
+
+            Returns
+            -------
+            dict
+                P10, P50 and P90 of total OIP or GIP between top and
+                bottom.
+
+            Example
+            -------
+            >>> log.fluid_properties()
+            >>> totals = log.multimineral_uncertainty(distributions = {
+            ...     'rho_clay': ('normal', 2.64, 0.03),
+            ...     'gr_clay': ('uniform', 300, 400),
+            ...     'm': ('triangular', 1.8, 2, 2.2),
+            ...     'n': ('normal', 2, 0.1),
+            ...     'RW': ('uniform', 0.8, 1.2)}, n_realizations = 500)
+
+            See Also
+            --------
+            :meth:`multimineral.MultimineralModel.uncertainty`
+                percentile convention and curve names
+
+        """
+
+        model = MultimineralModel(**params)
+        return model.uncertainty(self, distributions = distributions,
+                                 grid = grid, n_realizations = n_realizations,
+                                 seed = seed, top = top, bottom = bottom,
+                                 max_iter = max_iter, tol = tol,
+                                 batch_size = batch_size)
+
 
 
     def write(self, file_path, version = 2.0, wrap = False,
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Preconditioning
+
+Configurable version of :meth:`pet.Log.precondition`.
+
+A pipeline is a list of steps, each a dictionary with the key 'step' and
+its options, so preconditioning can be tuned per basin from a config
+file. Steps that change which curves the log has (alias, derive_density,
+keep) run on the log. Steps that change values (clip, round, smooth) run
+in place on one 2D block of the curves, which is written back to the log
+once, instead of creating new full length arrays for each step and
+curve. Consecutive clip steps are merged into one. Each run records the
+time of every step.
+
+"""
+
+
+import time
+import numpy as np
+from scipy.signal import filtfilt
+
+from aliases import load_alias_index
+
+
+# steps changing the curves of the log, and steps on the curve block
+LOG_STEPS = ['alias', 'derive_density', 'keep']
+BLOCK_STEPS = ['clip', 'round', 'smooth']
+
+STANDARD_CURVES = ['GR', 'NPHI', 'RHOB', 'ILD', 'PE', 'DT']
+
+# curves read by the default steps, for pet.Log(curves=LOAD_CURVES)
+LOAD_CURVES = STANDARD_CURVES + ['DPHI']
+
+
+def default_steps(drho_matrix=2.71, n=15, alias_path=None):
+    """
+    Steps of :meth:`pet.Log.precondition`.
+
+    """
+
+    return [
+        {'step': 'alias', 'path': alias_path},
+        {'step': 'derive_density', 'drho_matrix': drho_matrix},
+        {'step': 'keep', 'curves': STANDARD_CURVES},
+        {'step': 'clip', 'limits': {'*': (0.0001, None)}},
+        {'step': 'round', 'decimals': 4},
+        {'step': 'smooth', 'curves': ['DT', 'RHOB'], 'n': n},
+        {'step': 'round', 'curves': ['DT', 'RHOB'], 'decimals': 4},
+        {'step': 'clip', 'limits': {'DT': (None, 122), 'RHOB': (2.2, None)}}
+    ]
+
+
+def filter_segments(block, valid, n):
+    """
+    Zero phase moving average of the rows of block along depth. Each
+    contiguous run of valid samples is filtered on its own, and rows
+    with the same valid samples are filtered together. Invalid samples
+    are nan.
+
+    """
+
+    smoothed = np.empty_like(block)
+    smoothed[:] = np.nan
+
+    ### group rows by valid samples ###
+    groups = {}
+    for i, mask in enumerate(valid):
+        groups.setdefault(np.packbits(mask).tobytes(), []).append(i)
+
+    b = np.ones(n) / n
+    for rows in groups.values():
+        edges = np.flatnonzero(np.diff(np.concatenate(([0],
+            valid[rows[0]].astype(np.int8), [0]))))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            smoothed[rows, start:stop] = filtfilt(b, 1,
+                block[rows, start:stop], axis = -1, padtype = None)
+
+    return smoothed
+
+
+def clip_limits(mnemonics, limits):
+    """
+    Lower and upper limit arrays of mnemonics from {mnemonic: (min, max)},
+    where '*' applies to every curve and None is no limit.
+
+    """
+
+    lower = np.empty(len(mnemonics))
+    upper = np.empty(len(mnemonics))
+    lower[:] = -np.inf
+    upper[:] = np.inf
+
+    for i, mnemonic in enumerate(mnemonics):
+        for key in ('*', mnemonic):
+            if key not in limits:
+                continue
+            low, high = limits[key]
+            if low is not None:
+                lower[i] = max(lower[i], low)
+            if high is not None:
+                upper[i] = min(upper[i], high)
+
+    return lower, upper
+
+
+class PreconditionPipeline(object):
+    """
+    Compiled preconditioning steps.
+
+        Parameters
+        ----------
+        steps : list of dict
+            Steps to run in order. Each has the key 'step' and options:
+
+            alias
+                path : alias xml, default alias_folder/curve_alias.xml
+            derive_density
+                drho_matrix : matrix density to calculate RHOB from DPHI,
+                or DPHI from RHOB, when one of them is missing
+            keep
+                curves : curves to keep besides the index curve. Raises
+                ValueError if none of them are in the log.
+            clip
+                limits : {mnemonic: (min, max)}, '*' for every curve
+            round
+                decimals : decimals to round to
+                curves : curves to round, default every curve
+            smooth
+                curves : curves to filter
+                n : samples of the zero phase moving average
+                descr : curve description, with %s for the mnemonic,
+                default 'Lfilter applied to %s curve'
+
+        Attributes
+        ----------
+        timings : list of tuple
+            (step, seconds) of the last run, including the final 'write'
+            of the curve block to the log.
+
+        Example
+        -------
+        >>> import preconditioning
+        >>> steps = preconditioning.default_steps(drho_matrix = 2.65)
+        >>> steps[-1]['limits']['DT'] = (None, 140)
+        >>> pipeline = preconditioning.PreconditionPipeline(steps)
+        >>> log.precondition(pipeline = pipeline)
+        >>> pipeline.timings
+
+    """
+
+    def __init__(self, steps):
+        self.steps = []
+        for step in steps:
+            name = step.get('step')
+            if name not in LOG_STEPS + BLOCK_STEPS:
+                raise ValueError('Unknown precondition step: %s' % name)
+
+            ### merge consecutive clips, limits applied in order ###
+            if name == 'clip' and len(self.steps) > 0 and \
+               self.steps[-1]['step'] == 'clip':
+                self.steps[-1]['limits'].append(step['limits'])
+                continue
+
+            if name == 'clip':
+                step = {'step': 'clip', 'limits': [step['limits']]}
+
+            self.steps.append(dict(step))
+
+        self.timings = []
+
+    @classmethod
+    def default(cls, drho_matrix=2.71, n=15, alias_path=None):
+        """
+        Pipeline of :meth:`pet.Log.precondition`.
+
+        """
+
+        return cls(default_steps(drho_matrix = drho_matrix, n = n,
+                                 alias_path = alias_path))
+
+    def run(self, log):
+        """
+        Runs the steps on log.
+
+            Returns
+            -------
+            timings : list of tuple
+                (step, seconds) of each step.
+
+        """
+
+        self.timings = []
+        mnemonics = None
+        block = None
+
+        for step in self.steps:
+            name = step['step']
+            start = time.time()
+
+            if name in BLOCK_STEPS:
+                if block is None:
+                    mnemonics, block = self._read_block(log)
+                getattr(self, '_' + name)(log, mnemonics, block, step)
+            else:
+                if block is not None:
+                    self._write_block(log, mnemonics, block)
+                    mnemonics, block = None, None
+                getattr(self, '_' + name)(log, step)
+
+            self.timings.append((name, time.time() - start))
+
+        if block is not None:
+            start = time.time()
+            self._write_block(log, mnemonics, block)
+            self.timings.append(('write', time.time() - start))
+
+        return self.timings
+
+    @staticmethod
+    def _read_block(log):
+        """
+        Float curves of log, except the index, as rows of one array.
+
+        """
+
+        curves = [c for c in log.curves[1:] if c.data.dtype.kind == 'f']
+        block = np.empty((len(curves), len(log[0])))
+        for row, curve in zip(block, curves):
+            row[:] = curve.data
+
+        return [c.mnemonic for c in curves], block
+
+    @staticmethod
+    def _write_block(log, mnemonics, block):
+        for mnemonic, row in zip(mnemonics, block):
+            log[mnemonic] = row
+
+    @staticmethod
+    def _alias(log, step):
+        alias_index = load_alias_index(step.get('path'))
+        for primary_log, alias in alias_index.resolve(log.keys()):
+            log[primary_log] = log[alias]
+
+    @staticmethod
+    def _derive_density(log, step):
+        drho_matrix = step.get('drho_matrix', 2.71)
+
+        if 'RHOB' not in log.keys() and 'DPHI' in log.keys():
+            non_null_depth_mask = log.valid_mask(log['DPHI'])
+            non_null_depths = log['DPHI'][non_null_depth_mask]
+            calculated_rho = drho_matrix - (drho_matrix - 1) * non_null_depths
+            log.append_curves([{'mnemonic': 'RHOB', 'data': calculated_rho, 'unit': 'g/cc',
+                                'descr': 'Calculated bulk density from density porosity assuming rho matrix = %.2f' % drho_matrix}],
+                              depth_index = np.where(non_null_depth_mask)[0])
+
+        if 'RHOB' in log.keys() and 'DPHI' not in log.keys():
+            non_null_depth_mask = log.valid_mask(log['RHOB'])
+            non_null_depths = log['RHOB'][non_null_depth_mask]
+            calculated_phi = (drho_matrix - non_null_depths) / (drho_matrix - 1)
+            log.append_curves([{'mnemonic': 'DPHI', 'data': calculated_phi, 'unit': 'v/v',
+                                'descr': 'Calculated density porosity from bulk density assuming rho matrix = %.2f' % drho_matrix}],
+                              depth_index = np.where(non_null_depth_mask)[0])
+
+    @staticmethod
+    def _keep(log, step):
+        curves = step['curves']
+        log.keep_curves(list(curves) + [log.curves[0].mnemonic])
+
+        remaining_curves = [curve for curve in log.keys() if curve in curves]
+        if not remaining_curves:
+            raise ValueError('None of the curves from the standard_curves list are present in the data.')
+
+    @staticmethod
+    def _clip(log, mnemonics, block, step):
+        lower = np.empty(len(mnemonics))
+        upper = np.empty(len(mnemonics))
+        lower[:] = -np.inf
+        upper[:] = np.inf
+        ### clipping to low, high after lower, upper is one clip ###
+        for limits in step['limits']:
+            low, high = clip_limits(mnemonics, limits)
+            lower = np.clip(lower, low, high)
+            upper = np.clip(upper, low, high)
+
+        rows = np.flatnonzero(np.isfinite(lower) | np.isfinite(upper))
+        if len(rows) == len(mnemonics):
+            np.clip(block, lower[:, None], upper[:, None], out = block)
+        elif len(rows) > 0:
+            block[rows] = np.clip(block[rows], lower[rows, None],
+                                  upper[rows, None])
+
+    @staticmethod
+    def _round(log, mnemonics, block, step):
+        decimals = step.get('decimals', 4)
+        curves = step.get('curves')
+        if curves is None:
+            np.round(block, decimals, out = block)
+            return
+
+        rows = [i for i, m in enumerate(mnemonics) if m in curves]
+        if len(rows) > 0:
+            block[rows] = np.round(block[rows], decimals)
+
+    @staticmethod
+    def _smooth(log, mnemonics, block, step):
+        rows = [i for i, m in enumerate(mnemonics) if m in step['curves']]
+        if len(rows) == 0:
+            return
+
+        block[rows] = filter_segments(block[rows],
+                                      log.valid_mask(block[rows]),
+                                      step.get('n', 15))
+
+        descr = step.get('descr', 'Lfilter applied to %s curve')
+        for i in rows:
+            log.curvesdict.get(mnemonics[i]).descr = descr % mnemonics[i]
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+QC
+
+Early quality control of raw logs, to reject wells before running
+:meth:`pet.Log.precondition`, :meth:`pet.Log.fluid_properties` and
+:meth:`pet.Log.multimineral_model` on them.
+
+Null fraction, range violations, spikes and depth coverage of every
+float curve are calculated together on one 2D block of the curves.
+Curves are matched to the primary mnemonics of the curve alias xml the
+same way as :meth:`pet.Log.precondition`, so a raw vendor log is checked
+against the curves it will have after preconditioning.
+
+"""
+
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from aliases import load_alias_index
+
+
+# valid ranges of primary curves
+DEFAULT_RANGES = {
+    'GR': (0, 1000),
+    'NPHI': (-0.15, 1),
+    'RHOB': (1, 3.2),
+    'ILD': (0.01, 100000),
+    'PE': (0, 20),
+    'DT': (30, 200)
+}
+
+# primary curves needed by each processing step
+STEP_CURVES = {
+    'precondition': [],
+    'fluid_properties': [],
+    'multimineral_model': ['GR', 'NPHI', 'RHOB', 'ILD']
+}
+
+DEFAULT_THRESHOLDS = {
+    'required': ['GR', 'NPHI', 'RHOB', 'ILD'],
+    'max_null_fraction': 0.5,
+    'max_range_fraction': 0.1,
+    'max_spike_fraction': 0.05,
+    'min_coverage': 0.5,
+    'spike_factor': 10,
+    'ranges': DEFAULT_RANGES
+}
+
+
+class QCResult(object):
+    """
+    Result of :func:`check_log`.
+
+        Attributes
+        ----------
+        curves : pandas.DataFrame
+            One row per float curve, indexed by mnemonic, with columns
+            primary, null_fraction, range_fraction, spike_fraction,
+            coverage and constant.
+        passed : bool
+            True if every required curve passed the thresholds.
+        reasons : list of str
+            Failed checks.
+
+    """
+
+    def __init__(self, curves, reasons):
+        self.curves = curves
+        self.reasons = reasons
+        self.passed = len(reasons) == 0
+
+    def __repr__(self):
+        if self.passed:
+            return 'QCResult(passed)'
+        return 'QCResult(failed: %s)' % '; '.join(self.reasons)
+
+
+def required_curves(steps, curves=None):
+    """
+    Required curves of :func:`check_log` for a run of processing steps,
+    so wells are only rejected for curves the run uses.
+
+        Parameters
+        ----------
+        steps : list of str
+            Steps of the run, keys of :data:`STEP_CURVES`.
+        curves : list (default None)
+            Other curves the run needs, e.g. the curves clustered by
+            :func:`electrofacies.electrofacies`.
+
+        Returns
+        -------
+        required : list
+            Primary mnemonics, without repeats.
+
+        Example
+        -------
+        >>> required = qc.required_curves(['precondition',
+        ...                                'multimineral_model'])
+        >>> result = log.qc(thresholds = {'required': required})
+
+    """
+
+    unknown = [step for step in steps if step not in STEP_CURVES]
+    if len(unknown) > 0:
+        raise ValueError('Unknown processing steps: %s' % ', '.join(unknown))
+
+    required = []
+    for step in steps:
+        required += STEP_CURVES[step]
+    if curves is not None:
+        required += list(curves)
+
+    return list(dict.fromkeys(required))
+
+
+def _sources(mnemonics, alias_path):
+    """
+    Curve of each primary mnemonic after aliasing, as in
+    :meth:`pet.Log.precondition`.
+
+    """
+
+    return load_alias_index(alias_path).sources(mnemonics)
+
+
+def curve_metrics(block, depths, null, ranges, spike_factor):
+    """
+    Quality metrics of the rows of block.
+
+        Parameters
+        ----------
+        block : 2D array
+            Curves as rows.
+        depths : array
+            Depth of each column.
+        null : float or None
+            NULL value, counted as null with nan.
+        ranges : 2D array
+            (min, max) of each row, nan for no limit.
+        spike_factor : float
+            A sample is a spike when it differs from both neighbours by
+            more than spike_factor times the median absolute difference
+            of the curve, in opposite directions.
+
+        Returns
+        -------
+        metrics : dict of arrays
+            null_fraction, range_fraction, spike_fraction, coverage and
+            constant of each row.
+
+    """
+
+    n = block.shape[1]
+    if n == 0:
+        zeros = np.zeros(len(block))
+        return {'null_fraction': zeros + 1, 'range_fraction': zeros,
+                'spike_fraction': zeros, 'coverage': zeros,
+                'constant': zeros > 0}
+
+    valid = np.isfinite(block)
+    if null is not None:
+        valid &= block != null
+    n_valid = valid.sum(axis = 1)
+    values = np.where(valid, block, np.nan)
+
+    with np.errstate(invalid = 'ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        out_of_range = (values < ranges[:, :1]) | (values > ranges[:, 1:])
+        diff = np.diff(values, axis = 1)
+        step = np.nanmedian(np.abs(diff), axis = 1)
+        limit = spike_factor * np.where(step > 0, step, np.nan)[:, None]
+        spikes = (np.abs(diff[:, :-1]) > limit) & \
+                 (np.abs(diff[:, 1:]) > limit) & \
+                 (np.sign(diff[:, :-1]) != np.sign(diff[:, 1:]))
+        spread = np.nanmax(values, axis = 1) - np.nanmin(values, axis = 1)
+
+    ### span of valid samples over the span of the log ###
+    first = np.argmax(valid, axis = 1)
+    last = n - 1 - np.argmax(valid[:, ::-1], axis = 1)
+    span = abs(depths[-1] - depths[0])
+    coverage = np.where(n_valid > 0,
+                        np.abs(depths[last] - depths[first]) / span \
+                        if span > 0 else 1.0, 0.0)
+
+    fraction = np.maximum(n_valid, 1)
+    return {
+        'null_fraction': 1 - n_valid / max(n, 1),
+        'range_fraction': out_of_range.sum(axis = 1) / fraction,
+        'spike_fraction': spikes.sum(axis = 1) / fraction,
+        'coverage': coverage,
+        'constant': (n_valid > 0) & ~(spread > 0)
+    }
+
+
+def _dphi_range(rho_range, drho_matrix):
+    """
+    Range of density porosity with bulk density in rho_range, as
+    converted by the derive_density step of preconditioning.
+
+    """
+
+    low, high = rho_range
+    to_phi = lambda rho: (drho_matrix - rho) / (drho_matrix - 1)
+    return (None if high is None else to_phi(high),
+            None if low is None else to_phi(low))
+
+
+def check_log(log, thresholds=None, top=None, bottom=None,
+              alias_path=None, drho_matrix=2.71):
+    """
+    Quality control of a log before processing.
+
+        Parameters
+        ----------
+        log : pet.Log
+            Log to check, raw or preconditioned.
+        thresholds : dict (default None)
+            Updates of :data:`DEFAULT_THRESHOLDS`:
+
+            required : primary curves that must be present and pass,
+            see :func:`required_curves`
+            max_null_fraction : maximum fraction of null samples
+            max_range_fraction : maximum fraction of valid samples out
+            of range
+            max_spike_fraction : maximum fraction of spikes
+            min_coverage : minimum depth span of valid samples over the
+            span of the checked depths
+            spike_factor : spike size in median absolute differences
+            ranges : {primary: (min, max)} valid range of curves
+        top : float (default None)
+            Top depth of the zone to check, default top of the log.
+        bottom : float (default None)
+            Bottom depth of the zone to check, default bottom of the log.
+        alias_path : str (default None)
+            Alias xml to match raw curves to primary mnemonics.
+        drho_matrix : float (default 2.71)
+            Matrix density preconditioning derives RHOB from DPHI with.
+            A log without RHOB is checked on DPHI for the required RHOB,
+            with the RHOB range converted to density porosity.
+
+        Returns
+        -------
+        result : QCResult
+
+        Example
+        -------
+        >>> import qc
+        >>> result = qc.check_log(log, {'max_null_fraction': 0.3})
+        >>> if not result.passed:
+        ...     print(result.reasons)
+
+    """
+
+    t = dict(DEFAULT_THRESHOLDS)
+    if thresholds is not None:
+        t.update(thresholds)
+
+    depths = log[0]
+    zone = np.ones(len(depths), dtype = bool)
+    if top is not None:
+        zone &= depths >= top
+    if bottom is not None:
+        zone &= depths < bottom
+
+    limits = dict(t['ranges'])
+    if 'RHOB' in limits and 'DPHI' not in limits:
+        limits['DPHI'] = _dphi_range(limits['RHOB'], drho_matrix)
+
+    mnemonics = log.keys()
+    sources = _sources(mnemonics, alias_path)
+    ### primary of each curve, preferring primaries with a range ###
+    primaries = {}
+    for primary, source in sources.items():
+        if primary == source or source in limits:
+            continue
+        if source not in primaries or \
+           (primary in limits and primaries[source] not in limits):
+            primaries[source] = primary
+
+    curves = [c for c in log.curves[1:] if c.data.dtype.kind == 'f']
+    names = [c.mnemonic for c in curves]
+
+    try:
+        null = float(log.well.NULL.value)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        null = None
+
+    block = np.empty((len(curves), np.count_nonzero(zone)))
+    for row, curve in zip(block, curves):
+        row[:] = curve.data[zone]
+
+    ranges = np.empty((len(curves), 2))
+    ranges[:] = np.nan
+    for i, name in enumerate(names):
+        low, high = limits.get(primaries.get(name, name), (None, None))
+        ranges[i] = [np.nan if low is None else low,
+                     np.nan if high is None else high]
+
+    metrics = curve_metrics(block, depths[zone], null, ranges,
+                            t['spike_factor'])
+
+    table = pd.DataFrame(metrics, index = pd.Index(names, name = 'mnemonic'))
+    table.insert(0, 'primary', [primaries.get(n, n) for n in names])
+
+    ### thresholds on required curves ###
+    reasons = []
+    for primary in t['required']:
+        source = sources.get(primary)
+        missing = source is None or source not in table.index
+        if missing and primary == 'RHOB':
+            ### preconditioning derives RHOB from DPHI ###
+            source = sources.get('DPHI')
+            missing = source is None or source not in table.index
+        if missing:
+            reasons.append('%s missing' % primary)
+            continue
+
+        row = table.loc[source]
+        if row['null_fraction'] > t['max_null_fraction']:
+            reasons.append('%s null fraction %.2f' % (primary,
+                                                      row['null_fraction']))
+        if row['constant']:
+            reasons.append('%s constant' % primary)
+        if row['range_fraction'] > t['max_range_fraction']:
+            reasons.append('%s out of range fraction %.2f' % \
+                           (primary, row['range_fraction']))
+        if row['spike_fraction'] > t['max_spike_fraction']:
+            reasons.append('%s spike fraction %.2f' % \
+                           (primary, row['spike_fraction']))
+        if row['coverage'] < t['min_coverage']:
+            reasons.append('%s coverage %.2f' % (primary, row['coverage']))
+
+    return QCResult(table, reasons)